@@ -182,7 +182,7 @@ const PredictionDetail = () => {
                 </Box>
                 
                 <Typography variant="body2" color="text.secondary" sx={{ mt: 2 }}>
-                  File: {prediction.imageName}
+                  File: {prediction.fileName || prediction.imageName}
                 </Typography>
               </CardContent>
             </Card>
@@ -414,7 +414,7 @@ const DashboardOverview = () => {
                   Image:
                 </Typography>
                 <Typography variant="body1">
-                  {statistics.mostRecent.imageName}
+                  {statistics.mostRecent.fileName || statistics.mostRecent.imageName}
                 </Typography>
               </Box>
             </Grid>
@@ -562,7 +562,7 @@ const PredictionHistory = () => {
                   {predictions.map((prediction) => (
                     <TableRow key={prediction.id}>
                       <TableCell component="th" scope="row">
-                        {prediction.imageName}
+                        {prediction.fileName || prediction.imageName}
                       </TableCell>
                       <TableCell align="center">
                         <Chip
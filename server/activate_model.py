@@ -0,0 +1,31 @@
+import sys
+from dotenv import load_dotenv
+from utils.model_registry import model_registry
+
+load_dotenv()
+
+def list_versions():
+    """Print the model versions on disk, marking the active one"""
+    active = model_registry.resolve_active_version()
+    versions = model_registry.list_versions()
+    if not versions:
+        print(f"No models found under {model_registry.model_dir}")
+        return
+    for version, path in versions.items():
+        marker = '*' if version == active else ' '
+        print(f"{marker} {version}\t{path}")
+
+def activate(version):
+    """Point the running servers at a new version (they swap it in without a restart)"""
+    model_registry.set_active_pointer(version)
+    print(f"Active model version set to {version}; servers will load and swap it in on their next poll")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        try:
+            activate(sys.argv[1])
+        except FileNotFoundError as e:
+            print(str(e))
+            sys.exit(1)
+    else:
+        list_versions()
@@ -1,21 +1,63 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Request, request, jsonify, send_from_directory
 from flask_cors import CORS
 import os
 from dotenv import load_dotenv
 import pymongo
-from routes.auth_routes import auth_bp, cleanup_expired_otps, cleanup_expired_temp_users
-from routes.predict_routes import predict_bp
-from routes.dashboard_routes import dashboard_bp
+from utils.tuning_profile import apply_tuning_profile
+
+# Apply the machine's tuning profile (see autotune.py) before any module reads its settings
+tuning_settings = apply_tuning_profile()
+
+# Fork the image preprocess workers before the routes import TensorFlow (through the model
+# registry) and before any background thread exists; a forked worker inherits both
+from utils.preprocess_pool import preprocess_pool
+preprocess_pool.start()
+
+from routes.auth_routes import auth_bp, cleanup_expired_otps, cleanup_expired_temp_users, ensure_auth_indexes
+from routes.predict_routes import predict_bp, prediction_writer
+from routes.dashboard_routes import dashboard_bp, ensure_dashboard_indexes
+from routes.job_routes import jobs_bp, recover_pending_jobs
+from routes.debug_routes import debug_bp
+from routes.study_routes import studies_bp, ensure_study_indexes, MAX_STUDY_BYTES, STUDIES_PATH
+from utils.logger import get_logger, init_request_logging, sampled
+from utils.upload_intake import MAX_UPLOAD_BYTES
+from utils.inference_scheduler import inference_scheduler
+from utils.model_registry import model_registry
+from utils.rollups import rollup_writer
+from utils.memory_diagnostics import memory_watchdog
+from utils.saliency import recover_pending_saliency, move_public_overlays
+from utils.retention import run_maintenance, MAINTENANCE_ENABLED, MAINTENANCE_INTERVAL_MINUTES
+import sys
 import time
+import signal
 import datetime
 import threading
 
 # Load environment variables
 load_dotenv()
 
+logger = get_logger(__name__)
+
+if tuning_settings:
+    logger.info("Applied tuning profile", extra={"fields": tuning_settings})
+
+class UploadLimitedRequest(Request):
+    """Study uploads carry many slices, so they get a larger body limit than single images"""
+
+    @property
+    def max_content_length(self):
+        if self.path.rstrip('/') == STUDIES_PATH:
+            return MAX_STUDY_BYTES
+        return super().max_content_length
+
 # Initialize Flask app
 app = Flask(__name__)
+app.request_class = UploadLimitedRequest
 CORS(app, supports_credentials=True, resources={r"/*": {"origins": "*"}})
+init_request_logging(app)
+
+# Bound the request body; multipart overhead gets a little headroom over the image limit
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES + 64 * 1024
 
 # MongoDB connection with retry
 mongo_uri = os.getenv('MONGO_URI', 'mongodb://localhost:27017')
@@ -29,24 +71,24 @@ def connect_to_mongodb():
     
     while retry_count < max_retries:
         try:
-            print(f"Attempting to connect to MongoDB at {mongo_uri}")
+            logger.info("Attempting to connect to MongoDB")
             mongo_client = pymongo.MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)
             # Force a connection to verify it works
             mongo_client.server_info()
             db = mongo_client['brain_tumor_detection']
-            print("Successfully connected to MongoDB")
+            logger.info("Successfully connected to MongoDB")
             return True
         except pymongo.errors.ServerSelectionTimeoutError as e:
             retry_count += 1
-            print(f"MongoDB connection attempt {retry_count} failed: {str(e)}")
+            logger.warning(f"MongoDB connection attempt {retry_count} failed: {str(e)}")
             if retry_count < max_retries:
-                print(f"Retrying in 2 seconds...")
+                logger.info("Retrying in 2 seconds...")
                 time.sleep(2)
             else:
-                print("All MongoDB connection attempts failed. Starting without database.")
+                logger.error("All MongoDB connection attempts failed. Starting without database.")
                 return False
         except Exception as e:
-            print(f"Unexpected error connecting to MongoDB: {str(e)}")
+            logger.exception(f"Unexpected error connecting to MongoDB: {str(e)}")
             return False
 
 # Try to connect to MongoDB
@@ -66,12 +108,12 @@ def start_otp_cleanup_scheduler():
                 cleanup_expired_otps()
                 time.sleep(60)  # 60 seconds = 1 minute
             except Exception as e:
-                print(f"Error in OTP cleanup task: {str(e)}")
+                logger.exception(f"Error in OTP cleanup task: {str(e)}")
                 time.sleep(60)  # Continue despite errors
     
     cleanup_thread = threading.Thread(target=cleanup_task, daemon=True)
     cleanup_thread.start()
-    print("Started background OTP cleanup task")
+    logger.info("Started background OTP cleanup task")
 
 # Set up background task for temporary users cleanup
 def start_temp_users_cleanup_scheduler():
@@ -83,27 +125,89 @@ def start_temp_users_cleanup_scheduler():
                 cleanup_expired_temp_users()
                 time.sleep(15 * 60)  # 15 minutes
             except Exception as e:
-                print(f"Error in temporary users cleanup task: {str(e)}")
+                logger.exception(f"Error in temporary users cleanup task: {str(e)}")
                 time.sleep(15 * 60)  # Continue despite errors
     
     cleanup_thread = threading.Thread(target=cleanup_task, daemon=True)
     cleanup_thread.start()
-    print("Started background temporary users cleanup task")
+    logger.info("Started background temporary users cleanup task")
+
+# Set up background task for retention and upload compaction
+def start_maintenance_scheduler():
+    """Start a background thread that archives old anonymous predictions and compacts uploads"""
+    def maintenance_task():
+        while True:
+            # Wait first so startup is not competing with a maintenance run
+            time.sleep(MAINTENANCE_INTERVAL_MINUTES * 60)
+            try:
+                results = run_maintenance(db)
+                if results:
+                    logger.info("Maintenance run complete", extra={"fields": results})
+            except Exception as e:
+                logger.exception(f"Error in maintenance task: {str(e)}")
+    
+    maintenance_thread = threading.Thread(target=maintenance_task, daemon=True)
+    maintenance_thread.start()
+    logger.info("Started background maintenance task")
+
+# Replay prediction records spilled by an earlier run now rather than on the first prediction
+prediction_writer.start()
 
 # Start the cleanup schedulers
 start_otp_cleanup_scheduler()
 start_temp_users_cleanup_scheduler()
+if mongo_client and MAINTENANCE_ENABLED:
+    start_maintenance_scheduler()
+
+# Load and warm up the model before traffic arrives, then hot-swap when model/ACTIVE_VERSION changes
+model_registry.preload_in_background()
+model_registry.start_watcher()
+
+# Recycle this worker before memory growth from long-running inference reaches the OOM killer
+memory_watchdog.on_recycle(rollup_writer.flush)
+memory_watchdog.on_recycle(prediction_writer.close)
+memory_watchdog.start(inference_scheduler)
+
+# Resume prediction jobs interrupted by a restart
+if mongo_client:
+    try:
+        recover_pending_jobs()
+    except Exception as e:
+        logger.exception(f"Error recovering prediction jobs: {str(e)}")
+    try:
+        recover_pending_saliency(db['predictions'])
+        move_public_overlays(db['predictions'], upload_dir)
+    except Exception as e:
+        logger.exception(f"Error recovering saliency requests: {str(e)}")
+    try:
+        ensure_auth_indexes()
+    except Exception as e:
+        logger.exception(f"Error creating auth indexes: {str(e)}")
+    try:
+        ensure_dashboard_indexes()
+        ensure_study_indexes()
+    except Exception as e:
+        logger.exception(f"Error creating dashboard indexes: {str(e)}")
 
 # Register blueprints
 app.register_blueprint(auth_bp, url_prefix='/api/auth')
 app.register_blueprint(predict_bp, url_prefix='/api/predict')
+app.register_blueprint(jobs_bp, url_prefix='/api/predict/jobs')
+app.register_blueprint(studies_bp, url_prefix=STUDIES_PATH)
 app.register_blueprint(dashboard_bp, url_prefix='/api/dashboard')
+app.register_blueprint(debug_bp, url_prefix='/api/debug')
 
 # Serve upload files
-@app.route('/uploads/<path:filename>')
+@app.route('/uploads/<filename>')
 def serve_upload(filename):
+    # Uploads are flat files; nothing in a subdirectory is public
     return send_from_directory(upload_dir, filename)
 
+@app.errorhandler(413)
+def request_too_large(e):
+    limit = MAX_STUDY_BYTES if request.path.rstrip('/') == STUDIES_PATH else MAX_UPLOAD_BYTES
+    return jsonify({"error": f"Upload exceeds maximum size of {limit // (1024 * 1024)} MB"}), 413
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     db_status = "connected" if mongo_client else "disconnected"
@@ -112,19 +216,56 @@ def health_check():
         "database": db_status
     }), 200
 
+@app.route('/api/health/live', methods=['GET'])
+def liveness_check():
+    """The process is up and serving requests"""
+    return jsonify({"status": "alive"}), 200
+
+@app.route('/api/health/ready', methods=['GET'])
+def readiness_check():
+    """Ready to take prediction traffic: model loaded and warmed up, database reachable"""
+    model_readiness = model_registry.readiness()
+    # A worker draining for a memory recycle stops taking new traffic
+    ready = model_readiness["ready"] and mongo_client is not None and not memory_watchdog.draining
+    return jsonify({
+        "status": "ready" if ready else "not ready",
+        "database": "connected" if mongo_client else "disconnected",
+        "model": model_readiness,
+        "draining": memory_watchdog.draining
+    }), 200 if ready else 503
+
+@app.route('/api/health/inference', methods=['GET'])
+def inference_queue_stats():
+    """Per-class inference queue depth and wait times"""
+    return jsonify(inference_scheduler.stats()), 200
+
+@app.route('/api/health/preprocess', methods=['GET'])
+def preprocess_status():
+    """Image decode workers: mode, throughput and inline fallbacks"""
+    return jsonify(preprocess_pool.status()), 200
+
+@app.route('/api/health/model', methods=['GET'])
+def model_status():
+    """Active model version, versions on disk and shadow comparison stats"""
+    return jsonify(model_registry.status()), 200
+
+@app.route('/api/health/persistence', methods=['GET'])
+def persistence_status():
+    """Write-behind buffer depth, flush and spill counters for prediction records"""
+    return jsonify(prediction_writer.status()), 200
+
 # Record visitor
 @app.route('/api/record-visitor', methods=['POST'])
 def record_visitor():
     if not mongo_client:
-        print("Failed to record visitor: Database connection not available")
+        logger.error("Failed to record visitor: Database connection not available")
         return jsonify({"error": "Database connection not available"}), 500
     
     try:
-        print("Processing visitor request...")
         # Get or create visitors collection
         visitors_collection = db.get_collection('visitors')
         if visitors_collection is None:
-            print("Creating visitors collection")
+            logger.info("Creating visitors collection")
             db.create_collection('visitors')
             visitors_collection = db['visitors']
         
@@ -134,13 +275,13 @@ def record_visitor():
         ip_address = request.remote_addr
         session_id = data.get("sessionId")
         
-        print(f"Visitor data: IP={ip_address}, SessionID={session_id}, UserAgent={user_agent[:50]}...")
+        if sampled('visitor'):
+            logger.debug("Visitor request", extra={"fields": {"sessionId": session_id, "userAgent": user_agent[:50]}})
         
         # Check if this session has already been recorded (to prevent duplicates)
         if session_id:
             existing_visit = visitors_collection.find_one({"sessionId": session_id})
             if existing_visit:
-                print(f"Session {session_id} already recorded, skipping")
                 total_visitors = visitors_collection.count_documents({})
                 return jsonify({"success": True, "duplicate": True, "totalVisitors": total_visitors}), 200
         
@@ -156,17 +297,25 @@ def record_visitor():
         
         # Verify the visitor was recorded
         if result.inserted_id:
-            print(f"Visitor recorded successfully. ID: {result.inserted_id}")
+            rollup_writer.record({"visitors": 1}, visitor_data["timestamp"])
             # Count total visitors after adding this one
             total_visitors = visitors_collection.count_documents({})
-            print(f"Total visitors count: {total_visitors}")
+            if sampled('visitor'):
+                logger.info("Visitor recorded", extra={"fields": {"visitorId": str(result.inserted_id), "totalVisitors": total_visitors}})
             return jsonify({"success": True, "totalVisitors": total_visitors}), 200
         else:
-            print("Failed to insert visitor document")
+            logger.error("Failed to insert visitor document")
             return jsonify({"error": "Failed to record visitor"}), 500
     except Exception as e:
-        print(f"Error recording visitor: {str(e)}")
+        logger.exception(f"Error recording visitor: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000, host='0.0.0.0') 
\ No newline at end of file
+    # Exit through atexit on SIGTERM so buffered prediction records and rollups are flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if memory_watchdog.threshold_mb > 0:
+        logger.warning("MEMORY_RECYCLE_RSS_MB is set but nothing restarts the development server "
+                       "once it recycles; run under a process manager such as gunicorn")
+    # The reloader re-runs this module in a child process, which would preload the model and
+    # start the preprocess workers and background threads a second time
+    app.run(debug=True, port=5000, host='0.0.0.0', use_reloader=False)
\ No newline at end of file
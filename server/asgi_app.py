@@ -0,0 +1,91 @@
+"""
+Async serving mode
+
+Auth and dashboard requests, and job event streams, are served by async
+Quart routes (motor for MongoDB, httpx for the OTP service), so one process
+can hold thousands of them open while they wait on I/O. Every other path
+(prediction, creating and polling jobs, studies, health, uploads) goes to
+the regular Flask app, which runs in its own pool of ASYNC_WSGI_WORKERS
+threads so CPU-heavy inference never blocks the event loop. Responses are
+the same as with app.py alone, except that job events stream on one
+connection instead of one status per connection.
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+    python asgi_app.py
+"""
+import os
+import re
+from dotenv import load_dotenv
+from a2wsgi import WSGIMiddleware
+from quart import Quart
+from quart_cors import cors
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import RequestRedirect
+from app import app as flask_app
+from routes.async_auth_routes import auth_async_bp
+from routes.async_dashboard_routes import dashboard_async_bp
+from routes.async_job_routes import jobs_async_bp
+from utils.email_service import close_async_client
+from utils.logger import get_logger, init_request_logging
+
+load_dotenv()
+
+logger = get_logger(__name__)
+
+# Threads running Flask requests (prediction etc.); each blocks for the whole request
+ASYNC_WSGI_WORKERS = int(os.getenv('ASYNC_WSGI_WORKERS', '16'))
+
+# Async app with the same CORS policy, body limit and request ids as app.py
+async_app = Quart(__name__)
+
+@async_app.after_request
+async def drop_empty_expose_headers(response):
+    # quart-cors sends an empty Access-Control-Expose-Headers where flask-cors sends none
+    if not response.headers.get('Access-Control-Expose-Headers', '').strip('"'):
+        response.headers.pop('Access-Control-Expose-Headers', None)
+    return response
+
+# Registered after the hook above so its headers are in place when the hook runs
+async_app = cors(async_app, allow_origin=re.compile(r".*"), allow_credentials=True)
+async_app.config['MAX_CONTENT_LENGTH'] = flask_app.config['MAX_CONTENT_LENGTH']
+init_request_logging(async_app)
+
+async_app.register_blueprint(auth_async_bp, url_prefix='/api/auth')
+async_app.register_blueprint(dashboard_async_bp, url_prefix='/api/dashboard')
+async_app.register_blueprint(jobs_async_bp, url_prefix='/api/predict/jobs')
+
+@async_app.after_serving
+async def close_http_client():
+    await close_async_client()
+
+
+class RouteDispatcher:
+    """ASGI app that sends requests the async app has a route for to it, and everything else to Flask"""
+
+    def __init__(self, async_app, wsgi_app, workers=ASYNC_WSGI_WORKERS):
+        self.async_app = async_app
+        self.wsgi_app = WSGIMiddleware(wsgi_app, workers=workers)
+        self.adapter = async_app.url_map.bind('')
+
+    def handled_async(self, scope):
+        try:
+            self.adapter.match(scope['path'], method=scope['method'])
+            return True
+        except (HTTPException, RequestRedirect):
+            # Not found, wrong method or a trailing-slash redirect: Flask answers exactly as before
+            return False
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and not self.handled_async(scope):
+            await self.wsgi_app(scope, receive, send)
+        else:
+            # Lifespan events go to Quart (startup/shutdown hooks)
+            await self.async_app(scope, receive, send)
+
+
+app = RouteDispatcher(async_app, flask_app)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host='0.0.0.0', port=5000)
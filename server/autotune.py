@@ -0,0 +1,201 @@
+"""
+Tune TensorFlow thread counts, inference concurrency and batch size for this machine
+
+Each combination runs in a fresh subprocess (TF thread pools can only be
+set before the runtime starts) against the active model from the model
+registry, or with --stub against a randomly initialized model with the
+same VGG19 architecture and input shape. The best settings are written to
+a profile the server applies at startup:
+
+    python autotune.py                       # writes tuning_profile.json
+    python autotune.py --stub --max-p99-ms 800 --duration 15
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import datetime
+import threading
+import subprocess
+import numpy as np
+from dotenv import load_dotenv
+from utils.tuning_profile import TUNING_PROFILE_PATH
+
+load_dotenv()
+
+INPUT_SHAPE = (240, 240, 3)
+
+
+def parse_int_list(value):
+    return sorted({int(part) for part in value.split(',') if part.strip()})
+
+
+def build_stub_model():
+    """VGG19 with a binary head and random weights: same compute cost as the real model"""
+    import tensorflow as tf
+
+    base = tf.keras.applications.VGG19(weights=None, include_top=False, input_shape=INPUT_SHAPE)
+    model = tf.keras.Sequential([
+        base,
+        tf.keras.layers.Flatten(),
+        tf.keras.layers.Dense(1, activation='sigmoid')
+    ])
+    return model
+
+
+def run_trial(config):
+    """Measure one configuration in this process; returns a result dict"""
+    from utils.model_registry import model_registry, warm_up
+    from utils.tuning_profile import configure_tf_threads
+
+    batch_size = config["batch"]
+    if config["stub"]:
+        configure_tf_threads()
+        model = build_stub_model()
+        warm_up(model, (batch_size,))
+        model_name = "stub-vgg19"
+    else:
+        version = model_registry.resolve_active_version()
+        if version is None:
+            raise SystemExit(f"No model found under {model_registry.model_dir}; use --stub")
+        model = model_registry.load_version(version, batch_sizes=(batch_size,)).model
+        model_name = version
+
+    batch = np.random.default_rng(0).random((batch_size,) + INPUT_SHAPE, dtype=np.float32)
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + config["duration"]
+
+    def worker():
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            model.predict(batch, verbose=0)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=worker) for _ in range(config["concurrency"])]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    values = np.sort(np.array(latencies))
+    return {
+        "model": model_name,
+        "calls": len(values),
+        "imagesPerSecond": round(len(values) * batch_size / elapsed, 2),
+        "p50Ms": round(float(np.percentile(values, 50)) * 1000, 1),
+        "p99Ms": round(float(np.percentile(values, 99)) * 1000, 1),
+    }
+
+
+def run_trial_subprocess(config, timeout):
+    env = dict(os.environ)
+    env["TF_INTRA_OP_THREADS"] = str(config["intra"])
+    env["TF_INTER_OP_THREADS"] = str(config["inter"])
+    env["TF_CPP_MIN_LOG_LEVEL"] = "2"
+    env["LOG_LEVEL"] = "WARNING"
+    try:
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--trial", json.dumps(config)],
+            capture_output=True, text=True, timeout=timeout, env=env, cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+    except subprocess.TimeoutExpired:
+        return None, "timed out"
+    for line in reversed(completed.stdout.splitlines()):
+        if line.startswith("{"):
+            return json.loads(line), None
+    return None, (completed.stderr.strip().splitlines() or ["no output"])[-1]
+
+
+def choose(results, max_p99_ms):
+    """
+    Pick the serving settings and the study batch size
+
+    Threads and concurrency are chosen on batch-1 throughput (how single
+    predictions are served) among runs within the p99 budget; the batch size
+    is then the one with the best throughput under those settings.
+    """
+    def within_budget(result):
+        return max_p99_ms is None or result["p99Ms"] <= max_p99_ms
+
+    single = [r for r in results if r["batch"] == 1 and within_budget(r)] or [r for r in results if r["batch"] == 1]
+    if not single:
+        single = results
+    serving = max(single, key=lambda r: r["imagesPerSecond"])
+    same_threads = [
+        r for r in results
+        if (r["intra"], r["inter"], r["concurrency"]) == (serving["intra"], serving["inter"], serving["concurrency"])
+    ]
+    batched = max([r for r in same_threads if within_budget(r)] or same_threads, key=lambda r: r["imagesPerSecond"])
+    return {
+        "TF_INTRA_OP_THREADS": serving["intra"],
+        "TF_INTER_OP_THREADS": serving["inter"],
+        "INFERENCE_MAX_CONCURRENCY": serving["concurrency"],
+        "STUDY_BATCH_SIZE": batched["batch"],
+        "WARMUP_BATCH_SIZES": ",".join(str(size) for size in sorted({1, batched["batch"]}))
+    }
+
+
+if __name__ == "__main__":
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Sweep inference settings and write a tuning profile")
+    parser.add_argument("--intra", type=parse_int_list, default=sorted({max(1, cpus // 2), cpus}),
+                        help="Comma-separated intra-op thread counts")
+    parser.add_argument("--inter", type=parse_int_list, default=[1, 2], help="Comma-separated inter-op thread counts")
+    parser.add_argument("--concurrency", type=parse_int_list, default=[1, 2, 4],
+                        help="Comma-separated concurrent inference slots (INFERENCE_MAX_CONCURRENCY)")
+    parser.add_argument("--batch", type=parse_int_list, default=[1, 8, 16], help="Comma-separated batch sizes")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds measured per combination")
+    parser.add_argument("--max-p99-ms", type=float, help="Latency budget per model call")
+    parser.add_argument("--stub", action="store_true", help="Use a random-weight VGG19 instead of the model on disk")
+    parser.add_argument("--output", default=TUNING_PROFILE_PATH, help="Where to write the profile")
+    parser.add_argument("--trial", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.trial:
+        print(json.dumps(run_trial(json.loads(args.trial))))
+        sys.exit(0)
+
+    combinations = [
+        {"intra": intra, "inter": inter, "concurrency": concurrency, "batch": batch,
+         "duration": args.duration, "stub": args.stub}
+        for intra in args.intra for inter in args.inter for concurrency in args.concurrency for batch in args.batch
+    ]
+    print(f"Running {len(combinations)} combinations of {args.duration:.0f}s each on {cpus} CPUs")
+    print(f"{'intra':>5} {'inter':>5} {'conc':>5} {'batch':>5} {'img/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+
+    results = []
+    for config in combinations:
+        result, error = run_trial_subprocess(config, timeout=args.duration + 300)
+        prefix = f"{config['intra']:>5} {config['inter']:>5} {config['concurrency']:>5} {config['batch']:>5}"
+        if result is None:
+            print(f"{prefix}  failed: {error}")
+            continue
+        result.update({key: config[key] for key in ("intra", "inter", "concurrency", "batch")})
+        results.append(result)
+        print(f"{prefix} {result['imagesPerSecond']:>9.1f} {result['p50Ms']:>8.1f} {result['p99Ms']:>8.1f}")
+
+    if not results:
+        print("No combination completed; nothing written")
+        sys.exit(1)
+
+    settings = choose(results, args.max_p99_ms)
+    profile = {
+        "generatedAt": datetime.datetime.utcnow().isoformat(),
+        "host": socket.gethostname(),
+        "cpuCount": cpus,
+        "model": results[0]["model"],
+        "maxP99Ms": args.max_p99_ms,
+        "settings": settings,
+        "trials": results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(profile, f, indent=2)
+    print(f"\nRecommended settings: {json.dumps(settings)}")
+    print(f"Wrote {args.output}; the server applies it at startup (explicit environment settings win)")
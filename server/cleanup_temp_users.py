@@ -1,7 +1,7 @@
 import pymongo
 import os
-import datetime
 from dotenv import load_dotenv
+from utils import retention
 
 load_dotenv()
 
@@ -27,12 +27,8 @@ def cleanup_temp_users(hours=1):
         temp_users_count = db['temp_users'].count_documents({})
         print(f"Current temporary users count: {temp_users_count}")
         
-        # Calculate expiry time
-        expiry_time = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
-        
         # Find and delete expired temp users
-        result = db['temp_users'].delete_many({"created": {"$lt": expiry_time}})
-        deleted_count = result.deleted_count
+        deleted_count = retention.cleanup_temp_users(db, hours)
         
         # Get new count
         new_count = db['temp_users'].count_documents({})
@@ -0,0 +1,368 @@
+"""
+Hermetic load test for the API server
+
+Boots app.py in-process against an in-memory Mongo stand-in (mongomock)
+and a local stub of the OTP email service, then drives mixed traffic over
+real HTTP from a pool of virtual users and reports per-endpoint throughput
+and latency percentiles. No MongoDB, mail service or GPU is needed:
+
+    pip install -r requirements-dev.txt
+    python loadtest.py --concurrency 16 --duration 60
+    python loadtest.py --json results.json   # keep numbers to compare releases
+
+The model is replaced by a stub that sleeps --model-latency-ms per batch
+unless --real-model is given and TensorFlow plus a model are available.
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import importlib.util
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import requests
+from PIL import Image
+
+# Traffic mix for the main loop of each virtual user (relative weights)
+DEFAULT_MIX = {
+    "visitor": 20,
+    "public_statistics": 15,
+    "anonymous_predict": 5,
+    "authenticated_predict": 15,
+    "dashboard": 35,
+    "login": 10,
+}
+
+
+class OtpStub:
+    """Local stand-in for the Node.js OTP email service; remembers the last OTP per email"""
+
+    def __init__(self):
+        self.otps = {}
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                stub.otps[payload.get('email')] = payload.get('otp')
+                body = json.dumps({"success": True}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/api/send-otp"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+class StubModel:
+    """Stands in for the Keras model: fixed latency per batch, score derived from the pixels"""
+
+    def __init__(self, latency_ms):
+        self.latency = latency_ms / 1000.0
+
+    def predict(self, batch, verbose=0):
+        time.sleep(self.latency)
+        means = batch.reshape(batch.shape[0], -1).mean(axis=1)
+        return (1.0 / (1.0 + np.exp(-(means - 0.5) * 8))).reshape(-1, 1).astype(np.float32)
+
+
+def install_tensorflow_stub():
+    """Register a minimal `tensorflow` module when TensorFlow is not installed"""
+    import types
+
+    tensorflow = types.ModuleType('tensorflow')
+    keras = types.ModuleType('tensorflow.keras')
+    preprocessing = types.ModuleType('tensorflow.keras.preprocessing')
+    image = types.ModuleType('tensorflow.keras.preprocessing.image')
+    models = types.ModuleType('tensorflow.keras.models')
+    image.img_to_array = lambda img: np.asarray(img, dtype=np.float32)
+
+    def load_model(path):
+        raise RuntimeError("TensorFlow is not installed; the load test serves a stub model")
+
+    models.load_model = load_model
+    tensorflow.keras, keras.preprocessing, keras.models, preprocessing.image = keras, preprocessing, models, image
+    sys.modules.update({
+        'tensorflow': tensorflow,
+        'tensorflow.keras': keras,
+        'tensorflow.keras.preprocessing': preprocessing,
+        'tensorflow.keras.preprocessing.image': image,
+        'tensorflow.keras.models': models,
+    })
+
+
+def boot_server(args, otp_stub, upload_dir):
+    """Import app.py with Mongo and the OTP service stubbed out and serve it on a free port"""
+    import mongomock
+    import pymongo
+
+    os.environ['OTP_SERVICE_URL'] = otp_stub.url
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ['MAINTENANCE_ENABLED'] = 'false'
+    if not args.keep_rate_limits:
+        # Every virtual user shares 127.0.0.1, which would exhaust the per-IP anonymous limit at once
+        os.environ['ANON_RATE_LIMIT_PER_MINUTE'] = '1000000'
+        os.environ['ANON_RATE_LIMIT_BURST'] = '1000000'
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    # Fork the preprocess workers before TensorFlow (or the stub) is imported, as app.py does in production
+    from utils.preprocess_pool import preprocess_pool
+    preprocess_pool.start()
+
+    have_tensorflow = importlib.util.find_spec('tensorflow') is not None
+    if not have_tensorflow:
+        install_tensorflow_stub()
+    use_real_model = args.real_model and have_tensorflow
+    if not use_real_model:
+        os.environ['MODEL_PRELOAD'] = 'false'
+        os.environ['MODEL_WATCH_INTERVAL'] = '0'
+
+    # One shared in-memory client so every module sees the same data
+    mongo = mongomock.MongoClient()
+    pymongo.MongoClient = lambda *a, **k: mongo
+
+    import app as app_module
+    from routes import predict_routes
+    from utils.model_registry import model_registry, ModelHandle
+
+    predict_routes.UPLOAD_DIR = upload_dir
+
+    if use_real_model:
+        model_registry.get_active()
+    else:
+        model_registry._active = ModelHandle('loadtest-stub', StubModel(args.model_latency_ms), None)
+
+    import logging
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def make_images(count, images_dir=None):
+    """Encoded upload bodies: real scans from a directory, or smooth random blobs"""
+    if images_dir:
+        paths = sorted(os.path.join(images_dir, name) for name in os.listdir(images_dir))
+        images = []
+        for path in paths[:count]:
+            with open(path, 'rb') as f:
+                images.append((os.path.basename(path), f.read()))
+        return images
+    rng = np.random.default_rng(0)
+    images = []
+    for index in range(count):
+        coarse = (rng.random((12, 12)) * 255).astype(np.uint8)
+        scan = Image.fromarray(coarse).resize((256, 256), Image.BICUBIC).convert('RGB')
+        buffer = io.BytesIO()
+        scan.save(buffer, format='JPEG', quality=90)
+        images.append((f"scan_{index}.jpg", buffer.getvalue()))
+    return images
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def call(self, session, name, method, url, expected=(200, 201, 304), **kwargs):
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=60, **kwargs)
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, 'exception'
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latencies[name].append(elapsed)
+            self.statuses[name][status] += 1
+            if status not in expected:
+                self.errors[name] += 1
+        return response if status in expected else None
+
+
+class VirtualUser:
+    """One simulated browser: signs up once, then loops over the traffic mix"""
+
+    def __init__(self, index, base_url, otp_stub, recorder, images, mix):
+        self.index = index
+        self.base_url = base_url
+        self.otp_stub = otp_stub
+        self.recorder = recorder
+        self.images = images
+        self.names, self.weights = zip(*mix.items())
+        self.session = requests.Session()
+        self.email = f"loadtest{index}_{random.randrange(10 ** 9)}@example.com"
+        self.password = "loadtest-password"
+        self.token = None
+        self.etags = {}
+
+    def call(self, name, method, path, **kwargs):
+        return self.recorder.call(self.session, name, method, self.base_url + path, **kwargs)
+
+    def auth_headers(self, path=None):
+        headers = {"Authorization": f"Bearer {self.token}"}
+        if path in self.etags:
+            headers["If-None-Match"] = self.etags[path]
+        return headers
+
+    def signup(self):
+        response = self.call("POST /api/auth/register", "POST", "/api/auth/register", json={
+            "firstName": "Load", "lastName": f"User{self.index}", "email": self.email, "password": self.password
+        })
+        if response is None:
+            return False
+        user_id = response.json()["userId"]
+        response = self.call("POST /api/auth/verify-otp", "POST", "/api/auth/verify-otp", json={
+            "userId": user_id, "otp": self.otp_stub.otps.get(self.email)
+        })
+        if response is None:
+            return False
+        self.token = response.json()["token"]
+        return True
+
+    def visitor(self):
+        self.call("POST /api/record-visitor", "POST", "/api/record-visitor",
+                  json={"sessionId": f"{self.email}-{random.randrange(10 ** 6)}", "userAgent": "loadtest"})
+
+    def public_statistics(self):
+        self.call("GET /api/dashboard/public-statistics", "GET", "/api/dashboard/public-statistics")
+
+    def login(self):
+        response = self.call("POST /api/auth/login", "POST", "/api/auth/login",
+                             json={"email": self.email, "password": self.password})
+        if response is not None:
+            self.token = response.json()["token"]
+
+    def _upload(self):
+        name, data = random.choice(self.images)
+        return {"image": (name, data, "image/jpeg")}
+
+    def anonymous_predict(self):
+        self.call("POST /api/predict", "POST", "/api/predict/", files=self._upload(), expected=(200, 429, 503))
+
+    def authenticated_predict(self):
+        self.call("POST /api/predict/authenticated", "POST", "/api/predict/authenticated",
+                  files=self._upload(), headers=self.auth_headers(), expected=(200, 503))
+
+    def dashboard(self):
+        # What one dashboard render fetches, revalidating with the ETags seen last time
+        for path in ("/api/dashboard/user-profile", "/api/dashboard/statistics", "/api/dashboard/predictions"):
+            response = self.call(f"GET {path}", "GET", path, headers=self.auth_headers(path))
+            if response is not None and response.headers.get("ETag"):
+                self.etags[path] = response.headers["ETag"]
+
+    def run(self, deadline):
+        if not self.signup():
+            return
+        while time.monotonic() < deadline:
+            action = random.choices(self.names, self.weights)[0]
+            getattr(self, action)()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(recorder, elapsed):
+    summary = {}
+    for name, latencies in sorted(recorder.latencies.items()):
+        values = sorted(latencies)
+        summary[name] = {
+            "requests": len(values),
+            "errors": recorder.errors[name],
+            "rps": len(values) / elapsed,
+            "p50Ms": percentile(values, 0.50) * 1000,
+            "p95Ms": percentile(values, 0.95) * 1000,
+            "p99Ms": percentile(values, 0.99) * 1000,
+            "maxMs": values[-1] * 1000,
+            "statuses": {str(status): count for status, count in recorder.statuses[name].items()},
+        }
+    return summary
+
+
+def print_report(summary, elapsed, concurrency):
+    print(f"\n{concurrency} virtual users for {elapsed:.1f}s\n")
+    header = f"{'endpoint':<42} {'reqs':>7} {'errors':>6} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+    print(header)
+    print('-' * len(header))
+    for name, row in summary.items():
+        print(f"{name:<42} {row['requests']:>7} {row['errors']:>6} {row['rps']:>8.1f} "
+              f"{row['p50Ms']:>8.1f} {row['p95Ms']:>8.1f} {row['p99Ms']:>8.1f} {row['maxMs']:>8.1f}")
+    total = sum(row['requests'] for row in summary.values())
+    print(f"\nTotal: {total} requests, {total / elapsed:.1f} req/s")
+
+
+def parse_mix(value):
+    mix = dict(DEFAULT_MIX)
+    for part in filter(None, value.split(',')):
+        name, weight = part.split('=')
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown action '{name}', choose from {', '.join(DEFAULT_MIX)}")
+        mix[name] = float(weight)
+    return mix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hermetic end-to-end load test (mongomock + OTP stub)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of traffic after signup")
+    parser.add_argument("--mix", type=parse_mix, default=dict(DEFAULT_MIX),
+                        help=f"Override weights, e.g. dashboard=50,login=0 (actions: {', '.join(DEFAULT_MIX)})")
+    parser.add_argument("--images", type=int, default=100, help="Distinct images to upload")
+    parser.add_argument("--images-dir", help="Upload real scans from this directory instead of synthetic ones")
+    parser.add_argument("--model-latency-ms", type=float, default=50, help="Latency of the stub model per batch")
+    parser.add_argument("--real-model", action="store_true", help="Serve the model on disk if TensorFlow is installed")
+    parser.add_argument("--keep-rate-limits", action="store_true", help="Leave the anonymous rate limit in place")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the summary to this file")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    upload_dir = tempfile.mkdtemp(prefix='loadtest_uploads_')
+    try:
+        otp_stub = OtpStub()
+        server, base_url = boot_server(args, otp_stub, upload_dir)
+        images = make_images(args.images, args.images_dir)
+        recorder = Recorder()
+        print(f"Serving on {base_url}; running {args.concurrency} virtual users for {args.duration:.0f}s...")
+
+        start = time.monotonic()
+        deadline = start + args.duration
+        users = [VirtualUser(i, base_url, otp_stub, recorder, images, args.mix) for i in range(args.concurrency)]
+        threads = [threading.Thread(target=user.run, args=(deadline,), daemon=True) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+
+        summary = summarize(recorder, elapsed)
+        print_report(summary, elapsed, args.concurrency)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({"concurrency": args.concurrency, "durationSeconds": elapsed, "endpoints": summary}, f, indent=2)
+            print(f"Wrote {args.json}")
+        server.shutdown()
+    finally:
+        shutil.rmtree(upload_dir, ignore_errors=True)
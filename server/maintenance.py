@@ -0,0 +1,28 @@
+import os
+import argparse
+import pymongo
+from dotenv import load_dotenv
+from utils.retention import TASKS, run_maintenance
+
+load_dotenv()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run retention, archival and upload compaction once")
+    parser.add_argument("tasks", nargs="*", help=f"Tasks to run (default: all): {', '.join(TASKS)}")
+    args = parser.parse_args()
+    unknown = [name for name in args.tasks if name not in TASKS]
+    if unknown:
+        parser.error(f"unknown task(s): {', '.join(unknown)}")
+
+    mongo_uri = os.getenv('MONGO_URI', 'mongodb://localhost:27017/brain_tumor_detection')
+    client = pymongo.MongoClient(mongo_uri)
+    db = client['brain_tumor_detection']
+
+    print(f"Running maintenance tasks: {', '.join(args.tasks or TASKS)}")
+    results = run_maintenance(db, args.tasks or None)
+    if results is None:
+        print("Maintenance is already running in another process")
+    else:
+        for name, count in results.items():
+            print(f"{name}: {'failed' if count is None else count}")
+    print("Maintenance complete")
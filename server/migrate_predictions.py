@@ -0,0 +1,93 @@
+import os
+import argparse
+import pymongo
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+from utils.retention import UPLOAD_DIR
+from utils.prediction_schema import upgrade_document, SCHEMA_VERSION, LIST_INDEX, LIST_INDEX_NAME
+
+load_dotenv()
+
+# Index the dashboard used before the covering index replaced it
+OLD_INDEX_NAME = 'userId_1_timestamp_-1'
+
+def migrate_predictions(db, batch_size=500, dry_run=False, upload_dir=UPLOAD_DIR):
+    """
+    Convert version 1 prediction documents to the compact version 2 schema
+
+    Safe to rerun and to run while the server is up: only documents without
+    a "v" field are touched, and each update is conditional on that, so a
+    document is never converted twice. Uploads are re-filed under their
+    content hash; an old file is removed once no unconverted document
+    refers to it.
+
+    Returns:
+        dict: Counts of converted documents and moved/removed files
+    """
+    predictions_collection = db['predictions']
+    stats = {"converted": 0, "filesMoved": 0, "filesRemoved": 0, "missingFiles": 0}
+    last_id = None
+    while True:
+        query = {"v": {"$exists": False}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = list(predictions_collection.find(query).sort("_id", pymongo.ASCENDING).limit(batch_size))
+        if not batch:
+            break
+        last_id = batch[-1]["_id"]
+
+        operations = []
+        old_paths = set()
+        for document in batch:
+            if dry_run:
+                stats["converted"] += 1
+                continue
+            update, old_path = upgrade_document(document, upload_dir)
+            if "image" in update["$set"]:
+                stats["filesMoved"] += old_path is not None
+            elif document.get("imageName"):
+                stats["missingFiles"] += 1
+            if old_path:
+                old_paths.add(old_path)
+            operations.append(UpdateOne({"_id": document["_id"], "v": {"$exists": False}}, update))
+
+        if operations:
+            result = predictions_collection.bulk_write(operations, ordered=False)
+            stats["converted"] += result.modified_count
+
+        # Other documents may still name the same file (e.g. jobs written before this run)
+        for old_path in old_paths:
+            if predictions_collection.find_one({"imageName": os.path.basename(old_path)}, {"_id": 1}):
+                continue
+            try:
+                os.remove(old_path)
+                stats["filesRemoved"] += 1
+            except FileNotFoundError:
+                pass
+        print(f"Processed {len(batch)} documents (up to {last_id})")
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=f"Convert prediction documents to schema version {SCHEMA_VERSION}")
+    parser.add_argument("--batch-size", type=int, default=500, help="Documents per bulk write (default: 500)")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the documents that would be converted")
+    parser.add_argument("--drop-old-index", action="store_true",
+                        help=f"Drop the {OLD_INDEX_NAME} index once the covering index exists")
+    args = parser.parse_args()
+
+    mongo_uri = os.getenv('MONGO_URI', 'mongodb://localhost:27017/brain_tumor_detection')
+    client = pymongo.MongoClient(mongo_uri)
+    db = client['brain_tumor_detection']
+
+    print(f"Migrating predictions to schema version {SCHEMA_VERSION}{' (dry run)' if args.dry_run else ''}...")
+    stats = migrate_predictions(db, args.batch_size, args.dry_run)
+    for name, count in stats.items():
+        print(f"{name}: {count}")
+
+    if not args.dry_run:
+        db['predictions'].create_index(LIST_INDEX, name=LIST_INDEX_NAME)
+        print(f"Ensured index {LIST_INDEX_NAME}")
+        if args.drop_old_index and OLD_INDEX_NAME in db['predictions'].index_information():
+            db['predictions'].drop_index(OLD_INDEX_NAME)
+            print(f"Dropped index {OLD_INDEX_NAME}")
+    print("Migration complete")
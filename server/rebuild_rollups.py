@@ -0,0 +1,114 @@
+import pymongo
+import os
+import argparse
+import datetime
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+from utils.rollups import ROLLUPS_COLLECTION, GRANULARITIES, HOUR, bucket_id
+from utils.prediction_schema import result_filter, TUMOR, NO_TUMOR
+from utils.retention import RETENTION_ANONYMOUS_DAYS
+
+load_dotenv()
+
+# (collection, timestamp field, extra match, counter name)
+SOURCES = [
+    ('predictions', 'timestamp', {}, 'predictions'),
+    ('predictions', 'timestamp', {"result": result_filter(TUMOR)}, 'tumorPredictions'),
+    ('predictions', 'timestamp', {"result": result_filter(NO_TUMOR)}, 'noTumorPredictions'),
+    ('predictions', 'timestamp', {"userId": None}, 'anonymousPredictions'),
+    ('predictions', 'timestamp', {"userId": {"$ne": None}}, 'authenticatedPredictions'),
+    ('visitors', 'timestamp', {}, 'visitors'),
+    ('users', 'created', {}, 'signups'),
+]
+
+def archive_cutoff(days=RETENTION_ANONYMOUS_DAYS):
+    """Start of the first day no archived prediction can fall in (archival cuts off mid-day)"""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    return cutoff.replace(hour=0, minute=0, second=0, microsecond=0) + datetime.timedelta(days=1)
+
+def rebuild_rollups(days=None, include_archived=False):
+    """
+    Recompute usage rollup buckets from the raw collections
+
+    Each counter is aggregated server-side per hour/day bucket and written
+    with $set, so rerunning the script is idempotent. Use it to backfill
+    history or to repair buckets after an outage.
+
+    Old anonymous predictions are moved out of the collection by retention,
+    so recounting their buckets would overwrite the live counts with smaller
+    ones; prediction counters are only rebuilt from archive_cutoff() on
+    unless include_archived is set (e.g. before anything was archived).
+
+    Args:
+        days (int): Only rebuild the last N days (default: all history)
+        include_archived (bool): Also rebuild prediction buckets older than the retention cutoff
+
+    Returns:
+        int: Number of bucket counters written
+    """
+    # MongoDB connection
+    mongo_uri = os.getenv('MONGO_URI', 'mongodb://localhost:27017/brain_tumor_detection')
+    client = pymongo.MongoClient(mongo_uri)
+    db = client['brain_tumor_detection']
+    rollups_collection = db[ROLLUPS_COLLECTION]
+
+    since = None
+    if days:
+        since = (datetime.datetime.utcnow() - datetime.timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    predictions_since = since
+    if not include_archived:
+        predictions_since = max(since, archive_cutoff()) if since else archive_cutoff()
+        print(f"Prediction counters before {predictions_since.date()} are kept (archived predictions)")
+
+    written = 0
+    for granularity in GRANULARITIES:
+        date_format = '%Y-%m-%dT%H' if granularity == HOUR else '%Y-%m-%d'
+        for collection_name, time_field, extra_match, counter in SOURCES:
+            start_time = predictions_since if collection_name == 'predictions' else since
+            match = dict(extra_match)
+            match[time_field] = {"$gte": start_time} if start_time else {"$exists": True}
+            pipeline = [
+                {"$match": match},
+                {"$group": {
+                    "_id": {"$dateToString": {"format": date_format, "date": f"${time_field}"}},
+                    "count": {"$sum": 1}
+                }}
+            ]
+            operations = []
+            for group in db[collection_name].aggregate(pipeline, allowDiskUse=True):
+                start = datetime.datetime.strptime(group["_id"], date_format)
+                operations.append(UpdateOne(
+                    {"_id": bucket_id(start, granularity)},
+                    {
+                        "$set": {f"counts.{counter}": group["count"]},
+                        "$setOnInsert": {"granularity": granularity, "bucket": start}
+                    },
+                    upsert=True
+                ))
+                # Write in bounded batches
+                if len(operations) >= 1000:
+                    rollups_collection.bulk_write(operations, ordered=False)
+                    written += len(operations)
+                    operations = []
+            if operations:
+                rollups_collection.bulk_write(operations, ordered=False)
+                written += len(operations)
+        print(f"Rebuilt {granularity} buckets")
+
+    rollups_collection.create_index([("granularity", pymongo.ASCENDING), ("bucket", pymongo.ASCENDING)])
+    print(f"Wrote {written} bucket counters")
+    return written
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute usage rollup buckets from the raw collections")
+    parser.add_argument("days", nargs="?", type=int, help="Only rebuild the last N days (default: all history)")
+    parser.add_argument("--include-archived", action="store_true",
+                        help=f"Also recount predictions older than RETENTION_ANONYMOUS_DAYS ({RETENTION_ANONYMOUS_DAYS}); "
+                             "only safe if none have been archived")
+    args = parser.parse_args()
+    days = args.days
+
+    print(f"Rebuilding usage rollups for {'the last ' + str(days) + ' day(s)' if days else 'all history'}...")
+    rebuild_rollups(days, args.include_archived)
+    print("Rebuild complete")
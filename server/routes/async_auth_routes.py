@@ -0,0 +1,305 @@
+"""
+Auth routes for the async serving mode (asgi_app.py)
+
+Same endpoints as routes/auth_routes.py, using its validation and
+response helpers so both modes answer alike, but Mongo calls go through motor and the OTP service through httpx, so a
+request waiting on I/O does not hold a thread. bcrypt is CPU-bound and
+runs in the default executor.
+"""
+from quart import Blueprint, request, jsonify
+import asyncio
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from bson.objectid import ObjectId
+from werkzeug.exceptions import UnsupportedMediaType
+import os
+from dotenv import load_dotenv
+from utils.email_service import send_otp_email_async
+from utils.logger import get_logger, mask_email
+from utils.rollups import rollup_writer
+from routes.auth_routes import (
+    generate_otp, hash_password, check_password, validate_request, temp_user_document,
+    verified_user_document, signed_in_response, UNSUPPORTED_CONTENT_TYPE, EMAIL_NOT_SENT, OTP_EXPIRY_SECONDS
+)
+import datetime
+import json
+
+load_dotenv()
+
+logger = get_logger(__name__)
+
+# Initialize auth blueprint
+auth_async_bp = Blueprint('auth_async', __name__)
+
+# MongoDB connection
+mongo_uri = os.getenv('MONGO_URI', 'mongodb://localhost:27017')
+mongo_client = AsyncIOMotorClient(mongo_uri)
+db = mongo_client['brain_tumor_detection']
+users_collection = db['users']
+otps_collection = db['otps']
+temp_users_collection = db['temp_users']
+
+# Helper functions
+async def issue_otp(user_id, otp_type):
+    """Create or replace the OTP for a user in one upsert; any earlier OTP of that type stops working"""
+    otp = generate_otp()
+    await otps_collection.update_one(
+        {"userId": user_id, "type": otp_type},
+        {"$set": {"otp": otp, "created": datetime.datetime.utcnow()}},
+        upsert=True
+    )
+    return otp
+
+async def consume_otp(user_id, otp, otp_type):
+    """
+    Atomically delete and return a matching, unexpired OTP
+
+    Returns:
+        tuple: (otp_record, error) where error is None on success
+    """
+    expiry_time = datetime.datetime.utcnow() - datetime.timedelta(seconds=OTP_EXPIRY_SECONDS)
+    otp_record = await otps_collection.find_one_and_delete({
+        "userId": user_id,
+        "otp": otp,
+        "type": otp_type,
+        "created": {"$gte": expiry_time}
+    })
+    if otp_record:
+        return otp_record, None
+    # Failure path only: tell an expired code apart from a wrong one
+    if await otps_collection.find_one({"userId": user_id, "otp": otp, "type": otp_type}, {"_id": 1}):
+        return None, "OTP expired"
+    return None, "Invalid OTP"
+
+async def read_json():
+    """request.get_json() as Flask behaves: a body that is not JSON is rejected with 415"""
+    if not request.is_json:
+        raise UnsupportedMediaType(
+            "Did not attempt to load JSON data because the request Content-Type was not 'application/json'."
+        )
+    return await request.get_json()
+
+async def read_form_or_json():
+    """
+    Request data for register and login, accepting the same content types as the sync routes
+
+    Returns:
+        tuple: (data, error_response) where error_response is None on success
+    """
+    if request.content_type and 'application/json' in request.content_type:
+        return await request.get_json(), None
+    if request.content_type and 'application/x-www-form-urlencoded' in request.content_type:
+        return (await request.form).to_dict(), None
+    # get_json() refuses other content types, so try form data, then the raw body
+    data = (await request.form).to_dict()
+    if data:
+        return data, None
+    try:
+        return json.loads((await request.get_data()).decode('utf-8')), None
+    except:
+        return None, (jsonify(UNSUPPORTED_CONTENT_TYPE[0]), UNSUPPORTED_CONTENT_TYPE[1])
+
+# Routes
+@auth_async_bp.route('/register', methods=['POST'])
+async def register():
+    data, error = await read_form_or_json()
+    if error:
+        return error
+
+    # Log the incoming data format for debugging
+    logger.debug("Register attempt", extra={"fields": {"contentType": request.content_type}})
+
+    # Validate request data
+    error = validate_request(data, 'register')
+    if error:
+        return jsonify(error[0]), error[1]
+
+    # Check if user already exists
+    if await users_collection.find_one({"email": data['email']}, {"_id": 1}):
+        return jsonify({"error": "User already exists"}), 409
+
+    # Store user data temporarily
+    hashed_password = await asyncio.to_thread(hash_password, data['password'])
+    user_data = temp_user_document(data, hashed_password)
+
+    # Save temporary user data, replacing any previous registration for this email
+    try:
+        temp_user = await temp_users_collection.find_one_and_update(
+            {"email": data['email']},
+            {"$set": user_data},
+            projection={"_id": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # A concurrent submit for the same email won the upsert race
+        return jsonify({"error": "Registration already in progress for this email"}), 409
+    temp_user_id = str(temp_user['_id'])
+
+    # Generate and save OTP
+    otp = await issue_otp(temp_user['_id'], "signup")
+
+    # Send OTP via email
+    send_result = await send_otp_email_async(data['email'], otp, 'signup')
+
+    if not send_result:
+        return jsonify(EMAIL_NOT_SENT[0]), EMAIL_NOT_SENT[1]
+
+    logger.info("Signup OTP issued", extra={"fields": {"email": mask_email(data['email'])}})
+
+    return jsonify({
+        "message": "Please check your email for OTP to verify your account.",
+        "userId": temp_user_id
+    }), 201
+
+@auth_async_bp.route('/verify-otp', methods=['POST'])
+async def verify_otp():
+    data = await read_json()
+
+    # Validate request data
+    error = validate_request(data, 'verify-otp')
+    if error:
+        return jsonify(error[0]), error[1]
+
+    # Consume the OTP; only one of several concurrent submits can get it (5 minutes validity)
+    otp_record, error = await consume_otp(ObjectId(data['userId']), data['otp'], "signup")
+
+    if not otp_record:
+        return jsonify({"error": error}), 400
+
+    # Take the temporary user data
+    temp_user = await temp_users_collection.find_one_and_delete({"_id": ObjectId(data['userId'])})
+
+    if not temp_user:
+        return jsonify({"error": "Registration data expired or not found"}), 400
+
+    # Create verified user from temporary data
+    new_user = verified_user_document(temp_user)
+
+    # Save user to database; the unique email index rejects duplicates
+    try:
+        user_result = await users_collection.insert_one(new_user)
+    except DuplicateKeyError:
+        return jsonify({"error": "User already exists"}), 409
+    user_id = str(user_result.inserted_id)
+    rollup_writer.record({"signups": 1})
+
+    # Generate JWT token
+    return jsonify(signed_in_response("Account verified successfully", user_id, new_user)), 200
+
+@auth_async_bp.route('/login', methods=['POST'])
+async def login():
+    data, error = await read_form_or_json()
+    if error:
+        return error
+
+    # Log the incoming data format for debugging
+    logger.debug("Login attempt", extra={"fields": {"contentType": request.content_type}})
+
+    # Validate request data
+    error = validate_request(data, 'login')
+    if error:
+        return jsonify(error[0]), error[1]
+
+    # Find user in database
+    user = await users_collection.find_one({"email": data['email']})
+
+    if not user:
+        return jsonify({"error": "Invalid credentials"}), 401
+
+    # Check password
+    if not await asyncio.to_thread(check_password, data['password'], user['password']):
+        return jsonify({"error": "Invalid credentials"}), 401
+
+    # Check if user is verified
+    if not user.get('isVerified', False):
+        return jsonify({"error": "Account not verified", "userId": str(user['_id'])}), 403
+
+    # Generate JWT token
+    return jsonify(signed_in_response("Login successful", str(user['_id']), user)), 200
+
+@auth_async_bp.route('/forgot-password', methods=['POST'])
+async def forgot_password():
+    data = await read_json()
+
+    # Validate request data
+    error = validate_request(data, 'forgot-password')
+    if error:
+        return jsonify(error[0]), error[1]
+
+    # Find user in database
+    user = await users_collection.find_one({"email": data['email']}, {"_id": 1})
+
+    if not user:
+        return jsonify({"error": "User not found"}), 404
+
+    # Generate and save OTP
+    otp = await issue_otp(user['_id'], "reset")
+
+    # Send OTP via email
+    await send_otp_email_async(data['email'], otp, 'reset')
+
+    return jsonify({"message": "Password reset OTP sent", "userId": str(user['_id'])}), 200
+
+@auth_async_bp.route('/reset-password', methods=['POST'])
+async def reset_password():
+    data = await read_json()
+
+    # Validate request data
+    error = validate_request(data, 'reset-password')
+    if error:
+        return jsonify(error[0]), error[1]
+
+    # Consume the OTP (5 minutes validity)
+    otp_record, error = await consume_otp(ObjectId(data['userId']), data['otp'], "reset")
+
+    if not otp_record:
+        return jsonify({"error": error}), 400
+
+    # Update password
+    hashed_password = await asyncio.to_thread(hash_password, data['newPassword'])
+    await users_collection.update_one(
+        {"_id": ObjectId(data['userId'])},
+        {"$set": {"password": hashed_password}}
+    )
+
+    return jsonify({"message": "Password reset successful"}), 200
+
+@auth_async_bp.route('/resend-otp', methods=['POST'])
+async def resend_otp():
+    data = await read_json()
+
+    # Validate request data
+    error = validate_request(data, 'resend-otp')
+    if error:
+        return jsonify(error[0]), error[1]
+
+    # Check if this is for signup or password reset
+    otp_type = data.get('type', 'signup')
+
+    # Find user in temporary or users collection based on OTP type
+    if otp_type == 'signup':
+        user = await temp_users_collection.find_one({"_id": ObjectId(data['userId'])}, {"email": 1})
+    else:
+        user = await users_collection.find_one({"_id": ObjectId(data['userId'])}, {"email": 1})
+
+    if not user:
+        return jsonify({"error": "User not found"}), 404
+
+    # Generate and save new OTP, replacing any existing one for this user
+    otp = await issue_otp(ObjectId(data['userId']), otp_type)
+
+    # Send OTP via email
+    email = user['email']
+    send_result = await send_otp_email_async(email, otp, otp_type)
+
+    if not send_result:
+        return jsonify(EMAIL_NOT_SENT[0]), EMAIL_NOT_SENT[1]
+
+    logger.info("OTP re-issued", extra={"fields": {"email": mask_email(email), "type": otp_type}})
+
+    return jsonify({
+        "message": "OTP sent successfully",
+        "email": email
+    }), 200
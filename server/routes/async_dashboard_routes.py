@@ -0,0 +1,338 @@
+"""
+Dashboard routes for the async serving mode (asgi_app.py)
+
+Same endpoints and responses as routes/dashboard_routes.py, with Mongo
+calls through motor. The saliency image and similar-case endpoints are CPU
+or file bound and stay on the Flask app, which asgi_app.py falls back to.
+"""
+from quart import Blueprint, request, jsonify, Response
+import asyncio
+import pymongo
+from motor.motor_asyncio import AsyncIOMotorClient
+from bson.objectid import ObjectId
+import os
+import io
+import csv
+import json
+import datetime
+from dotenv import load_dotenv
+from functools import wraps
+from utils.jwt_handler import verify_token
+from utils.logger import get_logger, sampled
+from utils.saliency import request_saliency, READY
+from utils.rollups import rollup_query, format_rollup, COUNTERS, HOUR, DAY, ROLLUPS_COLLECTION
+from utils.response_cache import async_cached_user_response
+from routes import dashboard_routes
+from routes.dashboard_routes import (
+    format_prediction, parse_iso_datetime, EXPORT_BATCH_SIZE, EXPORT_FIELDS, ANALYTICS_DEFAULT_RANGE, ANALYTICS_MAX_RANGE,
+    ANALYTICS_USER_IDS
+)
+from utils.prediction_schema import decode_prediction, display_name, result_filter, LIST_FIELDS, TUMOR, NO_TUMOR
+
+load_dotenv()
+
+logger = get_logger(__name__)
+
+# Initialize dashboard blueprint
+dashboard_async_bp = Blueprint('dashboard_async', __name__)
+
+# MongoDB connection
+mongo_uri = os.getenv('MONGO_URI', 'mongodb://localhost:27017')
+mongo_client = AsyncIOMotorClient(mongo_uri)
+db = mongo_client['brain_tumor_detection']
+predictions_collection = db['predictions']
+users_collection = db['users']
+visitors_collection = db['visitors']
+rollups_collection = db[ROLLUPS_COLLECTION]
+
+def parse_date_arg(name):
+    """Parse an optional ISO date/datetime query argument; raises ValueError if malformed"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    return parse_iso_datetime(value)
+
+# Authentication middleware
+def token_required(f):
+    @wraps(f)
+    async def decorated(*args, **kwargs):
+        token = None
+
+        # Check if token is in the request header
+        if 'Authorization' in request.headers:
+            auth_header = request.headers['Authorization']
+            if auth_header.startswith('Bearer '):
+                token = auth_header.split(" ")[1]
+
+        if not token:
+            return jsonify({'error': 'Token is missing'}), 401
+
+        # Verify token
+        user_id = verify_token(token)
+        if not user_id:
+            return jsonify({'error': 'Invalid or expired token'}), 401
+
+        # Add user_id to the request context
+        request.user_id = user_id
+        return await f(*args, **kwargs)
+
+    return decorated
+
+def first_page_cache_key():
+    """Only the first page of history (what the dashboard renders) is cached"""
+    if int(request.args.get('page', 1)) != 1:
+        return None
+    return f"predictions:{int(request.args.get('limit', 10))}"
+
+# Routes
+@dashboard_async_bp.route('/predictions', methods=['GET'])
+@token_required
+@async_cached_user_response(first_page_cache_key)
+async def get_predictions():
+    """Get all predictions for the authenticated user"""
+    # Get pagination parameters
+    page = int(request.args.get('page', 1))
+    limit = int(request.args.get('limit', 10))
+    skip = (page - 1) * limit
+
+    # The page and the total are independent queries, so run them concurrently
+    user_filter = {"userId": ObjectId(request.user_id)}
+    cursor = predictions_collection.find(user_filter, LIST_FIELDS).sort("timestamp", pymongo.DESCENDING).skip(skip).limit(limit)
+    predictions, total_predictions = await asyncio.gather(
+        cursor.to_list(length=None),
+        predictions_collection.count_documents(user_filter)
+    )
+
+    return jsonify({
+        "predictions": [format_prediction(prediction) for prediction in predictions],
+        "total": total_predictions,
+        "page": page,
+        "limit": limit,
+        "totalPages": (total_predictions + limit - 1) // limit
+    }), 200
+
+@dashboard_async_bp.route('/predictions/export', methods=['GET'])
+@token_required
+async def export_predictions():
+    """Stream the authenticated user's full prediction history as CSV or NDJSON"""
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({"error": "Unsupported format. Use csv or ndjson"}), 400
+
+    try:
+        date_from = parse_date_arg('from')
+        date_to = parse_date_arg('to')
+    except ValueError:
+        return jsonify({"error": "Invalid date. Use ISO format, e.g. 2024-01-31"}), 400
+
+    query = {"userId": ObjectId(request.user_id)}
+    if date_from or date_to:
+        query["timestamp"] = {}
+        if date_from:
+            query["timestamp"]["$gte"] = date_from
+        if date_to:
+            # A bare date includes the whole day
+            if len(request.args['to']) == 10:
+                date_to += datetime.timedelta(days=1)
+                query["timestamp"]["$lt"] = date_to
+            else:
+                query["timestamp"]["$lte"] = date_to
+
+    # Served by the (userId, timestamp) index; the cursor fetches EXPORT_BATCH_SIZE documents at a time
+    cursor = predictions_collection.find(
+        query,
+        {**LIST_FIELDS, "modelVersion": 1}
+    ).sort("timestamp", pymongo.DESCENDING).batch_size(EXPORT_BATCH_SIZE)
+
+    def export_row(prediction):
+        prediction = decode_prediction(prediction)
+        return {
+            "id": str(prediction["_id"]),
+            "timestamp": prediction["timestamp"].isoformat(),
+            "result": prediction["result"],
+            "fileName": display_name(prediction),
+            "imageName": prediction["imageName"],
+            "modelVersion": prediction.get("modelVersion")
+        }
+
+    async def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+        async for prediction in cursor:
+            writer.writerow(export_row(prediction))
+            # Flush in chunks rather than per row to keep the number of writes down
+            if buffer.tell() >= 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    async def generate_ndjson():
+        chunk = []
+        async for prediction in cursor:
+            chunk.append(json.dumps(export_row(prediction)))
+            if len(chunk) >= EXPORT_BATCH_SIZE:
+                yield '\n'.join(chunk) + '\n'
+                chunk = []
+        if chunk:
+            yield '\n'.join(chunk) + '\n'
+
+    timestamp = datetime.datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+    if export_format == 'csv':
+        body, mimetype = generate_csv(), 'text/csv'
+    else:
+        body, mimetype = generate_ndjson(), 'application/x-ndjson'
+
+    response = Response(
+        body,
+        mimetype=mimetype,
+        headers={
+            'Content-Disposition': f'attachment; filename="predictions_{timestamp}.{export_format}"',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+    # Large histories take longer than the default response timeout to stream
+    response.timeout = None
+    return response
+
+@dashboard_async_bp.route('/predictions/<prediction_id>', methods=['GET'])
+@token_required
+async def get_prediction_by_id(prediction_id):
+    """Get a specific prediction by ID"""
+    try:
+        # Find prediction in database
+        prediction = await predictions_collection.find_one(
+            {"_id": ObjectId(prediction_id), "userId": ObjectId(request.user_id)},
+            {**LIST_FIELDS, "saliency": 1}
+        )
+
+        if not prediction:
+            return jsonify({"error": "Prediction not found"}), 404
+
+        formatted_prediction = format_prediction(prediction)
+
+        # Grad-CAM overlay is generated in the background the first time it is asked for;
+        # scheduling shares the sync app's saliency workers, so it goes through a thread
+        if request.args.get('saliency', '').lower() == 'true':
+            saliency = await asyncio.to_thread(request_saliency, dashboard_routes.predictions_collection, prediction)
+            formatted_prediction["saliency"] = {"status": saliency["status"]}
+            if saliency["status"] == READY:
+                formatted_prediction["saliency"]["url"] = f"/api/dashboard/predictions/{prediction_id}/saliency"
+
+        return jsonify(formatted_prediction), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@dashboard_async_bp.route('/user-profile', methods=['GET'])
+@token_required
+@async_cached_user_response(lambda: "user-profile")
+async def get_user_profile():
+    """Get the authenticated user's profile"""
+    # Find user in database
+    user = await users_collection.find_one({"_id": ObjectId(request.user_id)}, {"firstName": 1, "lastName": 1, "email": 1})
+
+    if not user:
+        return jsonify({"error": "User not found"}), 404
+
+    # Format user for response
+    formatted_user = {
+        "id": str(user["_id"]),
+        "firstName": user["firstName"],
+        "lastName": user["lastName"],
+        "email": user["email"]
+    }
+
+    return jsonify(formatted_user), 200
+
+@dashboard_async_bp.route('/statistics', methods=['GET'])
+@token_required
+@async_cached_user_response(lambda: "statistics")
+async def get_statistics():
+    """Get statistics about the user's predictions"""
+    user_id = ObjectId(request.user_id)
+    total_predictions, tumor_predictions, no_tumor_predictions, recent_prediction = await asyncio.gather(
+        predictions_collection.count_documents({"userId": user_id}),
+        predictions_collection.count_documents({"userId": user_id, "result": result_filter(TUMOR)}),
+        predictions_collection.count_documents({"userId": user_id, "result": result_filter(NO_TUMOR)}),
+        predictions_collection.find({"userId": user_id}, LIST_FIELDS).sort("timestamp", pymongo.DESCENDING).limit(1).to_list(length=1)
+    )
+
+    # Calculate percentages
+    tumor_percentage = (tumor_predictions / total_predictions * 100) if total_predictions > 0 else 0
+    no_tumor_percentage = (no_tumor_predictions / total_predictions * 100) if total_predictions > 0 else 0
+
+    return jsonify({
+        "totalPredictions": total_predictions,
+        "tumorPredictions": tumor_predictions,
+        "noTumorPredictions": no_tumor_predictions,
+        "tumorPercentage": tumor_percentage,
+        "noTumorPercentage": no_tumor_percentage,
+        "mostRecent": format_prediction(recent_prediction[0]) if recent_prediction else None
+    }), 200
+
+@dashboard_async_bp.route('/public-statistics', methods=['GET'])
+async def get_public_statistics():
+    """Get public statistics about the application usage - no authentication required"""
+    try:
+        total_users, total_predictions, total_visitors, tumor_predictions, no_tumor_predictions = await asyncio.gather(
+            users_collection.count_documents({}),
+            predictions_collection.count_documents({}),
+            visitors_collection.count_documents({}),
+            predictions_collection.count_documents({"result": result_filter(TUMOR)}),
+            predictions_collection.count_documents({"result": result_filter(NO_TUMOR)})
+        )
+
+        if sampled('public_statistics'):
+            logger.info("Public statistics served", extra={"fields": {
+                "users": total_users,
+                "visitors": total_visitors,
+                "predictions": total_predictions
+            }})
+
+        return jsonify({
+            "totalUsers": total_users,
+            "totalVisitors": total_visitors,
+            "totalPredictions": total_predictions,
+            "tumorPredictions": tumor_predictions,
+            "noTumorPredictions": no_tumor_predictions
+        }), 200
+    except Exception as e:
+        logger.exception(f"Error getting public statistics: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@dashboard_async_bp.route('/analytics', methods=['GET'])
+@token_required
+async def get_usage_analytics():
+    """Site-wide usage trends served from pre-aggregated hourly/daily rollups (ANALYTICS_USER_IDS only)"""
+    if request.user_id not in ANALYTICS_USER_IDS:
+        return jsonify({'error': 'Not allowed'}), 403
+
+    granularity = request.args.get('granularity', DAY).lower()
+    if granularity not in (HOUR, DAY):
+        return jsonify({"error": "Unsupported granularity. Use hour or day"}), 400
+
+    try:
+        date_from = parse_date_arg('from')
+        date_to = parse_date_arg('to')
+    except ValueError:
+        return jsonify({"error": "Invalid date. Use ISO format, e.g. 2024-01-31"}), 400
+
+    date_to = date_to or datetime.datetime.utcnow()
+    date_from = date_from or date_to - ANALYTICS_DEFAULT_RANGE[granularity]
+    if date_from >= date_to:
+        return jsonify({"error": "'from' must be before 'to'"}), 400
+    if date_to - date_from > ANALYTICS_MAX_RANGE[granularity]:
+        return jsonify({"error": f"Time range too large for {granularity} granularity"}), 400
+
+    cursor = rollups_collection.find(*rollup_query(granularity, date_from, date_to)).sort("bucket", pymongo.ASCENDING)
+    buckets = [format_rollup(document) async for document in cursor]
+    totals = {name: sum(bucket[name] for bucket in buckets) for name in COUNTERS}
+
+    return jsonify({
+        "granularity": granularity,
+        "from": date_from.isoformat(),
+        "to": date_to.isoformat(),
+        "buckets": buckets,
+        "totals": totals
+    }), 200
@@ -0,0 +1,76 @@
+"""
+Prediction job events for the async serving mode (asgi_app.py)
+
+Streams a job's status changes over one connection, polling MongoDB through
+motor without holding a Flask worker. Creating and polling jobs stay on the
+Flask app (routes/job_routes.py), which asgi_app.py falls back to.
+"""
+from quart import Blueprint, request, jsonify, Response
+import asyncio
+import os
+import time
+from motor.motor_asyncio import AsyncIOMotorClient
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from dotenv import load_dotenv
+from utils.jwt_handler import verify_token
+from utils.logger import get_logger
+from routes.job_routes import (
+    read_job_credentials, job_visible_to, format_job_event, TERMINAL_STATUSES,
+    JOB_EVENTS_TIMEOUT_SECONDS, JOB_EVENTS_POLL_SECONDS, SSE_KEEPALIVE_SECONDS
+)
+
+load_dotenv()
+
+logger = get_logger(__name__)
+
+# Initialize prediction job events blueprint
+jobs_async_bp = Blueprint('jobs_async', __name__)
+
+# MongoDB connection
+mongo_uri = os.getenv('MONGO_URI', 'mongodb://localhost:27017')
+mongo_client = AsyncIOMotorClient(mongo_uri)
+db = mongo_client['brain_tumor_detection']
+prediction_jobs_collection = db['prediction_jobs']
+
+@jobs_async_bp.route('/<job_id>/events', methods=['GET'])
+async def stream_job_events(job_id):
+    """Stream job status changes as server-sent events until the job finishes"""
+    token, job_key = read_job_credentials(request, allow_query_token=True)
+    user_id = verify_token(token) if token else None
+    if token and not user_id:
+        return jsonify({'error': 'Invalid or expired token'}), 401
+    try:
+        job = await prediction_jobs_collection.find_one({"_id": ObjectId(job_id)})
+    except InvalidId:
+        job = None
+    if not job or not job_visible_to(job, user_id, job_key):
+        return jsonify({"error": "Job not found"}), 404
+
+    async def generate(job):
+        last_status = None
+        deadline = time.monotonic() + JOB_EVENTS_TIMEOUT_SECONDS
+        last_sent = time.monotonic()
+        while True:
+            if job["status"] != last_status:
+                last_status = job["status"]
+                last_sent = time.monotonic()
+                yield format_job_event(job).encode()
+            if last_status in TERMINAL_STATUSES or time.monotonic() >= deadline:
+                return
+            if time.monotonic() - last_sent >= SSE_KEEPALIVE_SECONDS:
+                last_sent = time.monotonic()
+                yield b": keepalive\n\n"
+            await asyncio.sleep(JOB_EVENTS_POLL_SECONDS)
+            job = await prediction_jobs_collection.find_one({"_id": job["_id"]})
+            if job is None:
+                return
+
+    response = Response(
+        generate(job),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Quart cuts responses off after RESPONSE_TIMEOUT; this one ends on its own deadline
+    response.timeout = None
+    return response
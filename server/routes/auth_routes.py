@@ -1,5 +1,7 @@
 from flask import Blueprint, request, jsonify
 import pymongo
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 import bcrypt
 import random
 import string
@@ -8,11 +10,15 @@ import os
 from dotenv import load_dotenv
 from utils.jwt_handler import generate_token, verify_token
 from utils.email_service import send_otp_email
+from utils.logger import get_logger, mask_email
+from utils.rollups import rollup_writer
 import datetime
 import json
 
 load_dotenv()
 
+logger = get_logger(__name__)
+
 # Initialize auth blueprint
 auth_bp = Blueprint('auth', __name__)
 
@@ -40,12 +46,130 @@ def hash_password(password):
 def check_password(password, hashed):
     return bcrypt.checkpw(password.encode('utf-8'), hashed)
 
+def issue_otp(user_id, otp_type):
+    """Create or replace the OTP for a user in one upsert; any earlier OTP of that type stops working"""
+    otp = generate_otp()
+    otps_collection.update_one(
+        {"userId": user_id, "type": otp_type},
+        {"$set": {"otp": otp, "created": datetime.datetime.utcnow()}},
+        upsert=True
+    )
+    return otp
+
+def consume_otp(user_id, otp, otp_type):
+    """
+    Atomically delete and return a matching, unexpired OTP
+    
+    Returns:
+        tuple: (otp_record, error) where error is None on success
+    """
+    expiry_time = datetime.datetime.utcnow() - datetime.timedelta(seconds=OTP_EXPIRY_SECONDS)
+    otp_record = otps_collection.find_one_and_delete({
+        "userId": user_id,
+        "otp": otp,
+        "type": otp_type,
+        "created": {"$gte": expiry_time}
+    })
+    if otp_record:
+        return otp_record, None
+    # Failure path only: tell an expired code apart from a wrong one
+    if otps_collection.find_one({"userId": user_id, "otp": otp, "type": otp_type}, {"_id": 1}):
+        return None, "OTP expired"
+    return None, "Invalid OTP"
+
+# Validation and responses shared with the async routes (routes/async_auth_routes.py),
+# so both serving modes answer every request the same way
+REGISTER_FIELDS = ['firstName', 'lastName', 'email', 'password']
+REQUIRED_FIELDS = {
+    'verify-otp': (['userId', 'otp'], "Missing required fields: userId and otp"),
+    'login': (['email', 'password'], "Missing required fields: email and password"),
+    'forgot-password': (['email'], "Missing required field: email"),
+    'reset-password': (['userId', 'otp', 'newPassword'], "Missing required fields"),
+    'resend-otp': (['userId'], "Missing required field: userId"),
+}
+UNSUPPORTED_CONTENT_TYPE = (
+    {"error": "Unsupported content type. Please use application/json or application/x-www-form-urlencoded"}, 415
+)
+EMAIL_NOT_SENT = ({"error": "Failed to send verification email. Please try again."}, 500)
+
+def validate_request(data, route):
+    """
+    Check a request body has the fields `route` requires and a well-formed userId
+
+    Returns:
+        tuple: (error body, status code), or None if the request is valid
+    """
+    if route == 'register':
+        for field in REGISTER_FIELDS:
+            if field not in data:
+                return {"error": f"Missing required field: {field}"}, 400
+        return None
+    fields, message = REQUIRED_FIELDS[route]
+    if any(field not in data for field in fields):
+        return {"error": message}, 400
+    if 'userId' in fields and not ObjectId.is_valid(data['userId']):
+        return {"error": "Invalid userId"}, 400
+    return None
+
+def temp_user_document(data, hashed_password):
+    """Registration data kept until the signup OTP is verified"""
+    return {
+        "firstName": data['firstName'],
+        "lastName": data['lastName'],
+        "email": data['email'],
+        "password": hashed_password.decode('utf-8'),  # Convert binary to string for storage
+        "created": datetime.datetime.utcnow()
+    }
+
+def verified_user_document(temp_user):
+    """Create verified user from temporary data"""
+    return {
+        "firstName": temp_user['firstName'],
+        "lastName": temp_user['lastName'],
+        "email": temp_user['email'],
+        "password": temp_user['password'].encode('utf-8'),  # Convert back to binary for storage
+        "isVerified": True,
+        "created": datetime.datetime.utcnow()
+    }
+
+def signed_in_response(message, user_id, user):
+    """Response body with a new JWT and the user's profile"""
+    return {
+        "message": message,
+        "token": generate_token(user_id),
+        "user": {
+            "id": user_id,
+            "firstName": user['firstName'],
+            "lastName": user['lastName'],
+            "email": user['email']
+        }
+    }
+
+def ensure_auth_indexes():
+    """
+    Unique emails make concurrent double-submits unable to create duplicate users,
+    and TTL indexes expire OTPs and temporary users without request-path sweeps
+    """
+    indexes = [
+        (users_collection, [("email", pymongo.ASCENDING)], {"unique": True}),
+        (temp_users_collection, [("email", pymongo.ASCENDING)], {"unique": True}),
+        (temp_users_collection, [("created", pymongo.ASCENDING)], {"expireAfterSeconds": TEMP_USER_EXPIRY_SECONDS}),
+        (otps_collection, [("userId", pymongo.ASCENDING), ("type", pymongo.ASCENDING)], {"unique": True}),
+        (otps_collection, [("created", pymongo.ASCENDING)], {"expireAfterSeconds": OTP_EXPIRY_SECONDS}),
+    ]
+    for collection, keys, options in indexes:
+        try:
+            collection.create_index(keys, **options)
+        except pymongo.errors.PyMongoError as e:
+            # e.g. existing duplicate emails; the flows still work, just without the guarantee
+            logger.warning(f"Could not create index on {collection.name}: {str(e)}")
+
 # Function to clean up expired OTPs
 def cleanup_expired_otps():
     expiry_time = datetime.datetime.utcnow() - datetime.timedelta(seconds=OTP_EXPIRY_SECONDS)
     result = otps_collection.delete_many({"created": {"$lt": expiry_time}})
     if result.deleted_count > 0:
-        print(f"Cleaned up {result.deleted_count} expired OTPs")
+        logger.info(f"Cleaned up {result.deleted_count} expired OTPs")
     return result.deleted_count
 
 # Function to clean up temporary users
@@ -53,15 +177,12 @@ def cleanup_expired_temp_users():
     expiry_time = datetime.datetime.utcnow() - datetime.timedelta(seconds=TEMP_USER_EXPIRY_SECONDS)
     result = temp_users_collection.delete_many({"created": {"$lt": expiry_time}})
     if result.deleted_count > 0:
-        print(f"Cleaned up {result.deleted_count} expired temporary users")
+        logger.info(f"Cleaned up {result.deleted_count} expired temporary users")
     return result.deleted_count
 
 # Routes
 @auth_bp.route('/register', methods=['POST'])
 def register():
-    # First, clean up expired temporary users
-    cleanup_expired_temp_users()
-    
     # Check content type and handle accordingly
     if request.content_type and 'application/json' in request.content_type:
         data = request.get_json()
@@ -80,54 +201,47 @@ def register():
                 try:
                     data = json.loads(request.data.decode('utf-8'))
                 except:
-                    return jsonify({"error": "Unsupported content type. Please use application/json or application/x-www-form-urlencoded"}), 415
+                    return jsonify(UNSUPPORTED_CONTENT_TYPE[0]), UNSUPPORTED_CONTENT_TYPE[1]
     
     # Log the incoming data format for debugging
-    print(f"Register attempt: Content-Type={request.content_type}, Data format: {type(data)}")
+    logger.debug("Register attempt", extra={"fields": {"contentType": request.content_type}})
     
     # Validate request data
-    required_fields = ['firstName', 'lastName', 'email', 'password']
-    for field in required_fields:
-        if field not in data:
-            return jsonify({"error": f"Missing required field: {field}"}), 400
+    error = validate_request(data, 'register')
+    if error:
+        return jsonify(error[0]), error[1]
     
     # Check if user already exists
-    if users_collection.find_one({"email": data['email']}):
+    if users_collection.find_one({"email": data['email']}, {"_id": 1}):
         return jsonify({"error": "User already exists"}), 409
     
     # Store user data temporarily
-    user_data = {
-        "firstName": data['firstName'],
-        "lastName": data['lastName'],
-        "email": data['email'],
-        "password": hash_password(data['password']).decode('utf-8'),  # Convert binary to string for storage
-        "created": datetime.datetime.utcnow()
-    }
-    
-    # Remove any previous temp registration for this email
-    temp_users_collection.delete_many({"email": data['email']})
-    
-    # Save temporary user data
-    result = temp_users_collection.insert_one(user_data)
-    temp_user_id = str(result.inserted_id)
+    user_data = temp_user_document(data, hash_password(data['password']))
+    
+    # Save temporary user data, replacing any previous registration for this email
+    try:
+        temp_user = temp_users_collection.find_one_and_update(
+            {"email": data['email']},
+            {"$set": user_data},
+            projection={"_id": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # A concurrent submit for the same email won the upsert race
+        return jsonify({"error": "Registration already in progress for this email"}), 409
+    temp_user_id = str(temp_user['_id'])
     
     # Generate and save OTP
-    otp = generate_otp()
-    otps_collection.insert_one({
-        "userId": ObjectId(temp_user_id),
-        "otp": otp,
-        "created": datetime.datetime.utcnow(),
-        "type": "signup"
-    })
+    otp = issue_otp(temp_user['_id'], "signup")
     
     # Send OTP via email
     send_result = send_otp_email(data['email'], otp, 'signup')
     
     if not send_result:
-        return jsonify({"error": "Failed to send verification email. Please try again."}), 500
+        return jsonify(EMAIL_NOT_SENT[0]), EMAIL_NOT_SENT[1]
     
-    # Print OTP to console for development/testing
-    print(f"OTP for {data['email']}: {otp}")
+    logger.info("Signup OTP issued", extra={"fields": {"email": mask_email(data['email'])}})
     
     return jsonify({
         "message": "Please check your email for OTP to verify your account.", 
@@ -136,71 +250,38 @@ def register():
 
 @auth_bp.route('/verify-otp', methods=['POST'])
 def verify_otp():
-    # First, clean up expired OTPs and temporary users
-    cleanup_expired_otps()
-    cleanup_expired_temp_users()
-    
     data = request.get_json()
     
     # Validate request data
-    if 'userId' not in data or 'otp' not in data:
-        return jsonify({"error": "Missing required fields: userId and otp"}), 400
-    
-    # Find OTP in database
-    otp_record = otps_collection.find_one({
-        "userId": ObjectId(data['userId']),
-        "otp": data['otp'],
-        "type": "signup"
-    })
+    error = validate_request(data, 'verify-otp')
+    if error:
+        return jsonify(error[0]), error[1]
     
-    if not otp_record:
-        return jsonify({"error": "Invalid OTP"}), 400
-    
-    # Check if OTP is expired (5 minutes validity)
-    current_time = datetime.datetime.utcnow()
-    otp_time = otp_record['created']
-    time_diff = (current_time - otp_time).total_seconds()
+    # Consume the OTP; only one of several concurrent submits can get it (5 minutes validity)
+    otp_record, error = consume_otp(ObjectId(data['userId']), data['otp'], "signup")
     
-    if time_diff > OTP_EXPIRY_SECONDS:
-        return jsonify({"error": "OTP expired"}), 400
+    if not otp_record:
+        return jsonify({"error": error}), 400
     
-    # Get temporary user data
-    temp_user = temp_users_collection.find_one({"_id": ObjectId(data['userId'])})
+    # Take the temporary user data
+    temp_user = temp_users_collection.find_one_and_delete({"_id": ObjectId(data['userId'])})
     
     if not temp_user:
         return jsonify({"error": "Registration data expired or not found"}), 400
     
     # Create verified user from temporary data
-    new_user = {
-        "firstName": temp_user['firstName'],
-        "lastName": temp_user['lastName'],
-        "email": temp_user['email'],
-        "password": temp_user['password'].encode('utf-8'),  # Convert back to binary for storage
-        "isVerified": True,
-        "created": datetime.datetime.utcnow()
-    }
+    new_user = verified_user_document(temp_user)
     
-    # Save user to database
-    user_result = users_collection.insert_one(new_user)
+    # Save user to database; the unique email index rejects duplicates
+    try:
+        user_result = users_collection.insert_one(new_user)
+    except DuplicateKeyError:
+        return jsonify({"error": "User already exists"}), 409
     user_id = str(user_result.inserted_id)
-    
-    # Delete OTP and temporary user
-    otps_collection.delete_one({"_id": otp_record['_id']})
-    temp_users_collection.delete_one({"_id": ObjectId(data['userId'])})
+    rollup_writer.record({"signups": 1})
     
     # Generate JWT token
-    token = generate_token(user_id)
-    
-    return jsonify({
-        "message": "Account verified successfully", 
-        "token": token,
-        "user": {
-            "id": user_id,
-            "firstName": new_user['firstName'],
-            "lastName": new_user['lastName'],
-            "email": new_user['email']
-        }
-    }), 200
+    return jsonify(signed_in_response("Account verified successfully", user_id, new_user)), 200
 
 @auth_bp.route('/login', methods=['POST'])
 def login():
@@ -222,14 +303,15 @@ def login():
                 try:
                     data = json.loads(request.data.decode('utf-8'))
                 except:
-                    return jsonify({"error": "Unsupported content type. Please use application/json or application/x-www-form-urlencoded"}), 415
+                    return jsonify(UNSUPPORTED_CONTENT_TYPE[0]), UNSUPPORTED_CONTENT_TYPE[1]
     
     # Log the incoming data format for debugging
-    print(f"Login attempt: Content-Type={request.content_type}, Data format: {type(data)}")
+    logger.debug("Login attempt", extra={"fields": {"contentType": request.content_type}})
     
     # Validate request data
-    if 'email' not in data or 'password' not in data:
-        return jsonify({"error": "Missing required fields: email and password"}), 400
+    error = validate_request(data, 'login')
+    if error:
+        return jsonify(error[0]), error[1]
     
     # Find user in database
     user = users_collection.find_one({"email": data['email']})
@@ -246,44 +328,25 @@ def login():
         return jsonify({"error": "Account not verified", "userId": str(user['_id'])}), 403
     
     # Generate JWT token
-    token = generate_token(str(user['_id']))
-    
-    return jsonify({
-        "message": "Login successful",
-        "token": token,
-        "user": {
-            "id": str(user['_id']),
-            "firstName": user['firstName'],
-            "lastName": user['lastName'],
-            "email": user['email']
-        }
-    }), 200
+    return jsonify(signed_in_response("Login successful", str(user['_id']), user)), 200
 
 @auth_bp.route('/forgot-password', methods=['POST'])
 def forgot_password():
-    # First, clean up expired temporary users
-    cleanup_expired_temp_users()
-    
     data = request.get_json()
     
     # Validate request data
-    if 'email' not in data:
-        return jsonify({"error": "Missing required field: email"}), 400
+    error = validate_request(data, 'forgot-password')
+    if error:
+        return jsonify(error[0]), error[1]
     
     # Find user in database
-    user = users_collection.find_one({"email": data['email']})
+    user = users_collection.find_one({"email": data['email']}, {"_id": 1})
     
     if not user:
         return jsonify({"error": "User not found"}), 404
     
     # Generate and save OTP
-    otp = generate_otp()
-    otps_collection.insert_one({
-        "userId": user['_id'],
-        "otp": otp,
-        "created": datetime.datetime.utcnow(),
-        "type": "reset"
-    })
+    otp = issue_otp(user['_id'], "reset")
     
     # Send OTP via email
     send_otp_email(data['email'], otp, 'reset')
@@ -292,33 +355,18 @@ def forgot_password():
 
 @auth_bp.route('/reset-password', methods=['POST'])
 def reset_password():
-    # First, clean up expired OTPs and temporary users
-    cleanup_expired_otps()
-    cleanup_expired_temp_users()
-    
     data = request.get_json()
     
     # Validate request data
-    if 'userId' not in data or 'otp' not in data or 'newPassword' not in data:
-        return jsonify({"error": "Missing required fields"}), 400
-    
-    # Find OTP in database
-    otp_record = otps_collection.find_one({
-        "userId": ObjectId(data['userId']),
-        "otp": data['otp'],
-        "type": "reset"
-    })
+    error = validate_request(data, 'reset-password')
+    if error:
+        return jsonify(error[0]), error[1]
     
-    if not otp_record:
-        return jsonify({"error": "Invalid OTP"}), 400
-    
-    # Check if OTP is expired (5 minutes validity)
-    current_time = datetime.datetime.utcnow()
-    otp_time = otp_record['created']
-    time_diff = (current_time - otp_time).total_seconds()
+    # Consume the OTP (5 minutes validity)
+    otp_record, error = consume_otp(ObjectId(data['userId']), data['otp'], "reset")
     
-    if time_diff > OTP_EXPIRY_SECONDS:
-        return jsonify({"error": "OTP expired"}), 400
+    if not otp_record:
+        return jsonify({"error": error}), 400
     
     # Update password
     hashed_password = hash_password(data['newPassword'])
@@ -327,23 +375,17 @@ def reset_password():
         {"$set": {"password": hashed_password}}
     )
     
-    # Delete OTP
-    otps_collection.delete_one({"_id": otp_record['_id']})
-    
     return jsonify({"message": "Password reset successful"}), 200
 
 # Add new route for resending OTP
 @auth_bp.route('/resend-otp', methods=['POST'])
 def resend_otp():
-    # First, clean up expired OTPs and temporary users
-    cleanup_expired_otps()
-    cleanup_expired_temp_users()
-    
     data = request.get_json()
     
     # Validate request data
-    if 'userId' not in data:
-        return jsonify({"error": "Missing required field: userId"}), 400
+    error = validate_request(data, 'resend-otp')
+    if error:
+        return jsonify(error[0]), error[1]
     
     # Check if this is for signup or password reset
     otp_type = data.get('type', 'signup')
@@ -351,39 +393,24 @@ def resend_otp():
     # Find user in temporary or users collection based on OTP type
     user = None
     if otp_type == 'signup':
-        user = temp_users_collection.find_one({"_id": ObjectId(data['userId'])})
+        user = temp_users_collection.find_one({"_id": ObjectId(data['userId'])}, {"email": 1})
     else:
-        user = users_collection.find_one({"_id": ObjectId(data['userId'])})
+        user = users_collection.find_one({"_id": ObjectId(data['userId'])}, {"email": 1})
     
     if not user:
         return jsonify({"error": "User not found"}), 404
     
-    # Generate and save new OTP
-    otp = generate_otp()
-    
-    # Delete any existing OTP for this user
-    otps_collection.delete_many({
-        "userId": ObjectId(data['userId']),
-        "type": otp_type
-    })
-    
-    # Save new OTP
-    otps_collection.insert_one({
-        "userId": ObjectId(data['userId']),
-        "otp": otp,
-        "created": datetime.datetime.utcnow(),
-        "type": otp_type
-    })
+    # Generate and save new OTP, replacing any existing one for this user
+    otp = issue_otp(ObjectId(data['userId']), otp_type)
     
     # Send OTP via email
     email = user['email']
     send_result = send_otp_email(email, otp, otp_type)
     
     if not send_result:
-        return jsonify({"error": "Failed to send verification email. Please try again."}), 500
+        return jsonify(EMAIL_NOT_SENT[0]), EMAIL_NOT_SENT[1]
     
-    # Print OTP to console for development/testing
-    print(f"New OTP for {email}: {otp}")
+    logger.info("OTP re-issued", extra={"fields": {"email": mask_email(email), "type": otp_type}})
     
     return jsonify({
         "message": "OTP sent successfully", 
@@ -1,13 +1,28 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, send_from_directory, Response, stream_with_context
 import pymongo
 from bson.objectid import ObjectId
 import os
+import io
+import csv
+import json
+import datetime
 from dotenv import load_dotenv
 from functools import wraps
 from utils.jwt_handler import verify_token
+from utils.logger import get_logger, sampled
+from utils.saliency import request_saliency, SALIENCY_DIR, READY, FAILED
+from utils.rollups import query_rollups, COUNTERS, HOUR, DAY, ROLLUPS_COLLECTION
+from utils.response_cache import cached_user_response
+from utils.embeddings import decode_embedding
+from utils.vector_index import vector_index
+from utils.prediction_schema import (
+    decode_prediction, display_name, result_filter, LIST_FIELDS, LIST_INDEX, LIST_INDEX_NAME, TUMOR, NO_TUMOR
+)
 
 load_dotenv()
 
+logger = get_logger(__name__)
+
 # Initialize dashboard blueprint
 dashboard_bp = Blueprint('dashboard', __name__)
 
@@ -17,6 +32,58 @@ mongo_client = pymongo.MongoClient(mongo_uri)
 db = mongo_client['brain_tumor_detection']
 predictions_collection = db['predictions']
 users_collection = db['users']
+rollups_collection = db[ROLLUPS_COLLECTION]
+
+# Constants
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))
+EXPORT_FIELDS = ["id", "timestamp", "result", "fileName", "imageName", "modelVersion"]
+# Default and maximum time range served by the analytics endpoint
+ANALYTICS_DEFAULT_RANGE = {HOUR: datetime.timedelta(hours=48), DAY: datetime.timedelta(days=30)}
+ANALYTICS_MAX_RANGE = {HOUR: datetime.timedelta(days=31), DAY: datetime.timedelta(days=3 * 366)}
+# Only these users may read site-wide usage analytics; the endpoint is closed while it is empty
+ANALYTICS_USER_IDS = {user_id.strip() for user_id in os.getenv('ANALYTICS_USER_IDS', '').split(',') if user_id.strip()}
+# Default and maximum number of similar cases returned
+SIMILAR_DEFAULT_LIMIT = 5
+SIMILAR_MAX_LIMIT = 50
+
+def ensure_dashboard_indexes():
+    """
+    Per-user history index, sorted by time (also used by date-range exports)
+
+    It carries every field the history list and statistics read, so those
+    queries are answered from the index without loading documents.
+    """
+    predictions_collection.create_index(LIST_INDEX, name=LIST_INDEX_NAME)
+
+def format_prediction(prediction):
+    """
+    The summary of a prediction (either schema version) the dashboard shows
+
+    fileName is the name to show; imageName is the stored file under /uploads.
+    """
+    prediction = decode_prediction(prediction)
+    return {
+        "id": str(prediction["_id"]),
+        "fileName": display_name(prediction),
+        "imageName": prediction["imageName"],
+        "result": prediction["result"],
+        "timestamp": prediction["timestamp"].isoformat()
+    }
+
+def parse_iso_datetime(value):
+    """Parse an ISO date/datetime as naive UTC, like the stored timestamps; raises ValueError if malformed"""
+    parsed = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        # Comparing an offset-aware value with the naive timestamps would raise TypeError
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def parse_date_arg(name):
+    """Parse an optional ISO date/datetime query argument; raises ValueError if malformed"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    return parse_iso_datetime(value)
 
 # Authentication middleware
 def token_required(f):
@@ -44,9 +111,16 @@ def token_required(f):
     
     return decorated
 
+def first_page_cache_key():
+    """Only the first page of history (what the dashboard renders) is cached"""
+    if int(request.args.get('page', 1)) != 1:
+        return None
+    return f"predictions:{int(request.args.get('limit', 10))}"
+
 # Routes
 @dashboard_bp.route('/predictions', methods=['GET'])
 @token_required
+@cached_user_response(first_page_cache_key)
 def get_predictions():
     """Get all predictions for the authenticated user"""
     # Get pagination parameters
@@ -54,64 +128,215 @@ def get_predictions():
     limit = int(request.args.get('limit', 10))
     skip = (page - 1) * limit
     
-    # Get user's predictions from database
-    predictions = list(predictions_collection.find(
-        {"userId": ObjectId(request.user_id)}
-    ).sort("timestamp", pymongo.DESCENDING).skip(skip).limit(limit))
+    # Get user's predictions from database (covered by the history index)
+    predictions = predictions_collection.find(
+        {"userId": ObjectId(request.user_id)}, LIST_FIELDS
+    ).sort("timestamp", pymongo.DESCENDING).skip(skip).limit(limit)
     
     # Count total predictions
     total_predictions = predictions_collection.count_documents({"userId": ObjectId(request.user_id)})
     
-    # Format predictions for response
-    formatted_predictions = []
-    for prediction in predictions:
-        formatted_predictions.append({
-            "id": str(prediction["_id"]),
-            "imageName": prediction["imageName"],
-            "result": prediction["result"],
-            "timestamp": prediction["timestamp"].isoformat()
-        })
-    
     return jsonify({
-        "predictions": formatted_predictions,
+        "predictions": [format_prediction(prediction) for prediction in predictions],
         "total": total_predictions,
         "page": page,
         "limit": limit,
         "totalPages": (total_predictions + limit - 1) // limit
     }), 200
 
+@dashboard_bp.route('/predictions/export', methods=['GET'])
+@token_required
+def export_predictions():
+    """Stream the authenticated user's full prediction history as CSV or NDJSON"""
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({"error": "Unsupported format. Use csv or ndjson"}), 400
+    
+    try:
+        date_from = parse_date_arg('from')
+        date_to = parse_date_arg('to')
+    except ValueError:
+        return jsonify({"error": "Invalid date. Use ISO format, e.g. 2024-01-31"}), 400
+    
+    query = {"userId": ObjectId(request.user_id)}
+    if date_from or date_to:
+        query["timestamp"] = {}
+        if date_from:
+            query["timestamp"]["$gte"] = date_from
+        if date_to:
+            # A bare date includes the whole day
+            if len(request.args['to']) == 10:
+                date_to += datetime.timedelta(days=1)
+                query["timestamp"]["$lt"] = date_to
+            else:
+                query["timestamp"]["$lte"] = date_to
+    
+    # Served by the (userId, timestamp) index; the cursor fetches EXPORT_BATCH_SIZE documents at a time
+    cursor = predictions_collection.find(
+        query,
+        {**LIST_FIELDS, "modelVersion": 1}
+    ).sort("timestamp", pymongo.DESCENDING).batch_size(EXPORT_BATCH_SIZE)
+    
+    def export_row(prediction):
+        prediction = decode_prediction(prediction)
+        return {
+            "id": str(prediction["_id"]),
+            "timestamp": prediction["timestamp"].isoformat(),
+            "result": prediction["result"],
+            "fileName": display_name(prediction),
+            "imageName": prediction["imageName"],
+            "modelVersion": prediction.get("modelVersion")
+        }
+    
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+        for prediction in cursor:
+            writer.writerow(export_row(prediction))
+            # Flush in chunks rather than per row to keep the number of writes down
+            if buffer.tell() >= 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    
+    def generate_ndjson():
+        chunk = []
+        for prediction in cursor:
+            chunk.append(json.dumps(export_row(prediction)))
+            if len(chunk) >= EXPORT_BATCH_SIZE:
+                yield '\n'.join(chunk) + '\n'
+                chunk = []
+        if chunk:
+            yield '\n'.join(chunk) + '\n'
+    
+    timestamp = datetime.datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+    if export_format == 'csv':
+        body, mimetype = generate_csv(), 'text/csv'
+    else:
+        body, mimetype = generate_ndjson(), 'application/x-ndjson'
+    
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={
+            'Content-Disposition': f'attachment; filename="predictions_{timestamp}.{export_format}"',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
 @dashboard_bp.route('/predictions/<prediction_id>', methods=['GET'])
 @token_required
 def get_prediction_by_id(prediction_id):
     """Get a specific prediction by ID"""
     try:
         # Find prediction in database
-        prediction = predictions_collection.find_one({
-            "_id": ObjectId(prediction_id),
-            "userId": ObjectId(request.user_id)
-        })
+        prediction = predictions_collection.find_one(
+            {"_id": ObjectId(prediction_id), "userId": ObjectId(request.user_id)},
+            {**LIST_FIELDS, "saliency": 1}
+        )
         
         if not prediction:
             return jsonify({"error": "Prediction not found"}), 404
         
-        # Format prediction for response
-        formatted_prediction = {
-            "id": str(prediction["_id"]),
-            "imageName": prediction["imageName"],
-            "result": prediction["result"],
-            "timestamp": prediction["timestamp"].isoformat()
-        }
+        formatted_prediction = format_prediction(prediction)
+        
+        # Grad-CAM overlay is generated in the background the first time it is asked for
+        if request.args.get('saliency', '').lower() == 'true':
+            saliency = request_saliency(predictions_collection, prediction)
+            formatted_prediction["saliency"] = {"status": saliency["status"]}
+            if saliency["status"] == READY:
+                formatted_prediction["saliency"]["url"] = f"/api/dashboard/predictions/{prediction_id}/saliency"
         
         return jsonify(formatted_prediction), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@dashboard_bp.route('/predictions/<prediction_id>/saliency', methods=['GET'])
+@token_required
+def get_prediction_saliency(prediction_id):
+    """Serve the cached Grad-CAM overlay, scheduling it on first request"""
+    try:
+        prediction = predictions_collection.find_one(
+            {"_id": ObjectId(prediction_id), "userId": ObjectId(request.user_id)},
+            {"saliency": 1}
+        )
+        
+        if not prediction:
+            return jsonify({"error": "Prediction not found"}), 404
+        
+        saliency = request_saliency(predictions_collection, prediction)
+        if saliency["status"] == READY:
+            response = send_from_directory(SALIENCY_DIR, saliency["imageName"], mimetype='image/png')
+            response.headers['Cache-Control'] = 'private, max-age=86400'
+            return response
+        if saliency["status"] == FAILED:
+            return jsonify({"status": FAILED, "error": "Saliency map could not be generated"}), 500
+        
+        response = jsonify({"status": saliency["status"]})
+        response.headers['Retry-After'] = '2'
+        return response, 202
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@dashboard_bp.route('/predictions/<prediction_id>/similar', methods=['GET'])
+@token_required
+def get_similar_predictions(prediction_id):
+    """Prior scans of the same user whose model embeddings are closest to this one"""
+    try:
+        limit = min(int(request.args.get('limit', SIMILAR_DEFAULT_LIMIT)), SIMILAR_MAX_LIMIT)
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        return jsonify({"error": f"Invalid limit. Use a number from 1 to {SIMILAR_MAX_LIMIT}"}), 400
+    
+    try:
+        prediction = predictions_collection.find_one(
+            {"_id": ObjectId(prediction_id), "userId": ObjectId(request.user_id)},
+            {"embedding": 1, "modelVersion": 1}
+        )
+        
+        if not prediction:
+            return jsonify({"error": "Prediction not found"}), 404
+        
+        # Screened, reused or older predictions have no embedding to compare
+        if "embedding" not in prediction:
+            return jsonify({"id": prediction_id, "similar": []}), 200
+        
+        vector_index.ensure_loaded(predictions_collection)
+        matches = vector_index.search(
+            request.user_id,
+            prediction.get("modelVersion"),
+            decode_embedding(prediction["embedding"]),
+            k=limit,
+            exclude_id=prediction["_id"]
+        )
+        
+        # Fetch the matched predictions in one query and keep the similarity order
+        similar_ids = [match_id for match_id, _ in matches]
+        documents = {
+            document["_id"]: document for document in predictions_collection.find(
+                {"_id": {"$in": similar_ids}, "userId": ObjectId(request.user_id)},
+                LIST_FIELDS
+            )
+        }
+        similar = [
+            {**format_prediction(documents[match_id]), "similarity": round(similarity, 4)}
+            for match_id, similarity in matches if match_id in documents
+        ]
+        
+        return jsonify({"id": prediction_id, "similar": similar}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @dashboard_bp.route('/user-profile', methods=['GET'])
 @token_required
+@cached_user_response(lambda: "user-profile")
 def get_user_profile():
     """Get the authenticated user's profile"""
     # Find user in database
-    user = users_collection.find_one({"_id": ObjectId(request.user_id)})
+    user = users_collection.find_one({"_id": ObjectId(request.user_id)}, {"firstName": 1, "lastName": 1, "email": 1})
     
     if not user:
         return jsonify({"error": "User not found"}), 404
@@ -128,17 +353,18 @@ def get_user_profile():
 
 @dashboard_bp.route('/statistics', methods=['GET'])
 @token_required
+@cached_user_response(lambda: "statistics")
 def get_statistics():
     """Get statistics about the user's predictions"""
     # Count predictions by result
     total_predictions = predictions_collection.count_documents({"userId": ObjectId(request.user_id)})
     tumor_predictions = predictions_collection.count_documents({
         "userId": ObjectId(request.user_id),
-        "result": "Tumor"
+        "result": result_filter(TUMOR)
     })
     no_tumor_predictions = predictions_collection.count_documents({
         "userId": ObjectId(request.user_id),
-        "result": "No Tumor"
+        "result": result_filter(NO_TUMOR)
     })
     
     # Calculate percentages
@@ -148,16 +374,11 @@ def get_statistics():
     # Get the most recent prediction
     most_recent = None
     recent_prediction = list(predictions_collection.find(
-        {"userId": ObjectId(request.user_id)}
+        {"userId": ObjectId(request.user_id)}, LIST_FIELDS
     ).sort("timestamp", pymongo.DESCENDING).limit(1))
     
     if recent_prediction:
-        most_recent = {
-            "id": str(recent_prediction[0]["_id"]),
-            "imageName": recent_prediction[0]["imageName"],
-            "result": recent_prediction[0]["result"],
-            "timestamp": recent_prediction[0]["timestamp"].isoformat()
-        }
+        most_recent = format_prediction(recent_prediction[0])
     
     return jsonify({
         "totalPredictions": total_predictions,
@@ -174,29 +395,30 @@ def get_public_statistics():
     try:
         # Count total registered users
         total_users = users_collection.count_documents({})
-        print(f"Total registered users: {total_users}")
         
         # Count total predictions
         total_predictions = predictions_collection.count_documents({})
-        print(f"Total predictions: {total_predictions}")
         
         # Get visitor count from the visitors collection
         visitors_collection = db.get_collection('visitors')
         if visitors_collection is None:
-            print("Visitors collection doesn't exist, creating it now")
+            logger.info("Visitors collection doesn't exist, creating it now")
             db.create_collection('visitors')
             visitors_collection = db['visitors']
             total_visitors = 0
         else:
             total_visitors = visitors_collection.count_documents({})
         
-        print(f"Total visitors: {total_visitors}")
-        
         # Count predictions by result
-        tumor_predictions = predictions_collection.count_documents({"result": "Tumor"})
-        no_tumor_predictions = predictions_collection.count_documents({"result": "No Tumor"})
+        tumor_predictions = predictions_collection.count_documents({"result": result_filter(TUMOR)})
+        no_tumor_predictions = predictions_collection.count_documents({"result": result_filter(NO_TUMOR)})
         
-        print(f"Statistics summary: {total_users} users, {total_visitors} visitors, {total_predictions} predictions")
+        if sampled('public_statistics'):
+            logger.info("Public statistics served", extra={"fields": {
+                "users": total_users,
+                "visitors": total_visitors,
+                "predictions": total_predictions
+            }})
         
         return jsonify({
             "totalUsers": total_users,
@@ -206,5 +428,40 @@ def get_public_statistics():
             "noTumorPredictions": no_tumor_predictions
         }), 200
     except Exception as e:
-        print(f"Error getting public statistics: {str(e)}")
-        return jsonify({"error": str(e)}), 500 
\ No newline at end of file
+        logger.exception(f"Error getting public statistics: {str(e)}")
+        return jsonify({"error": str(e)}), 500 
+
+@dashboard_bp.route('/analytics', methods=['GET'])
+@token_required
+def get_usage_analytics():
+    """Site-wide usage trends served from pre-aggregated hourly/daily rollups (ANALYTICS_USER_IDS only)"""
+    if request.user_id not in ANALYTICS_USER_IDS:
+        return jsonify({'error': 'Not allowed'}), 403
+    
+    granularity = request.args.get('granularity', DAY).lower()
+    if granularity not in (HOUR, DAY):
+        return jsonify({"error": "Unsupported granularity. Use hour or day"}), 400
+    
+    try:
+        date_from = parse_date_arg('from')
+        date_to = parse_date_arg('to')
+    except ValueError:
+        return jsonify({"error": "Invalid date. Use ISO format, e.g. 2024-01-31"}), 400
+    
+    date_to = date_to or datetime.datetime.utcnow()
+    date_from = date_from or date_to - ANALYTICS_DEFAULT_RANGE[granularity]
+    if date_from >= date_to:
+        return jsonify({"error": "'from' must be before 'to'"}), 400
+    if date_to - date_from > ANALYTICS_MAX_RANGE[granularity]:
+        return jsonify({"error": f"Time range too large for {granularity} granularity"}), 400
+    
+    buckets = query_rollups(rollups_collection, granularity, date_from, date_to)
+    totals = {name: sum(bucket[name] for bucket in buckets) for name in COUNTERS}
+    
+    return jsonify({
+        "granularity": granularity,
+        "from": date_from.isoformat(),
+        "to": date_to.isoformat(),
+        "buckets": buckets,
+        "totals": totals
+    }), 200
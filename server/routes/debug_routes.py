@@ -0,0 +1,75 @@
+from flask import Blueprint, request, jsonify
+import gc
+import os
+from dotenv import load_dotenv
+from functools import wraps
+from utils.jwt_handler import verify_token
+from utils.logger import get_logger
+from utils.memory_diagnostics import memory_report, start_tracemalloc, stop_tracemalloc
+
+load_dotenv()
+
+logger = get_logger(__name__)
+
+# Initialize debug blueprint
+debug_bp = Blueprint('debug', __name__)
+
+# Only these users may read diagnostics; the endpoints are closed while it is empty
+DEBUG_USER_IDS = {user_id.strip() for user_id in os.getenv('DEBUG_USER_IDS', '').split(',') if user_id.strip()}
+
+# Authentication middleware
+def debug_access_required(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        token = None
+
+        # Check if token is in the request header
+        if 'Authorization' in request.headers:
+            auth_header = request.headers['Authorization']
+            if auth_header.startswith('Bearer '):
+                token = auth_header.split(" ")[1]
+
+        if not token:
+            return jsonify({'error': 'Token is missing'}), 401
+
+        # Verify token
+        user_id = verify_token(token)
+        if not user_id:
+            return jsonify({'error': 'Invalid or expired token'}), 401
+
+        if user_id not in DEBUG_USER_IDS:
+            return jsonify({'error': 'Not allowed'}), 403
+
+        # Add user_id to the request context
+        request.user_id = user_id
+        return f(*args, **kwargs)
+
+    return decorated
+
+# Routes
+@debug_bp.route('/memory', methods=['GET'])
+@debug_access_required
+def get_memory():
+    """RSS, TF allocator stats, per-endpoint memory deltas and (if tracing) top Python allocations"""
+    top = min(int(request.args.get('top', 20)), 100)
+    report = {}
+    if request.args.get('gc', '').lower() == 'true':
+        # Collect first so the numbers show what is actually retained
+        report["gcCollected"] = gc.collect()
+    report.update(memory_report(top=top))
+    return jsonify(report), 200
+
+@debug_bp.route('/memory/tracemalloc', methods=['POST'])
+@debug_access_required
+def toggle_tracemalloc():
+    """Start or stop Python heap tracing ({"action": "start" | "stop"})"""
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    if action == 'start':
+        start_tracemalloc()
+    elif action == 'stop':
+        stop_tracemalloc()
+    else:
+        return jsonify({'error': "action must be 'start' or 'stop'"}), 400
+    logger.info(f"tracemalloc {action}ed", extra={"fields": {"userId": request.user_id}})
+    return jsonify({"tracing": action == 'start'}), 200
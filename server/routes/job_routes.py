@@ -0,0 +1,291 @@
+from flask import Blueprint, request, jsonify, Response
+import os
+import json
+import time
+import hmac
+import secrets
+import hashlib
+import datetime
+import pymongo
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from dotenv import load_dotenv
+from utils.jwt_handler import verify_token
+from utils.logger import get_logger
+from utils.job_queue import BackgroundWorkerPool
+from utils.upload_intake import intake_upload, UploadRejected
+from utils.admission import anonymous_rate_limiter, Overloaded
+from utils.inference_scheduler import BATCH
+from routes.predict_routes import (
+    predict_tumor, store_prediction, public_result, store_upload, upload_path,
+    busy_response
+)
+
+load_dotenv()
+
+logger = get_logger(__name__)
+
+# Initialize prediction jobs blueprint
+jobs_bp = Blueprint('jobs', __name__)
+
+# MongoDB connection
+mongo_uri = os.getenv('MONGO_URI', 'mongodb://localhost:27017')
+mongo_client = pymongo.MongoClient(mongo_uri)
+db = mongo_client['brain_tumor_detection']
+prediction_jobs_collection = db['prediction_jobs']
+
+# Constants
+PREDICTION_JOB_WORKERS = int(os.getenv('PREDICTION_JOB_WORKERS', '2'))
+PREDICTION_JOB_QUEUE = int(os.getenv('PREDICTION_JOB_QUEUE', '100'))
+PREDICTION_JOB_MAX_ATTEMPTS = int(os.getenv('PREDICTION_JOB_MAX_ATTEMPTS', '5'))
+JOB_EVENTS_TIMEOUT_SECONDS = int(os.getenv('JOB_EVENTS_TIMEOUT_SECONDS', '300'))
+JOB_STALE_SECONDS = 600  # a running job not updated for this long is assumed lost
+JOB_EVENTS_POLL_SECONDS = 1
+JOB_EVENTS_RETRY_MS = 2000  # EventSource reconnect delay when each connection sends one status
+SSE_KEEPALIVE_SECONDS = 15
+
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+TERMINAL_STATUSES = {COMPLETED, FAILED}
+
+def _update_job(job_id, fields):
+    fields["updated"] = datetime.datetime.utcnow()
+    prediction_jobs_collection.update_one({"_id": job_id}, {"$set": fields})
+
+def process_job(job_id):
+    """Run one queued prediction job (called from a background worker)"""
+    # Claim the job atomically so it runs at most once even if it was queued twice
+    job = prediction_jobs_collection.find_one_and_update(
+        {"_id": job_id, "status": QUEUED},
+        {"$set": {"status": RUNNING, "updated": datetime.datetime.utcnow()}},
+        return_document=pymongo.ReturnDocument.AFTER
+    )
+    if not job:
+        return
+
+    user_id = str(job["userId"]) if job.get("userId") else None
+    try:
+        attempt = 0
+        while True:
+            try:
+                with open(upload_path(job["imageName"]), 'rb') as f:
+                    prediction_result = predict_tumor(f, BATCH, user_id or job.get("clientIp"), user_id)
+                break
+            except Overloaded as e:
+                attempt += 1
+                if attempt >= PREDICTION_JOB_MAX_ATTEMPTS:
+                    logger.warning(f"Prediction job {job_id} gave up after {attempt} busy attempts")
+                    _update_job(job_id, {"status": FAILED, "error": "Server is busy, please resubmit the image"})
+                    return
+                # Background jobs wait their turn, backing off while inference stays busy
+                time.sleep(e.retry_after * 2 ** (attempt - 1))
+
+        if prediction_result is None:
+            _update_job(job_id, {"status": FAILED, "error": "Error processing image"})
+            return
+
+        prediction_record = store_prediction(prediction_result, job["imageName"], user_id, name=job.get("name"))
+        _update_job(job_id, {
+            "status": COMPLETED,
+            "result": public_result(prediction_result),
+            "predictionId": prediction_record.get("_id")
+        })
+    except Exception as e:
+        logger.exception(f"Prediction job {job_id} failed: {str(e)}")
+        _update_job(job_id, {"status": FAILED, "error": "Error processing image"})
+
+job_workers = BackgroundWorkerPool('prediction-job', process_job, PREDICTION_JOB_WORKERS, PREDICTION_JOB_QUEUE)
+
+def recover_pending_jobs():
+    """Re-queue jobs left behind by a restart (queued, or running but stale)"""
+    prediction_jobs_collection.create_index([("status", pymongo.ASCENDING), ("updated", pymongo.ASCENDING)])
+    stale_time = datetime.datetime.utcnow() - datetime.timedelta(seconds=JOB_STALE_SECONDS)
+    prediction_jobs_collection.update_many(
+        {"status": RUNNING, "updated": {"$lt": stale_time}},
+        {"$set": {"status": QUEUED, "updated": datetime.datetime.utcnow()}}
+    )
+    recovered = 0
+    for job in prediction_jobs_collection.find({"status": QUEUED}, {"_id": 1}):
+        if not job_workers.submit(job["_id"]):
+            break
+        recovered += 1
+    if recovered:
+        logger.info(f"Re-queued {recovered} pending prediction jobs")
+    return recovered
+
+def hash_job_key(job_key):
+    return hashlib.sha256(job_key.encode()).hexdigest()
+
+def job_urls(job_id, job_key=None):
+    """Status and events URLs of a job; an anonymous job's key travels as the `key` query parameter"""
+    query = f"?key={job_key}" if job_key else ""
+    return f"/api/predict/jobs/{job_id}{query}", f"/api/predict/jobs/{job_id}/events{query}"
+
+def read_job_credentials(req, allow_query_token=False):
+    """
+    Read the optional bearer token and job key of a Flask or Quart request
+
+    Returns:
+        tuple: (token or None, job key or None)
+    """
+    token = None
+    auth_header = req.headers.get('Authorization', '')
+    if auth_header.startswith('Bearer '):
+        token = auth_header.split(" ")[1]
+    elif allow_query_token:
+        # EventSource cannot set headers, so SSE clients may pass the token as a query parameter
+        token = req.args.get('token')
+    job_key = req.headers.get('X-Job-Key') or req.args.get('key')
+    return token, job_key
+
+def job_visible_to(job, user_id, job_key):
+    """Signed-in users see their own jobs; an anonymous job needs the key returned when it was created"""
+    if job.get("userId"):
+        return str(job["userId"]) == user_id
+    if not job.get("keyHash") or not job_key:
+        return False
+    return hmac.compare_digest(job["keyHash"], hash_job_key(job_key))
+
+def format_job_event(job):
+    return f"event: status\ndata: {json.dumps(format_job(job))}\n\n"
+
+def get_request_user_id(allow_query_token=False):
+    """
+    Resolve the optional bearer token of the request
+
+    Returns:
+        tuple: (user_id or None, error response or None)
+    """
+    token, _ = read_job_credentials(request, allow_query_token)
+    if not token:
+        return None, None
+    user_id = verify_token(token)
+    if not user_id:
+        return None, (jsonify({'error': 'Invalid or expired token'}), 401)
+    return user_id, None
+
+def format_job(job):
+    formatted_job = {
+        "jobId": str(job["_id"]),
+        "status": job["status"],
+        "created": job["created"].isoformat(),
+        "updated": job["updated"].isoformat()
+    }
+    if job["status"] == COMPLETED:
+        formatted_job["result"] = job.get("result")
+        if job.get("userId") and job.get("predictionId"):
+            formatted_job["predictionId"] = str(job["predictionId"])
+    elif job["status"] == FAILED:
+        formatted_job["error"] = job.get("error")
+    return formatted_job
+
+def find_job_for_request(job_id, allow_query_token=False):
+    """
+    Load a job and check the caller may see it
+
+    Returns:
+        tuple: (job or None, error response or None)
+    """
+    user_id, error = get_request_user_id(allow_query_token)
+    if error:
+        return None, error
+    try:
+        job = prediction_jobs_collection.find_one({"_id": ObjectId(job_id)})
+    except InvalidId:
+        job = None
+    if not job or not job_visible_to(job, user_id, read_job_credentials(request)[1]):
+        return None, (jsonify({"error": "Job not found"}), 404)
+    return job, None
+
+# Routes
+@jobs_bp.route('/', methods=['POST'])
+def create_job():
+    """Accept an image for asynchronous prediction and return 202 with a job id"""
+    user_id, error = get_request_user_id()
+    if error:
+        return error
+
+    if not user_id:
+        allowed, retry_after = anonymous_rate_limiter.allow(request.remote_addr)
+        if not allowed:
+            return busy_response('Too many requests, please slow down', retry_after, 429)
+
+    # Check if image is in the request
+    if 'image' not in request.files:
+        return jsonify({'error': 'No image file provided'}), 400
+
+    file = request.files['image']
+
+    # Validate size, format and dimensions from the header before accepting the job
+    try:
+        upload = intake_upload(file)
+    except UploadRejected as e:
+        return jsonify({'error': e.message}), e.status_code
+
+    # The upload must outlive this request, so store it before queuing
+    image_name, created = store_upload(upload)
+
+    # Anonymous jobs are only readable with this key, so a guessed job id reveals nothing
+    job_key = None if user_id else secrets.token_urlsafe(16)
+    now = datetime.datetime.utcnow()
+    job = {
+        "userId": ObjectId(user_id) if user_id else None,
+        "clientIp": request.remote_addr,
+        "imageName": image_name,
+        "name": upload['name'],
+        "status": QUEUED,
+        "created": now,
+        "updated": now
+    }
+    if job_key:
+        job["keyHash"] = hash_job_key(job_key)
+    job_id = prediction_jobs_collection.insert_one(job).inserted_id
+
+    if not job_workers.submit(job_id):
+        prediction_jobs_collection.delete_one({"_id": job_id})
+        if created:
+            # Only remove the file if no earlier prediction shares it
+            os.remove(upload_path(image_name))
+        return busy_response('Prediction queue is full, please retry shortly', 5)
+
+    status_url, events_url = job_urls(job_id, job_key)
+    body = {
+        "jobId": str(job_id),
+        "status": QUEUED,
+        "statusUrl": status_url,
+        "eventsUrl": events_url
+    }
+    if job_key:
+        body["jobKey"] = job_key
+    response = jsonify(body)
+    response.headers['Location'] = status_url
+    return response, 202
+
+@jobs_bp.route('/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Poll the status of a prediction job"""
+    job, error = find_job_for_request(job_id)
+    if error:
+        return error
+    return jsonify(format_job(job)), 200
+
+@jobs_bp.route('/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    """
+    Server-sent events for a job's status
+
+    A sync worker is not held for the life of a job: each connection gets
+    the current status and EventSource reconnects after JOB_EVENTS_RETRY_MS.
+    The async serving mode (asgi_app.py) streams changes on one connection.
+    """
+    job, error = find_job_for_request(job_id, allow_query_token=True)
+    if error:
+        return error
+
+    return Response(
+        f"retry: {JOB_EVENTS_RETRY_MS}\n{format_job_event(job)}",
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
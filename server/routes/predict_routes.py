@@ -2,19 +2,33 @@ from flask import Blueprint, request, jsonify
 import os
 import pymongo
 from bson.objectid import ObjectId
-import tensorflow as tf
-from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing import image
 import numpy as np
-from PIL import Image
-import io
+import uuid
+import shutil
 import datetime
 from dotenv import load_dotenv
 from functools import wraps
 from utils.jwt_handler import verify_token
+from utils.logger import get_logger
+from utils.upload_intake import intake_upload, UploadRejected
+from utils.admission import anonymous_rate_limiter, Overloaded
+from utils.inference_scheduler import inference_scheduler, AUTHENTICATED, ANONYMOUS, BATCH
+from utils.screening_model import load_screening_model, should_escalate
+from utils.perceptual_hash import phash_index, PHASH_DEDUP_ENABLED
+from utils.model_registry import model_registry
+from utils.rollups import rollup_writer, prediction_counters
+from utils.response_cache import response_cache
+from utils.embeddings import to_embeddings, encode_embedding
+from utils.vector_index import vector_index
+from utils.memory_diagnostics import track_memory
+from utils.write_behind import WriteBehindWriter
+from utils.preprocess_pool import preprocess_pool, decode_image, gather_rows, PreprocessError, TARGET_SIZE
+from utils.prediction_schema import build_document, hash_image, image_filename, IMAGE_EXTENSIONS
 
 load_dotenv()
 
+logger = get_logger(__name__)
+
 # Initialize prediction blueprint
 predict_bp = Blueprint('predict', __name__)
 
@@ -23,19 +37,22 @@ mongo_uri = os.getenv('MONGO_URI', 'mongodb://localhost:27017')
 mongo_client = pymongo.MongoClient(mongo_uri)
 db = mongo_client['brain_tumor_detection']
 predictions_collection = db['predictions']
+shadow_predictions_collection = db['shadow_predictions']
+
+def invalidate_flushed_users(records):
+    """A dashboard read between submit and flush may have cached the old list; drop it now the records are visible"""
+    for user_id in {record["userId"] for record in records if record.get("userId")}:
+        response_cache.bump(user_id)
+
+# Prediction records are written in batches after the response (see utils/write_behind.py for durability)
+prediction_writer = WriteBehindWriter(predictions_collection, 'predictions', on_flushed=invalidate_flushed_users)
 
-# Global model variable
-model = None
+# Uploaded images are stored alongside the server code
+UPLOAD_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'uploads')
 
 def load_prediction_model():
-    global model
-    if model is None:
-        model_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'model', 'vgg19_ML_Model.h5')
-        if os.path.exists(model_path):
-            model = load_model(model_path)
-        else:
-            raise FileNotFoundError(f"Model file not found at {model_path}")
-    return model
+    """Return the currently active model (see utils/model_registry.py for versioning)"""
+    return model_registry.get_active().model
 
 # Authentication middleware
 def token_required(f):
@@ -64,109 +81,275 @@ def token_required(f):
     return decorated
 
 # Helper functions
-def preprocess_image(img_data, target_size=(240, 240)):
-    """Preprocess the image for the model"""
-    img = Image.open(io.BytesIO(img_data))
-    img = img.convert('RGB')  # Convert to RGB
-    img = img.resize(target_size)  # Resize to target size
-    img_array = image.img_to_array(img)
-    img_array = np.expand_dims(img_array, axis=0)
-    img_array = img_array / 255.0  # Normalize
-    return img_array
-
-def predict_tumor(img_data):
-    """Make prediction on the image"""
+def preprocess_image(img_data, target_size=TARGET_SIZE):
+    """Preprocess the image for the model on this thread (accepts raw bytes or a file-like stream)"""
+    return np.expand_dims(decode_image(img_data, target_size), axis=0)
+
+def interpret_score(score):
+    """Turn the model's sigmoid output into a result and confidence (percent)"""
+    # Get result (assuming binary classification)
+    result = "Tumor" if score < 0.5 else "No Tumor"
+    confidence = float(score) if result == "Tumor" else float(1 - score)
+    return result, confidence * 100
+
+def run_inference(processed_img):
+    """
+    Score a preprocessed batch, screening first when the cascade is enabled
+
+    Returns:
+        tuple: (scores, stages, model_version, embeddings) where each stage is
+        "screen" if the lightweight model decided that image and "vgg19" if it
+        was escalated to the full model; model_version is None if VGG19 did not
+        run; embeddings holds a float16 vector per image, or None for images
+        VGG19 did not see (or when embeddings are unavailable)
+    """
+    batch_size = processed_img.shape[0]
+    scores = np.zeros(batch_size, dtype=np.float32)
+    stages = ["vgg19"] * batch_size
+    escalate = np.ones(batch_size, dtype=bool)
+    embeddings = [None] * batch_size
+    
+    screener = load_screening_model()
+    if screener is not None:
+        scores = screener.predict(processed_img).astype(np.float32)
+        escalate = np.array([should_escalate(score) for score in scores])
+        stages = ["vgg19" if uncertain else "screen" for uncertain in escalate]
+        if not escalate.any():
+            return scores, stages, None, embeddings
+    
+    # Hold on to one handle so a concurrent hot-swap cannot change the model mid-request
+    handle = model_registry.get_active()
+    
+    logger.debug("Running model inference", extra={"fields": {"inputShape": processed_img.shape}})
+    
+    # Make prediction; the dual-output model also yields penultimate activations in the same pass
+    rows = np.flatnonzero(escalate)
+    # Without a copy when every image is escalated (e.g. no screener)
+    escalated_imgs = gather_rows(processed_img, rows)
+    if handle.dual_model is not None:
+        prediction, activations = handle.dual_model.predict(escalated_imgs, verbose=0)
+        for row, embedding in zip(rows, to_embeddings(activations, handle.version)):
+            embeddings[row] = embedding
+    else:
+        prediction = handle.model.predict(escalated_imgs, verbose=0)
+    scores[escalate] = prediction[:, 0]
+    
+    # Compare a sampled fraction against the candidate model in the background
+    model_registry.maybe_shadow(escalated_imgs[:1], handle.version, prediction[0][0], shadow_predictions_collection)
+    return scores, stages, handle.version, embeddings
+
+def find_near_duplicate(phash, user_id=None):
+    """Return (prediction_id, result, confidence, model_version) of the user's own prior near-identical scan, or None"""
+    if not PHASH_DEDUP_ENABLED or not user_id:
+        return None
+    phash_index.ensure_loaded(predictions_collection)
+    # Only reuse results produced by the model version currently being served
+    return phash_index.find(phash, user_id, model_registry.active_version())
+
+def predict_tumor(img_data, request_class=BATCH, user_key=None, user_id=None):
+    """
+    Make prediction on the image
+    
+    The image is decoded by the preprocess workers before an inference slot
+    is requested, so decoding overlaps other requests' inference. A result
+    is only reused from an earlier scan of the same `user_id`.
+    
+    Raises:
+        Overloaded: If the request is not admitted to inference
+    """
     try:
-        # Load model if not loaded
-        model = load_prediction_model()
-        
-        # Preprocess image
-        processed_img = preprocess_image(img_data)
-        
-        # Print shape for debugging
-        print(f"Input shape to model: {processed_img.shape}")
-        
-        # Make prediction
-        prediction = model.predict(processed_img)
-        
-        # Get result (assuming binary classification)
-        result = "Tumor" if prediction[0][0] < 0.5 else "No Tumor"
-        
-        # Store confidence for database but don't return it
-        confidence = float(prediction[0][0]) if result == "Tumor" else float(1 - prediction[0][0])
+        with preprocess_pool.preprocess([img_data]) as (processed_img, phashes):
+            with inference_scheduler.slot(request_class, user_key):
+                return predict_preprocessed(processed_img, phashes[0], user_id)
+    except PreprocessError as e:
+        logger.exception(f"Error preprocessing image: {str(e)}")
+        return None
+
+def predict_preprocessed(processed_img, phash, user_id=None):
+    """Predict a preprocessed (1, height, width, 3) image with its perceptual hash for `user_id`"""
+    try:
+        # Reuse the result of a near-identical earlier scan instead of running the model again
+        duplicate = find_near_duplicate(phash, user_id) if phash else None
+        if duplicate:
+            reused_from, result, confidence, model_version = duplicate
+            stage = "phash"
+            embedding = None
+        else:
+            reused_from = None
+            scores, stages, model_version, embeddings = run_inference(processed_img)
+            result, confidence = interpret_score(scores[0])
+            stage = stages[0]
+            embedding = embeddings[0]
         
         # Return only the result without confidence
         prediction_result = {
             "result": result
         }
         
-        # Store the confidence internally for database records
-        prediction_result['_confidence'] = confidence * 100
+        # Store the confidence, deciding stage and image hash internally for database records
+        prediction_result['_confidence'] = confidence
+        prediction_result['_decidedBy'] = stage
+        prediction_result['_phash'] = phash
+        if model_version:
+            prediction_result['_modelVersion'] = model_version
+        if reused_from:
+            prediction_result['_reusedFrom'] = reused_from
+        if embedding is not None:
+            prediction_result['_embedding'] = embedding
         
         return prediction_result
     except Exception as e:
-        print(f"Error during prediction: {str(e)}")
+        logger.exception(f"Error during prediction: {str(e)}")
         return None
 
+def build_prediction_record(prediction_result, image_name, user_id=None, name=None):
+    """Build the prediction document stored in the database (see utils/prediction_schema.py)"""
+    prediction_record = build_document(
+        ObjectId(user_id) if user_id else None,  # No userId indicates anonymous/unregistered user
+        image_name,
+        prediction_result["result"],
+        prediction_result.get("_confidence", 0),  # Use internal confidence for database
+        prediction_result.get("_decidedBy", "vgg19"),
+        datetime.datetime.utcnow(),
+        name
+    )
+    if prediction_result.get("_modelVersion"):
+        prediction_record["modelVersion"] = prediction_result["_modelVersion"]
+    if prediction_result.get("_phash"):
+        prediction_record["phash"] = prediction_result["_phash"]
+    if prediction_result.get("_reusedFrom"):
+        prediction_record["reusedFrom"] = prediction_result["_reusedFrom"]
+    if prediction_result.get("_embedding") is not None:
+        prediction_record["embedding"] = encode_embedding(prediction_result["_embedding"])
+    return prediction_record
+
+def store_prediction(prediction_result, image_name, user_id=None, extra_fields=None, name=None):
+    """
+    Persist a prediction (plus any extra fields, e.g. the study it belongs to) and return the stored record
+
+    `name` is the file name the user uploaded, shown in the dashboard.
+    """
+    prediction_record = build_prediction_record(prediction_result, image_name, user_id, name)
+    prediction_record.update(extra_fields or {})
+    prediction_writer.submit(prediction_record)
+    if user_id:
+        # The user's cached dashboard responses are now stale
+        response_cache.bump(user_id)
+    rollup_writer.record(
+        prediction_counters(prediction_result["result"], user_id is None),
+        prediction_record["timestamp"]
+    )
+    
+    # Only original results go into the near-duplicate index
+    if PHASH_DEDUP_ENABLED and "phash" in prediction_record and "reusedFrom" not in prediction_record:
+        phash_index.add(
+            prediction_record["phash"],
+            prediction_record["_id"],
+            prediction_result["result"],
+            prediction_result.get("_confidence", 0),
+            prediction_record.get("modelVersion"),
+            user_id
+        )
+    
+    # Index the user's own scans for similar-case retrieval
+    if user_id and prediction_result.get("_embedding") is not None:
+        vector_index.add(user_id, prediction_record.get("modelVersion"), prediction_record["_id"], prediction_result["_embedding"])
+    return prediction_record
+
+def public_result(prediction_result):
+    """Strip internal fields (prefixed with _) before sending the result to the client"""
+    return {key: value for key, value in prediction_result.items() if not key.startswith('_')}
+
+def upload_path(filename):
+    """Absolute path of a file in the uploads directory"""
+    return os.path.join(UPLOAD_DIR, filename)
+
 def save_image(image_data, filename):
-    """Save the image to uploads directory"""
-    upload_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'uploads')
-    os.makedirs(upload_dir, exist_ok=True)
+    """Save the image (raw bytes or a file-like stream) to uploads directory"""
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
     
-    file_path = os.path.join(upload_dir, filename)
+    file_path = upload_path(filename)
     with open(file_path, 'wb') as f:
-        f.write(image_data)
+        if hasattr(image_data, 'read'):
+            image_data.seek(0)
+            shutil.copyfileobj(image_data, f)
+        else:
+            f.write(image_data)
     
     return file_path
 
+def busy_response(message, retry_after, status_code=503):
+    """Build an error response asking the client to back off"""
+    response = jsonify({'error': message})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, status_code
+
+def store_upload(upload):
+    """
+    Save an upload under its content hash; identical images share one file
+
+    Returns:
+        tuple: (filename, created) where created is False if the file already existed
+    """
+    filename = image_filename(hash_image(upload['stream']), IMAGE_EXTENSIONS[upload['format']])
+    file_path = upload_path(filename)
+    if os.path.exists(file_path):
+        # Refresh the age retention uses, so a reused file is not purged as old
+        try:
+            os.utime(file_path)
+            return filename, False
+        except FileNotFoundError:
+            # Retention removed it just now; write it again
+            pass
+    # Write under a temporary name so a concurrent identical upload never sees a partial file
+    temp_name = f".{filename}.{uuid.uuid4().hex}"
+    save_image(upload['stream'], temp_name)
+    os.replace(upload_path(temp_name), file_path)
+    return filename, True
+
 # Routes
 @predict_bp.route('/', methods=['POST'])
+@track_memory
 def predict_without_auth():
     """Endpoint for prediction without authentication (result is saved anonymously)"""
+    # Per-IP token bucket so anonymous tryouts cannot flood the model
+    allowed, retry_after = anonymous_rate_limiter.allow(request.remote_addr)
+    if not allowed:
+        return busy_response('Too many requests, please slow down', retry_after, 429)
+    
     # Check if image is in the request
     if 'image' not in request.files:
         return jsonify({'error': 'No image file provided'}), 400
     
     file = request.files['image']
     
-    # Check if the file is allowed
-    allowed_extensions = {'jpg', 'jpeg', 'png'}
-    if '.' not in file.filename or file.filename.rsplit('.', 1)[1].lower() not in allowed_extensions:
-        return jsonify({'error': 'Invalid file format. Please upload JPG or PNG image'}), 400
-    
-    # Read image data
-    image_data = file.read()
+    # Validate size, format and dimensions from the header before decoding
+    try:
+        upload = intake_upload(file)
+    except UploadRejected as e:
+        return jsonify({'error': e.message}), e.status_code
     
-    # Predict tumor
-    prediction_result = predict_tumor(image_data)
+    # Predict tumor (decoded from the spooled upload stream, then run once admitted)
+    try:
+        prediction_result = predict_tumor(upload['stream'], ANONYMOUS, request.remote_addr)
+    except Overloaded as e:
+        return busy_response(e.message, e.retry_after)
     
     if prediction_result is None:
         return jsonify({'error': 'Error processing image'}), 500
     
     # Save image to uploads directory
-    unique_filename = f"{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_{file.filename}"
-    save_image(image_data, unique_filename)
+    image_name, _ = store_upload(upload)
     
     # Save prediction to database with confidence, but without a user ID
-    prediction_record = {
-        "userId": None,  # Null userId indicates anonymous/unregistered user
-        "imageName": unique_filename,
-        "result": prediction_result["result"],
-        "confidence": prediction_result.get("_confidence", 0),
-        "timestamp": datetime.datetime.utcnow(),
-        "isAnonymous": True  # Flag to identify predictions from unregistered users
-    }
-    
-    predictions_collection.insert_one(prediction_record)
+    store_prediction(prediction_result, image_name, name=upload['name'])
     
-    # Remove internal confidence before sending response
-    if '_confidence' in prediction_result:
-        del prediction_result['_confidence']
-    
-    return jsonify(prediction_result), 200
+    # Remove internal fields before sending response
+    return jsonify(public_result(prediction_result)), 200
 
 @predict_bp.route('/authenticated', methods=['POST'])
 @token_required
+@track_memory
 def predict_with_auth():
     """Endpoint for prediction with authentication (result saved to database)"""
     # Check if image is in the request
@@ -175,37 +358,26 @@ def predict_with_auth():
     
     file = request.files['image']
     
-    # Check if the file is allowed
-    allowed_extensions = {'jpg', 'jpeg', 'png'}
-    if '.' not in file.filename or file.filename.rsplit('.', 1)[1].lower() not in allowed_extensions:
-        return jsonify({'error': 'Invalid file format. Please upload JPG or PNG image'}), 400
-    
-    # Read image data
-    image_data = file.read()
+    # Validate size, format and dimensions from the header before decoding
+    try:
+        upload = intake_upload(file)
+    except UploadRejected as e:
+        return jsonify({'error': e.message}), e.status_code
     
-    # Predict tumor
-    prediction_result = predict_tumor(image_data)
+    # Predict tumor (decoded from the spooled upload stream, then run once admitted)
+    try:
+        prediction_result = predict_tumor(upload['stream'], AUTHENTICATED, request.user_id, request.user_id)
+    except Overloaded as e:
+        return busy_response(e.message, e.retry_after)
     
     if prediction_result is None:
         return jsonify({'error': 'Error processing image'}), 500
     
     # Save image to uploads directory
-    unique_filename = f"{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_{file.filename}"
-    save_image(image_data, unique_filename)
+    image_name, _ = store_upload(upload)
     
     # Save prediction to database with confidence
-    prediction_record = {
-        "userId": ObjectId(request.user_id),
-        "imageName": unique_filename,
-        "result": prediction_result["result"],
-        "confidence": prediction_result.get("_confidence", 0),  # Use internal confidence for database
-        "timestamp": datetime.datetime.utcnow()
-    }
-    
-    predictions_collection.insert_one(prediction_record)
-    
-    # Remove internal confidence before sending response
-    if '_confidence' in prediction_result:
-        del prediction_result['_confidence']
+    store_prediction(prediction_result, image_name, request.user_id, name=upload['name'])
     
-    return jsonify(prediction_result), 200 
\ No newline at end of file
+    # Remove internal fields before sending response
+    return jsonify(public_result(prediction_result)), 200 
\ No newline at end of file
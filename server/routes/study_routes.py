@@ -0,0 +1,178 @@
+from flask import Blueprint, request, jsonify
+import os
+import datetime
+import pymongo
+import numpy as np
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from dotenv import load_dotenv
+from utils.logger import get_logger
+from utils.upload_intake import intake_upload, UploadRejected
+from utils.admission import Overloaded
+from utils.inference_scheduler import inference_scheduler, BATCH
+from utils.preprocess_pool import preprocess_pool, PreprocessError
+from utils.memory_diagnostics import track_memory
+from routes.predict_routes import (
+    token_required, run_inference, interpret_score, store_prediction,
+    store_upload, busy_response
+)
+
+load_dotenv()
+
+logger = get_logger(__name__)
+
+# Initialize studies blueprint
+studies_bp = Blueprint('studies', __name__)
+
+# MongoDB connection
+mongo_uri = os.getenv('MONGO_URI', 'mongodb://localhost:27017')
+mongo_client = pymongo.MongoClient(mongo_uri)
+db = mongo_client['brain_tumor_detection']
+studies_collection = db['studies']
+
+# Constants
+MAX_STUDY_SLICES = int(os.getenv('MAX_STUDY_SLICES', '64'))
+# Slices per model call; keep WARMUP_BATCH_SIZES in line so the first study is not slow
+STUDY_BATCH_SIZE = int(os.getenv('STUDY_BATCH_SIZE', '16'))
+# The study score is the mean tumor probability of its most suspicious slices
+STUDY_TOP_SLICES = int(os.getenv('STUDY_TOP_SLICES', '3'))
+# Request body limit for study uploads (single-image endpoints keep the per-image limit)
+MAX_STUDY_BYTES = int(os.getenv('MAX_STUDY_BYTES', str(200 * 1024 * 1024)))  # 200 MB
+STUDIES_PATH = '/api/predict/studies'
+
+def aggregate_slices(scores, top_k=STUDY_TOP_SLICES):
+    """
+    Combine per-slice model scores into a study-level score
+
+    The model's score is low for tumor, so a slice's tumor probability is
+    1 - score. A tumor usually shows on a few slices only, so the study is
+    scored on its top-k slices rather than the mean over all of them.
+
+    Returns:
+        tuple: (study score on the model's scale, indices of the top slices, most suspicious first)
+    """
+    tumor_probabilities = 1.0 - np.asarray(scores, dtype=np.float32)
+    top = np.argsort(-tumor_probabilities)[:max(1, min(top_k, len(scores)))]
+    return float(1.0 - tumor_probabilities[top].mean()), [int(index) for index in top]
+
+def score_slices(processed_slices):
+    """Run the (n, height, width, 3) slice batch through the model in batches of STUDY_BATCH_SIZE"""
+    scores, stages, embeddings = [], [], []
+    model_version = None
+    for start in range(0, len(processed_slices), STUDY_BATCH_SIZE):
+        batch = processed_slices[start:start + STUDY_BATCH_SIZE]
+        batch_scores, batch_stages, batch_version, batch_embeddings = run_inference(batch)
+        scores.extend(float(score) for score in batch_scores)
+        stages.extend(batch_stages)
+        embeddings.extend(batch_embeddings)
+        model_version = batch_version or model_version
+    return scores, stages, model_version, embeddings
+
+def ensure_study_indexes():
+    studies_collection.create_index([("userId", pymongo.ASCENDING), ("timestamp", pymongo.DESCENDING)])
+
+def format_study(study):
+    return {
+        "studyId": str(study["_id"]),
+        "result": study["result"],
+        "sliceCount": study["sliceCount"],
+        "topSlices": [
+            {"sliceIndex": top["sliceIndex"], "predictionId": str(top["predictionId"]), "result": top["result"]}
+            for top in study["topSlices"]
+        ],
+        "slices": [str(prediction_id) for prediction_id in study["slices"]],
+        "timestamp": study["timestamp"].isoformat()
+    }
+
+# Routes
+@studies_bp.route('/', methods=['POST'])
+@token_required
+@track_memory
+def create_study():
+    """Predict a whole study (ordered slices in `slices` form fields) in one batched request"""
+    files = request.files.getlist('slices')
+    if not files:
+        return jsonify({'error': 'No slices provided'}), 400
+    if len(files) > MAX_STUDY_SLICES:
+        return jsonify({'error': f'A study may have at most {MAX_STUDY_SLICES} slices'}), 400
+
+    # Validate every slice from its header before decoding any of them
+    uploads = []
+    for index, file in enumerate(files):
+        try:
+            uploads.append(intake_upload(file))
+        except UploadRejected as e:
+            return jsonify({'error': f'Slice {index}: {e.message}'}), e.status_code
+
+    # Slices are decoded in parallel by the preprocess workers before the study waits for inference
+    try:
+        with preprocess_pool.preprocess([upload['stream'] for upload in uploads]) as (processed_slices, phashes):
+            # A study is one admission in the batch class, so it cannot starve single-image traffic
+            with inference_scheduler.slot(BATCH, request.user_id):
+                scores, stages, model_version, embeddings = score_slices(processed_slices)
+    except PreprocessError as e:
+        logger.exception(f"Error preprocessing study slices: {str(e)}")
+        return jsonify({'error': 'Error processing image'}), 500
+    except Overloaded as e:
+        return busy_response(e.message, e.retry_after)
+    except Exception as e:
+        logger.exception(f"Error during study inference: {str(e)}")
+        return jsonify({'error': 'Error processing image'}), 500
+
+    study_id = ObjectId()
+    slice_ids = []
+    slice_results = []
+    for index, upload in enumerate(uploads):
+        result, confidence = interpret_score(scores[index])
+        prediction_result = {
+            "result": result,
+            "_confidence": confidence,
+            "_decidedBy": stages[index],
+            "_phash": phashes[index]
+        }
+        if model_version:
+            prediction_result["_modelVersion"] = model_version
+        if embeddings[index] is not None:
+            prediction_result["_embedding"] = embeddings[index]
+
+        image_name, _ = store_upload(upload)
+        record = store_prediction(prediction_result, image_name, request.user_id,
+                                  {"studyId": study_id, "sliceIndex": index}, upload['name'])
+        slice_ids.append(record["_id"])
+        slice_results.append(result)
+
+    study_score, top_slices = aggregate_slices(scores)
+    result, confidence = interpret_score(study_score)
+    study = {
+        "_id": study_id,
+        "userId": ObjectId(request.user_id),
+        "result": result,
+        "confidence": confidence,
+        "aggregation": f"top{len(top_slices)}-mean",
+        "sliceCount": len(files),
+        "slices": slice_ids,
+        "topSlices": [
+            {"sliceIndex": index, "predictionId": slice_ids[index], "result": slice_results[index],
+             "confidence": interpret_score(scores[index])[1]}
+            for index in top_slices
+        ],
+        "timestamp": datetime.datetime.utcnow()
+    }
+    if model_version:
+        study["modelVersion"] = model_version
+    studies_collection.insert_one(study)
+
+    logger.info("Study predicted", extra={"fields": {"studyId": str(study_id), "slices": len(files)}})
+    return jsonify(format_study(study)), 201
+
+@studies_bp.route('/<study_id>', methods=['GET'])
+@token_required
+def get_study(study_id):
+    """Get one of the user's studies"""
+    try:
+        study = studies_collection.find_one({"_id": ObjectId(study_id), "userId": ObjectId(request.user_id)})
+    except InvalidId:
+        study = None
+    if not study:
+        return jsonify({"error": "Study not found"}), 404
+    return jsonify(format_study(study)), 200
@@ -0,0 +1,163 @@
+import os
+import sys
+import csv
+import argparse
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+def list_images(image_dir, limit=None):
+    """Paths of the JPG/PNG files in a directory, sorted"""
+    paths = sorted(
+        os.path.join(image_dir, name) for name in os.listdir(image_dir)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    return paths[:limit] if limit else paths
+
+def iter_image_batches(paths, batch_size=16):
+    """Preprocess images batch_size at a time, so only one batch is ever decoded in memory"""
+    from routes.predict_routes import preprocess_image
+
+    for start in range(0, len(paths), batch_size):
+        batch = []
+        for path in paths[start:start + batch_size]:
+            with open(path, 'rb') as f:
+                batch.append(preprocess_image(f)[0])
+        yield paths[start:start + batch_size], np.stack(batch).astype(np.float32)
+
+def score_images(paths, batch_size=16, on_batch=None):
+    """
+    Run VGG19 over the images a batch at a time, keeping only screener features
+
+    Returns:
+        tuple: (features, teacher) with one row of extract_features() and one
+        VGG19 score per image; on_batch(batch_paths, batch_features,
+        batch_teacher) is called after each batch
+    """
+    from utils.screening_model import extract_features
+
+    features, teacher = [], []
+    for batch_paths, processed_imgs in iter_image_batches(paths, batch_size):
+        batch_teacher = teacher_scores(processed_imgs, batch_size)
+        batch_features = extract_features(processed_imgs)
+        features.append(batch_features)
+        teacher.append(batch_teacher)
+        if on_batch:
+            on_batch(batch_paths, batch_features, batch_teacher)
+        print(f"Scored {sum(len(batch) for batch in teacher)}/{len(paths)} images", end='\r', flush=True)
+    print()
+    return np.concatenate(features), np.concatenate(teacher)
+
+def teacher_scores(processed_imgs, batch_size=16):
+    """Run the full VGG19 model over a batch"""
+    from routes.predict_routes import load_prediction_model
+
+    model = load_prediction_model()
+    scores = []
+    for start in range(0, len(processed_imgs), batch_size):
+        scores.append(model.predict(processed_imgs[start:start + batch_size], verbose=0)[:, 0])
+    return np.concatenate(scores)
+
+def cascade_metrics(screen, teacher, lower, upper):
+    """Escalation rate and agreement with VGG19 for one uncertainty band"""
+    escalated = (screen >= lower) & (screen <= upper)
+    decided = ~escalated
+    agreement = ((screen[decided] < 0.5) == (teacher[decided] < 0.5)).mean() if decided.any() else 1.0
+    return {
+        "escalationRate": float(escalated.mean()),
+        "screenedAgreement": float(agreement),
+        # Overall agreement counts escalated images as matching since VGG19 decides them
+        "overallAgreement": float(1 - (1 - agreement) * decided.mean())
+    }
+
+def train(args):
+    from utils.screening_model import ScreeningModel, SCREENING_MODEL_PATH
+
+    paths = list_images(args.image_dir, args.limit)
+    if len(paths) == 0:
+        print(f"No images found in {args.image_dir}")
+        return 1
+    print(f"Computing VGG19 outputs for {len(paths)} images...")
+    features, teacher = score_images(paths, args.batch_size)
+
+    print("Distilling screening model...")
+    screener = ScreeningModel.fit(features, teacher, epochs=args.epochs, learning_rate=args.learning_rate)
+    output = args.output or SCREENING_MODEL_PATH
+    screener.save(output)
+    print(f"Saved screening model to {output}")
+
+    metrics = cascade_metrics(screener.predict_features(features), teacher, args.lower, args.upper)
+    print(f"Training-set escalation rate: {metrics['escalationRate']:.1%}, "
+          f"agreement on screened images: {metrics['screenedAgreement']:.1%}")
+    return 0
+
+def report(args):
+    from utils.screening_model import ScreeningModel, SCREENING_MODEL_PATH
+
+    model_path = args.model or SCREENING_MODEL_PATH
+    if not os.path.exists(model_path):
+        print(f"Screening model not found at {model_path}; run 'train' first")
+        return 1
+    screener = ScreeningModel.load(model_path)
+
+    paths = list_images(args.image_dir, args.limit)
+    if len(paths) == 0:
+        print(f"No images found in {args.image_dir}")
+        return 1
+
+    scores_file = open(args.scores, 'w', newline='') if args.scores else None
+    try:
+        on_batch = None
+        if scores_file:
+            writer = csv.writer(scores_file)
+            writer.writerow(['path', 'screen', 'vgg19'])
+
+            def on_batch(batch_paths, batch_features, batch_teacher):
+                # Written per batch, so an interrupted run keeps what it scored
+                batch_screen = screener.predict_features(batch_features)
+                writer.writerows(zip(batch_paths, batch_screen.round(6), batch_teacher.round(6)))
+                scores_file.flush()
+
+        features, teacher = score_images(paths, args.batch_size, on_batch)
+    finally:
+        if scores_file:
+            scores_file.close()
+    screen = screener.predict_features(features)
+
+    print(f"Evaluated {len(paths)} images from {args.image_dir}\n")
+    print(f"{'band':>14}  {'escalated':>9}  {'screened agree':>14}  {'overall agree':>13}")
+    bands = [(args.lower, args.upper)] + [(0.5 - w, 0.5 + w) for w in (0.1, 0.2, 0.3, 0.4, 0.45, 0.49)]
+    for lower, upper in bands:
+        metrics = cascade_metrics(screen, teacher, lower, upper)
+        print(f"[{lower:.2f}, {upper:.2f}]  {metrics['escalationRate']:>9.1%}  "
+              f"{metrics['screenedAgreement']:>14.1%}  {metrics['overallAgreement']:>13.1%}")
+    return 0
+
+if __name__ == "__main__":
+    from utils.screening_model import CASCADE_LOWER, CASCADE_UPPER
+
+    parser = argparse.ArgumentParser(description="Train and evaluate the cascade screening model")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    train_parser = subparsers.add_parser('train', help="Distill a screening model from VGG19 outputs on local images")
+    train_parser.add_argument('image_dir')
+    train_parser.add_argument('--output', help="Where to write the model (default: SCREENING_MODEL_PATH)")
+    train_parser.add_argument('--epochs', type=int, default=300)
+    train_parser.add_argument('--learning-rate', type=float, default=0.1)
+
+    report_parser = subparsers.add_parser('report', help="Report escalation rate and agreement with VGG19")
+    report_parser.add_argument('image_dir')
+    report_parser.add_argument('--model', help="Screening model path (default: SCREENING_MODEL_PATH)")
+    report_parser.add_argument('--scores', help="Also write each image's screener and VGG19 scores to this CSV")
+
+    for sub in (train_parser, report_parser):
+        sub.add_argument('--limit', type=int, help="Only use the first N images")
+        sub.add_argument('--batch-size', type=int, default=16, help="Images decoded and scored at a time (default: 16)")
+        sub.add_argument('--lower', type=float, default=CASCADE_LOWER)
+        sub.add_argument('--upper', type=float, default=CASCADE_UPPER)
+
+    args = parser.parse_args()
+    sys.exit(train(args) if args.command == 'train' else report(args))
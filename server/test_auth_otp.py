@@ -0,0 +1,78 @@
+import datetime
+import threading
+import mongomock
+import pytest
+from bson.objectid import ObjectId
+import routes.auth_routes as auth_routes
+from routes.auth_routes import issue_otp, consume_otp, OTP_EXPIRY_SECONDS
+
+class AtomicCollection:
+    """mongomock collection whose find_one_and_delete is atomic, as it is on a MongoDB server"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self._lock = threading.Lock()
+
+    def find_one_and_delete(self, *args, **kwargs):
+        with self._lock:
+            return self.collection.find_one_and_delete(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+@pytest.fixture
+def otps(monkeypatch):
+    collection = AtomicCollection(mongomock.MongoClient()['test']['otps'])
+    monkeypatch.setattr(auth_routes, 'otps_collection', collection)
+    return collection
+
+def test_concurrent_consumes_let_exactly_one_win(otps):
+    user_id = ObjectId()
+    otp = issue_otp(user_id, "signup")
+    attempts = 8
+    barrier = threading.Barrier(attempts)
+    results = []
+
+    def consume():
+        barrier.wait()
+        results.append(consume_otp(user_id, otp, "signup"))
+
+    threads = [threading.Thread(target=consume) for _ in range(attempts)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    winners = [record for record, _ in results if record]
+    assert len(winners) == 1
+    assert winners[0]["otp"] == otp
+    assert sorted(error for _, error in results if error) == ["Invalid OTP"] * (attempts - 1)
+
+def test_expired_and_invalid_otps_are_told_apart(otps):
+    user_id = ObjectId()
+    otp = issue_otp(user_id, "reset")
+    wrong = "000000" if otp != "000000" else "111111"
+    assert consume_otp(user_id, wrong, "reset") == (None, "Invalid OTP")
+    # The code is right but for another flow
+    assert consume_otp(user_id, otp, "signup") == (None, "Invalid OTP")
+
+    created = datetime.datetime.utcnow() - datetime.timedelta(seconds=OTP_EXPIRY_SECONDS + 1)
+    otps.update_one({"userId": user_id, "type": "reset"}, {"$set": {"created": created}})
+    assert consume_otp(user_id, otp, "reset") == (None, "OTP expired")
+    assert consume_otp(user_id, wrong, "reset") == (None, "Invalid OTP")
+
+def test_reissuing_replaces_the_previous_otp(otps, monkeypatch):
+    codes = iter(["111111", "222222", "333333"])
+    monkeypatch.setattr(auth_routes, 'generate_otp', lambda: next(codes))
+    user_id = ObjectId()
+    first = issue_otp(user_id, "signup")
+    second = issue_otp(user_id, "signup")
+    # Another flow's OTP is kept alongside
+    reset = issue_otp(user_id, "reset")
+
+    assert otps.count_documents({"userId": user_id, "type": "signup"}) == 1
+    assert consume_otp(user_id, first, "signup") == (None, "Invalid OTP")
+    record, error = consume_otp(user_id, second, "signup")
+    assert error is None and record["otp"] == second
+    assert consume_otp(user_id, reset, "reset")[1] is None
+    assert otps.count_documents({}) == 0
@@ -0,0 +1,99 @@
+import asyncio
+import pytest
+import mongomock
+from flask import Flask
+
+# The async serving mode's dependencies (requirements-async.txt) plus mongomock-motor
+pytest.importorskip("quart")
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+from quart import Quart
+from utils.jwt_handler import verify_token
+from utils.rollups import rollup_writer
+import routes.auth_routes as auth_routes
+import routes.async_auth_routes as async_auth_routes
+
+MALFORMED_ID = "not-an-object-id"
+REGISTERED = "<registered>"  # replaced by the userId the registration returned
+
+# The same sequence of (path, body) requests is sent to both apps
+REQUESTS = [
+    ('/register', {'firstName': 'A', 'lastName': 'B', 'email': 'a@b.c'}),
+    ('/register', {'firstName': 'A', 'lastName': 'B', 'email': 'a@b.c', 'password': 'pw'}),
+    ('/verify-otp', {'userId': REGISTERED}),
+    ('/verify-otp', {'userId': MALFORMED_ID, 'otp': '123456'}),
+    ('/verify-otp', {'userId': REGISTERED, 'otp': '000000'}),
+    ('/verify-otp', {'userId': REGISTERED, 'otp': '123456'}),
+    ('/login', {'email': 'a@b.c', 'password': 'wrong'}),
+    ('/login', {'email': 'a@b.c', 'password': 'pw'}),
+    ('/forgot-password', {'email': 'nobody@b.c'}),
+    ('/reset-password', {'userId': MALFORMED_ID, 'otp': '123456', 'newPassword': 'pw2'}),
+    ('/resend-otp', {'userId': MALFORMED_ID}),
+    ('/resend-otp', {'userId': REGISTERED}),
+]
+
+def fill(body, user_id):
+    return {key: user_id if value == REGISTERED else value for key, value in body.items()}
+
+def normalize(body):
+    # Ids and tokens differ between the two databases and clocks; check them separately
+    body = dict(body)
+    for key in ('userId', 'token'):
+        if key in body:
+            body[key] = '<%s>' % key
+    if 'user' in body:
+        body['user'] = {**body['user'], 'id': '<id>'}
+    return body
+
+@pytest.fixture
+def patched(monkeypatch):
+    sync_db = mongomock.MongoClient()['test']
+    async_db = mongomock_motor.AsyncMongoMockClient()['test']
+    for name in ('users', 'otps', 'temp_users'):
+        monkeypatch.setattr(auth_routes, f'{name}_collection', sync_db[name])
+        monkeypatch.setattr(async_auth_routes, f'{name}_collection', async_db[name])
+
+    async def sent(*args):
+        return True
+    monkeypatch.setattr(auth_routes, 'send_otp_email', lambda *args: True)
+    monkeypatch.setattr(async_auth_routes, 'send_otp_email_async', sent)
+    monkeypatch.setattr(auth_routes, 'generate_otp', lambda: '123456')
+    monkeypatch.setattr(async_auth_routes, 'generate_otp', lambda: '123456')
+    monkeypatch.setattr(rollup_writer, 'record', lambda *args, **kwargs: None)
+
+def run_sync():
+    app = Flask(__name__)
+    app.register_blueprint(auth_routes.auth_bp, url_prefix='/api/auth')
+    client = app.test_client()
+    responses = []
+    user_id = None
+    for path, body in REQUESTS:
+        response = client.post('/api/auth' + path, json=fill(body, user_id))
+        responses.append((response.status_code, response.get_json()))
+        user_id = user_id or response.get_json().get('userId')
+    return responses
+
+async def run_async():
+    app = Quart(__name__)
+    app.register_blueprint(async_auth_routes.auth_async_bp, url_prefix='/api/auth')
+    client = app.test_client()
+    responses = []
+    user_id = None
+    for path, body in REQUESTS:
+        response = await client.post('/api/auth' + path, json=fill(body, user_id))
+        data = await response.get_json()
+        responses.append((response.status_code, data))
+        user_id = user_id or data.get('userId')
+    return responses
+
+def test_sync_and_async_routes_respond_alike(patched):
+    sync_responses = run_sync()
+    async_responses = asyncio.run(run_async())
+    assert [(status, normalize(body)) for status, body in sync_responses] == \
+        [(status, normalize(body)) for status, body in async_responses]
+
+    statuses = [status for status, _ in sync_responses]
+    assert statuses == [400, 201, 400, 400, 400, 200, 401, 200, 404, 400, 400, 404]
+    assert sync_responses[3][1] == {"error": "Invalid userId"}
+    for responses in (sync_responses, async_responses):
+        assert verify_token(responses[7][1]['token']) == responses[7][1]['user']['id']
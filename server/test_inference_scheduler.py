@@ -0,0 +1,140 @@
+import time
+import threading
+import pytest
+from utils import admission
+from utils.admission import Overloaded, TokenBucketLimiter
+from utils.inference_scheduler import InferenceScheduler, AUTHENTICATED, ANONYMOUS, BATCH
+
+def make_scheduler(weights=None, max_queue=32, queue_timeout=10, max_queued_per_user=32):
+    weights = weights or {AUTHENTICATED: 6.0, BATCH: 2.0, ANONYMOUS: 1.0}
+    return InferenceScheduler(1, max_queue, queue_timeout, weights, max_queued_per_user)
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+def queue_waiters(scheduler, requests, order):
+    """Queue (request_class, user_key, label) requests one at a time; each records its label once admitted"""
+    def run(request_class, user_key, label):
+        with scheduler.slot(request_class, user_key):
+            order.append(label)
+
+    threads = []
+    for request_class, user_key, label in requests:
+        waiting = scheduler.stats()["waiting"]
+        thread = threading.Thread(target=run, args=(request_class, user_key, label))
+        thread.start()
+        # Queue in a known order
+        wait_until(lambda: scheduler.stats()["waiting"] == waiting + 1)
+        threads.append(thread)
+    return threads
+
+def test_classes_share_slots_by_weight():
+    scheduler = make_scheduler({AUTHENTICATED: 3.0, ANONYMOUS: 1.0})
+    order = []
+    with scheduler.slot(AUTHENTICATED, 'holder'):
+        # Anonymous requests queue first, yet authenticated ones get three slots for each of theirs
+        requests = [(ANONYMOUS, f'ip-{n}', ANONYMOUS) for n in range(8)]
+        requests += [(AUTHENTICATED, f'user-{n}', AUTHENTICATED) for n in range(8)]
+        threads = queue_waiters(scheduler, requests, order)
+    for thread in threads:
+        thread.join(5)
+    assert order[:8].count(AUTHENTICATED) == 6
+    assert order.count(ANONYMOUS) == order.count(AUTHENTICATED) == 8
+
+def test_users_in_a_class_are_served_round_robin():
+    scheduler = make_scheduler()
+    order = []
+    with scheduler.slot(BATCH, 'holder'):
+        requests = [(BATCH, 'a', 'a')] * 3 + [(BATCH, 'b', 'b')] * 3
+        threads = queue_waiters(scheduler, requests, order)
+    for thread in threads:
+        thread.join(5)
+    assert order == ['a', 'b', 'a', 'b', 'a', 'b']
+
+def test_full_queue_rejects_with_retry_after():
+    scheduler = make_scheduler(max_queue=1)
+    order = []
+    with scheduler.slot(AUTHENTICATED, 'holder'):
+        threads = queue_waiters(scheduler, [(AUTHENTICATED, 'a', 'a')], order)
+        with pytest.raises(Overloaded) as busy:
+            scheduler.acquire(AUTHENTICATED, 'b')
+        assert busy.value.retry_after >= 1
+    for thread in threads:
+        thread.join(5)
+    assert order == ['a']
+    assert scheduler.stats()["classes"][AUTHENTICATED]["rejected"] == 1
+
+def test_per_user_queue_limit():
+    scheduler = make_scheduler(max_queued_per_user=1)
+    order = []
+    with scheduler.slot(ANONYMOUS, 'holder'):
+        threads = queue_waiters(scheduler, [(ANONYMOUS, 'ip-1', 'first')], order)
+        with pytest.raises(Overloaded):
+            scheduler.acquire(ANONYMOUS, 'ip-1')
+        # Another user still gets a place in the queue
+        threads += queue_waiters(scheduler, [(ANONYMOUS, 'ip-2', 'second')], order)
+    for thread in threads:
+        thread.join(5)
+    assert order == ['first', 'second']
+
+def test_queue_timeout_raises_and_leaves_the_queue():
+    scheduler = make_scheduler(queue_timeout=0.05)
+    with scheduler.slot(BATCH, 'holder'):
+        with pytest.raises(Overloaded) as busy:
+            scheduler.acquire(BATCH, 'a')
+        assert busy.value.retry_after >= 1
+        assert scheduler.stats()["waiting"] == 0
+    assert scheduler.stats()["active"] == 0
+
+def test_slot_is_released_when_inference_raises():
+    scheduler = make_scheduler(queue_timeout=0.05)
+    with pytest.raises(ValueError):
+        with scheduler.slot(AUTHENTICATED, 'a'):
+            raise ValueError("model failed")
+    stats = scheduler.stats()
+    assert stats["active"] == 0
+    assert stats["classes"][AUTHENTICATED]["active"] == 0
+    # The single slot is free again, so this does not wait for the timeout
+    with scheduler.slot(AUTHENTICATED, 'b'):
+        assert scheduler.stats()["active"] == 1
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+def test_token_bucket_allows_burst_then_refills(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(admission, 'time', clock)
+    limiter = TokenBucketLimiter(rate_per_minute=30, burst=2)
+    assert limiter.allow('ip-1') == (True, 0)
+    assert limiter.allow('ip-1') == (True, 0)
+    # One token every two seconds
+    assert limiter.allow('ip-1') == (False, 2)
+    # Buckets are per key
+    assert limiter.allow('ip-2') == (True, 0)
+    clock.now += 1
+    assert limiter.allow('ip-1') == (False, 1)
+    clock.now += 1
+    assert limiter.allow('ip-1') == (True, 0)
+    assert limiter.allow('ip-1')[0] is False
+
+def test_token_bucket_prunes_refilled_keys(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(admission, 'time', clock)
+    limiter = TokenBucketLimiter(rate_per_minute=60, burst=1, max_keys=2)
+    limiter.allow('ip-1')
+    limiter.allow('ip-2')
+    clock.now += 5
+    limiter.allow('ip-3')
+    # ip-1 and ip-2 had refilled completely, so they carried no state
+    assert set(limiter._buckets) == {'ip-3'}
+
+def test_token_bucket_without_rate_never_limits():
+    limiter = TokenBucketLimiter(rate_per_minute=0, burst=1)
+    assert all(limiter.allow('ip-1') == (True, 0) for _ in range(10))
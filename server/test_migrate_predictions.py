@@ -0,0 +1,108 @@
+import os
+import datetime
+import mongomock
+import pytest
+from flask import Flask
+from bson.objectid import ObjectId
+import routes.dashboard_routes as dashboard_routes
+from routes.dashboard_routes import dashboard_bp
+from utils import response_cache as cache_module
+from utils.jwt_handler import generate_token
+from utils.prediction_schema import decode_prediction, display_name
+from migrate_predictions import migrate_predictions
+
+USER_ID = ObjectId()
+IMAGE_BYTES = b'\x89PNG\r\n\x1a\n' + b'scan' * 64
+
+def v1_documents():
+    """Predictions as the server wrote them before schema version 2"""
+    base = datetime.datetime(2024, 1, 1, 12, 0)
+    return [
+        {"_id": ObjectId(), "userId": USER_ID, "imageName": "20240101_120000_scan.png", "result": "Tumor",
+         "confidence": 87.35, "decidedBy": "vgg19", "isAnonymous": False, "timestamp": base},
+        {"_id": ObjectId(), "userId": USER_ID, "imageName": "20240101_130000_gone.png", "result": "No Tumor",
+         "confidence": 99.5, "decidedBy": "screen", "isAnonymous": False,
+         "timestamp": base + datetime.timedelta(hours=1)},
+        {"_id": ObjectId(), "userId": None, "imageName": "20240101_140000_anon.png", "result": "No Tumor",
+         "confidence": 61.0, "decidedBy": "phash", "isAnonymous": True,
+         "timestamp": base + datetime.timedelta(hours=2)},
+    ]
+
+@pytest.fixture
+def db(monkeypatch):
+    db = mongomock.MongoClient()['test']
+    monkeypatch.setattr(dashboard_routes, 'predictions_collection', db['predictions'])
+    monkeypatch.setattr(cache_module, 'RESPONSE_CACHE_ENABLED', False)
+    return db
+
+@pytest.fixture
+def upload_dir(tmp_path):
+    for name in ("20240101_120000_scan.png", "20240101_140000_anon.png"):
+        (tmp_path / name).write_bytes(IMAGE_BYTES)
+    return str(tmp_path)
+
+def dashboard_responses(db):
+    app = Flask(__name__)
+    app.register_blueprint(dashboard_bp, url_prefix='/api/dashboard')
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {generate_token(str(USER_ID))}'}
+    responses = [client.get('/api/dashboard/predictions', headers=headers).get_json()]
+    for prediction in db['predictions'].find({"userId": USER_ID}).sort("_id", 1):
+        responses.append(client.get(f'/api/dashboard/predictions/{prediction["_id"]}', headers=headers).get_json())
+    return responses
+
+def without_image_names(value):
+    if isinstance(value, dict):
+        return {key: without_image_names(item) for key, item in value.items() if key not in ("imageName", "name")}
+    if isinstance(value, list):
+        return [without_image_names(item) for item in value]
+    return value
+
+def test_migrated_documents_read_like_version_1(db, upload_dir):
+    db['predictions'].insert_many(v1_documents())
+    before_api = dashboard_responses(db)
+    before = {doc["_id"]: decode_prediction(doc) for doc in db['predictions'].find()}
+
+    stats = migrate_predictions(db, batch_size=2, upload_dir=upload_dir)
+    assert stats == {"converted": 3, "filesMoved": 2, "filesRemoved": 2, "missingFiles": 1}
+    assert db['predictions'].count_documents({"v": 2}) == 3
+
+    # Only the stored names of re-filed uploads change; the name shown stays the same
+    after_api = dashboard_responses(db)
+    assert without_image_names(after_api) == without_image_names(before_api)
+    assert after_api[0]["predictions"][1]["fileName"] == "20240101_120000_scan.png"
+    after = {doc["_id"]: decode_prediction(doc) for doc in db['predictions'].find()}
+    assert {_id: display_name(prediction) for _id, prediction in after.items()} == {
+        _id: prediction["imageName"] for _id, prediction in before.items()
+    }
+    assert without_image_names(after) == without_image_names(before)
+
+    for _id, prediction in after.items():
+        if prediction["imageName"] == before[_id]["imageName"]:
+            # Its file was missing, so it keeps the old name
+            assert not os.path.exists(os.path.join(upload_dir, prediction["imageName"]))
+            continue
+        with open(os.path.join(upload_dir, prediction["imageName"]), 'rb') as f:
+            assert f.read() == IMAGE_BYTES
+        assert not os.path.exists(os.path.join(upload_dir, before[_id]["imageName"]))
+    # Both uploads had the same content, so they now share one file
+    assert len(os.listdir(upload_dir)) == 1
+
+def test_second_run_changes_nothing(db, upload_dir):
+    db['predictions'].insert_many(v1_documents())
+    migrate_predictions(db, upload_dir=upload_dir)
+    documents = list(db['predictions'].find().sort("_id", 1))
+    files = sorted(os.listdir(upload_dir))
+
+    stats = migrate_predictions(db, upload_dir=upload_dir)
+    assert stats == {"converted": 0, "filesMoved": 0, "filesRemoved": 0, "missingFiles": 0}
+    assert list(db['predictions'].find().sort("_id", 1)) == documents
+    assert sorted(os.listdir(upload_dir)) == files
+
+def test_dry_run_only_counts(db, upload_dir):
+    db['predictions'].insert_many(v1_documents())
+    documents = list(db['predictions'].find().sort("_id", 1))
+    stats = migrate_predictions(db, dry_run=True, upload_dir=upload_dir)
+    assert stats["converted"] == 3
+    assert list(db['predictions'].find().sort("_id", 1)) == documents
+    assert len(os.listdir(upload_dir)) == 2
@@ -0,0 +1,18 @@
+import os
+from utils import model_registry as registry_module
+from utils.model_registry import ModelRegistry
+
+
+def add_version(model_dir, version):
+    version_dir = os.path.join(model_dir, 'versions', version)
+    os.makedirs(version_dir)
+    open(os.path.join(version_dir, 'model.h5'), 'wb').close()
+
+
+def test_newest_version_is_chosen_by_number(tmp_path, monkeypatch):
+    monkeypatch.setattr(registry_module, 'MODEL_VERSION', None)
+    for version in ('v9', 'v10', 'v2'):
+        add_version(str(tmp_path), version)
+    registry = ModelRegistry(str(tmp_path))
+    assert list(registry.list_versions()) == ['v2', 'v9', 'v10']
+    assert registry.resolve_active_version() == 'v10'
@@ -0,0 +1,57 @@
+import io
+import numpy as np
+from PIL import Image
+from utils.perceptual_hash import compute_phash, hamming_distance, BKTree, PerceptualHashIndex
+from utils.prediction_schema import TUMOR, NO_TUMOR
+
+def make_scan(seed, size=(320, 320)):
+    rng = np.random.default_rng(seed)
+    # Smooth random blobs look more like a scan than white noise
+    coarse = rng.random((10, 10)) * 255
+    return Image.fromarray(coarse.astype(np.uint8)).resize(size, Image.BICUBIC).convert('RGB')
+
+def to_model_input(img):
+    img = img.convert('RGB').resize((240, 240))
+    return np.expand_dims(np.asarray(img, dtype=np.float32) / 255.0, axis=0)
+
+def reexport(img, quality, size):
+    buffer = io.BytesIO()
+    img.resize(size).save(buffer, format='JPEG', quality=quality)
+    buffer.seek(0)
+    return Image.open(buffer)
+
+def test_reexported_scan_hashes_close():
+    scan = make_scan(1)
+    original = int(compute_phash(to_model_input(scan)), 16)
+    reexported = int(compute_phash(to_model_input(reexport(scan, 40, (256, 256)))), 16)
+    different = int(compute_phash(to_model_input(make_scan(2))), 16)
+    assert hamming_distance(original, reexported) <= 3
+    assert hamming_distance(original, different) > 10
+
+def test_bk_tree_search_matches_linear_scan():
+    rng = np.random.default_rng(0)
+    keys = [int(k) for k in rng.integers(0, 2 ** 63, size=500)]
+    tree = BKTree()
+    for index, key in enumerate(keys):
+        tree.add(key, index)
+    query = keys[42] ^ 0b101  # two bits flipped
+    expected = sorted(i for i, key in enumerate(keys) if hamming_distance(query, key) <= 4)
+    assert sorted(value for _, value in tree.search(query, 4)) == expected
+    assert tree.search(query, 4)[0] == (2, 42)
+
+def test_index_only_matches_own_scans():
+    scan = compute_phash(to_model_input(make_scan(1)))
+    reexported = compute_phash(to_model_input(reexport(make_scan(1), 40, (256, 256))))
+    index = PerceptualHashIndex(max_distance=3)
+    index.add(scan, "first", TUMOR, 0.9, "v1", "user-a")
+    index.add(scan, "anonymous", NO_TUMOR, 0.8, "v1", None)
+    assert index.find(reexported, "user-a", "v1") == ("first", TUMOR, 0.9, "v1")
+    assert index.find(reexported, "user-b", "v1") is None
+    assert index.find(reexported, None, "v1") is None
+    assert index.find(reexported, "user-a", "v2") is None
+
+if __name__ == "__main__":
+    test_reexported_scan_hashes_close()
+    test_bk_tree_search_matches_linear_scan()
+    test_index_only_matches_own_scans()
+    print("Perceptual hash tests passed.")
@@ -0,0 +1,119 @@
+import io
+import os
+import numpy as np
+import pytest
+from multiprocessing import shared_memory
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image
+from utils.preprocess_pool import PreprocessPool, _SharedBuffers, decode_image, gather_rows, PROCESS
+
+def make_image_bytes(seed):
+    rng = np.random.default_rng(seed)
+    buffer = io.BytesIO()
+    Image.fromarray((rng.random((32, 32, 3)) * 255).astype(np.uint8)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def test_shared_buffers_reuse_released_blocks():
+    buffers = _SharedBuffers(max_idle_bytes=4096)
+    block = buffers.acquire(2048)
+    buffers.release(block)
+    assert buffers.idle_bytes() == block.size
+    # A smaller request reuses the idle block instead of creating one
+    assert buffers.acquire(1024) is block
+    assert buffers.created == 1
+    buffers.release(block)
+    buffers.close()
+
+def test_shared_buffers_free_unreusable_blocks():
+    buffers = _SharedBuffers(max_idle_bytes=4096)
+    block = buffers.acquire(1024)
+    # e.g. a worker may still write to it after a timeout
+    buffers.release(block, reusable=False)
+    assert buffers.idle_bytes() == 0
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=block.name)
+    replacement = buffers.acquire(1024)
+    assert replacement.name != block.name
+    assert buffers.created == 2
+    buffers.release(replacement)
+    buffers.close()
+
+def test_shared_buffers_free_blocks_beyond_the_idle_limit():
+    buffers = _SharedBuffers(max_idle_bytes=1024)
+    block = buffers.acquire(2048)
+    buffers.release(block)
+    assert buffers.idle_bytes() == 0
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=block.name)
+    buffers.close()
+
+def test_broken_pool_falls_back_to_inline_and_restarts():
+    pool = PreprocessPool(mode=PROCESS, workers=1, timeout=30, start_method='fork')
+    images = [make_image_bytes(1), make_image_bytes(2)]
+    try:
+        pool.start()
+        # A worker dying takes the whole executor down
+        with pytest.raises(BrokenProcessPool):
+            pool._executor.submit(os._exit, 1).result(timeout=30)
+
+        with pool.preprocess(images) as (batch, phashes):
+            assert np.array_equal(batch[1], decode_image(images[1]))
+            assert len(phashes) == 2
+        assert (pool.fallbacks, pool.restarts) == (1, 1)
+
+        # The next request gets fresh workers
+        with pool.preprocess(images) as (batch, _):
+            assert np.array_equal(batch[0], decode_image(images[0]))
+        assert pool.fallbacks == 1
+        assert pool.status()["running"]
+    finally:
+        pool.close()
+
+def test_gather_rows_copies_only_partial_selections():
+    batch = np.arange(4 * 3 * 2, dtype=np.float32).reshape(4, 3, 2)
+    assert gather_rows(batch, np.arange(4)) is batch
+
+    first = gather_rows(batch, np.array([1, 3]))
+    assert np.array_equal(first, batch[[1, 3]])
+    # The scratch array is reused by the next call on this thread
+    second = gather_rows(batch, np.array([0]))
+    assert np.array_equal(second, batch[[0]])
+    assert np.shares_memory(first, second)
+
+def test_freed_block_stays_mapped_while_viewed():
+    buffers = _SharedBuffers(max_idle_bytes=0)
+    block = buffers.acquire(1024)
+    view = np.frombuffer(block.buf, dtype=np.float32)[:4]
+    view[:] = 7
+    buffers.release(block)
+    # Unlinked, but the mapping lives as long as the view
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=block.name)
+    assert buffers.pinned() == 1
+    assert view.tolist() == [7, 7, 7, 7]
+    del view
+    buffers.close()
+    assert buffers.pinned() == 0
+
+def test_batch_used_after_the_block_is_not_overwritten():
+    pool = PreprocessPool(mode=PROCESS, workers=1, timeout=30, start_method='fork')
+    first, second = make_image_bytes(1), make_image_bytes(2)
+    try:
+        pool.start()
+        with pool.preprocess([first]) as (batch, _):
+            kept = batch[0]
+        del batch
+        with pool.preprocess([second]) as (batch, _):
+            assert np.array_equal(batch[0], decode_image(second))
+        del batch
+        # The first block was still viewed, so the second request got a new one
+        assert pool.status()["sharedBlocksCreated"] == 2
+        assert np.array_equal(kept, decode_image(first))
+
+        del kept
+        with pool.preprocess([second]) as (batch, _):
+            assert np.array_equal(batch[0], decode_image(second))
+        assert pool.status()["sharedBlocksCreated"] == 2
+    finally:
+        batch = None
+        pool.close()
@@ -0,0 +1,84 @@
+import pytest
+from functools import wraps
+from flask import Flask, request, jsonify
+from utils import response_cache as cache_module
+from utils.response_cache import UserResponseCache, cached_user_response
+
+@pytest.fixture
+def app(monkeypatch):
+    cache = UserResponseCache(max_entries=100, ttl=300)
+    monkeypatch.setattr(cache_module, 'response_cache', cache)
+    monkeypatch.setattr(cache_module, 'RESPONSE_CACHE_ENABLED', True)
+
+    app = Flask(__name__)
+    app.cache = cache
+    app.data = {'a': 1, 'b': 1}
+    app.calls = []
+
+    def user_required(f):
+        # Stands in for token_required
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            request.user_id = request.headers['X-User']
+            return f(*args, **kwargs)
+        return decorated
+
+    @app.route('/statistics')
+    @user_required
+    @cached_user_response(lambda: "statistics")
+    def statistics():
+        app.calls.append(request.user_id)
+        if request.user_id not in app.data:
+            return jsonify({"error": "User not found"}), 404
+        return jsonify({"user": request.user_id, "predictions": app.data[request.user_id]}), 200
+
+    return app
+
+def get(client, user, etag=None):
+    headers = {'X-User': user}
+    if etag:
+        headers['If-None-Match'] = etag
+    return client.get('/statistics', headers=headers)
+
+def test_revalidation_is_a_304_from_the_cache(app):
+    client = app.test_client()
+    first = get(client, 'a')
+    assert first.status_code == 200
+    assert first.headers['Cache-Control'] == 'private, no-cache'
+    etag = first.headers['ETag'].strip('"')
+
+    assert get(client, 'a', etag).status_code == 304
+    repeat = get(client, 'a')
+    assert repeat.status_code == 200
+    assert repeat.get_json() == first.get_json()
+    assert app.calls == ['a']
+
+def test_bump_invalidates_only_that_users_entries(app):
+    client = app.test_client()
+    etag_a = get(client, 'a').headers['ETag'].strip('"')
+    etag_b = get(client, 'b').headers['ETag'].strip('"')
+
+    # A new prediction for user a
+    app.data['a'] = 2
+    app.cache.bump('a')
+
+    changed = get(client, 'a', etag_a)
+    assert changed.status_code == 200
+    assert changed.get_json()['predictions'] == 2
+    assert changed.headers['ETag'].strip('"') != etag_a
+    assert get(client, 'b', etag_b).status_code == 304
+    assert app.calls == ['a', 'b', 'a']
+
+def test_unchanged_data_after_bump_still_revalidates(app):
+    client = app.test_client()
+    etag = get(client, 'a').headers['ETag'].strip('"')
+    app.cache.bump('a')
+    # Re-rendered, but the body and so the ETag are the same
+    assert get(client, 'a', etag).status_code == 304
+    assert app.calls == ['a', 'a']
+
+def test_errors_are_not_cached(app):
+    client = app.test_client()
+    assert get(client, 'missing').status_code == 404
+    assert get(client, 'missing').status_code == 404
+    assert app.calls == ['missing', 'missing']
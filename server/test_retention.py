@@ -0,0 +1,93 @@
+import os
+import time
+import datetime
+import mongomock
+import numpy as np
+import pytest
+from PIL import Image
+from bson.objectid import ObjectId
+from utils import retention
+from utils.retention import enforce_upload_quota, recompress_aged_uploads, remove_if_untouched
+from utils.prediction_schema import build_document, TUMOR
+
+OLD = time.time() - 60 * 86400
+
+def write_upload(directory, name, size=1024, mtime=OLD):
+    path = os.path.join(directory, name)
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size))
+    os.utime(path, (mtime, mtime))
+    return path
+
+def upload_name(n, ext='png'):
+    return f"{n:032x}.{ext}"
+
+def add_prediction(db, name, user_id=None):
+    document = build_document(user_id, name, TUMOR, 90.0, "vgg19", datetime.datetime.utcnow())
+    db['predictions'].insert_one(document)
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient()['test']
+
+def test_quota_only_deletes_uploads_of_anonymous_or_archived_predictions(db, tmp_path):
+    upload_dir, saliency_dir = str(tmp_path / 'uploads'), str(tmp_path / 'saliency')
+    os.makedirs(upload_dir)
+    anonymous, archived, owned, queued, recent = (upload_name(n) for n in range(5))
+    for name in (anonymous, archived, owned, queued):
+        write_upload(upload_dir, name)
+    write_upload(upload_dir, recent, mtime=time.time())
+    add_prediction(db, anonymous)
+    # Shared by an anonymous and a signed-in prediction
+    add_prediction(db, owned)
+    add_prediction(db, owned, ObjectId())
+    db['prediction_jobs'].insert_one({"imageName": queued, "status": "queued"})
+
+    assert enforce_upload_quota(db, quota_mb=0, upload_dir=upload_dir, saliency_dir=saliency_dir) == 2
+    assert sorted(os.listdir(upload_dir)) == sorted([owned, queued, recent])
+    assert db['predictions'].count_documents({"imagePurged": True}) == 1
+
+def test_quota_stops_once_under_quota(db, tmp_path):
+    upload_dir = str(tmp_path)
+    for n in range(4):
+        write_upload(upload_dir, upload_name(n), size=512 * 1024, mtime=OLD + n)
+    assert enforce_upload_quota(db, quota_mb=1, upload_dir=upload_dir, saliency_dir=str(tmp_path / 'none')) == 2
+    # The oldest went first
+    assert sorted(os.listdir(upload_dir)) == [upload_name(2), upload_name(3)]
+
+def test_reused_file_is_put_back(tmp_path):
+    path = write_upload(str(tmp_path), upload_name(1))
+    listed = os.stat(path).st_mtime
+    # store_upload reused it after it was listed
+    os.utime(path)
+    assert not remove_if_untouched(path, listed)
+    assert os.listdir(str(tmp_path)) == [upload_name(1)]
+    assert remove_if_untouched(path, os.stat(path).st_mtime)
+    assert os.listdir(str(tmp_path)) == []
+
+def test_recompression_keeps_an_original_reused_meanwhile(db, tmp_path, monkeypatch):
+    upload_dir = str(tmp_path)
+    name = upload_name(7)
+    noise = (np.random.default_rng(0).random((64, 64, 3)) * 255).astype(np.uint8)
+    Image.fromarray(noise).resize((512, 512)).save(os.path.join(upload_dir, name), format='PNG')
+    os.utime(os.path.join(upload_dir, name), (OLD, OLD))
+    add_prediction(db, name, ObjectId())
+
+    rename_image_updates = retention.rename_image_updates
+
+    def reuse_then_rename(filename, new_filename):
+        # A new prediction of the same image arrives while the WebP is written
+        os.utime(os.path.join(upload_dir, filename))
+        return rename_image_updates(filename, new_filename)
+
+    monkeypatch.setattr(retention, 'rename_image_updates', reuse_then_rename)
+    webp_name = upload_name(7, 'webp')
+    assert recompress_aged_uploads(db, upload_dir=upload_dir) == 0
+    assert sorted(os.listdir(upload_dir)) == sorted([name, webp_name])
+    assert db['predictions'].find_one()["ext"] == "webp"
+
+    # Once it is old again, the existing WebP is used and the original removed
+    monkeypatch.setattr(retention, 'rename_image_updates', rename_image_updates)
+    os.utime(os.path.join(upload_dir, name), (OLD, OLD))
+    assert recompress_aged_uploads(db, upload_dir=upload_dir) == 1
+    assert os.listdir(upload_dir) == [webp_name]
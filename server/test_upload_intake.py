@@ -0,0 +1,48 @@
+import io
+import struct
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+from utils.upload_intake import intake_upload, sniff_image, UploadRejected, MAX_IMAGE_PIXELS
+
+def make_image_bytes(image_format, size=(64, 48)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color=(120, 30, 200)).save(buffer, format=image_format)
+    return buffer.getvalue()
+
+def make_upload(data, filename):
+    return FileStorage(stream=io.BytesIO(data), filename=filename)
+
+def test_sniff_reads_dimensions_from_header():
+    assert sniff_image(make_image_bytes('PNG')) == ('PNG', (64, 48))
+    assert sniff_image(make_image_bytes('JPEG')) == ('JPEG', (64, 48))
+    assert sniff_image(b'GIF89a') == (None, None)
+
+def test_intake_accepts_valid_image_and_rewinds_stream():
+    upload = intake_upload(make_upload(make_image_bytes('JPEG'), 'scan.jpg'))
+    assert upload['format'] == 'JPEG'
+    assert (upload['width'], upload['height']) == (64, 48)
+    assert upload['stream'].tell() == 0
+
+def test_intake_rejects_disguised_file():
+    try:
+        intake_upload(make_upload(b'not really an image' * 10, 'scan.png'))
+        assert False, "Expected UploadRejected"
+    except UploadRejected as e:
+        assert e.status_code == 400
+
+def test_intake_rejects_decompression_bomb_from_header():
+    # A PNG header claiming a huge canvas is rejected before any pixel data is decoded
+    side = int(MAX_IMAGE_PIXELS ** 0.5) + 1000
+    header = b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + struct.pack('>II', side, side) + b'\x08\x02\x00\x00\x00'
+    try:
+        intake_upload(make_upload(header, 'bomb.png'))
+        assert False, "Expected UploadRejected"
+    except UploadRejected as e:
+        assert e.status_code == 413
+
+if __name__ == "__main__":
+    test_sniff_reads_dimensions_from_header()
+    test_intake_accepts_valid_image_and_rewinds_stream()
+    test_intake_rejects_disguised_file()
+    test_intake_rejects_decompression_bomb_from_header()
+    print("Upload intake tests passed.")
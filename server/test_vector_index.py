@@ -0,0 +1,43 @@
+import mongomock
+import numpy as np
+from bson.objectid import ObjectId
+from utils.embeddings import encode_embedding
+from utils.vector_index import VectorIndex
+
+def unit(seed, dim=16):
+    vector = np.random.default_rng(seed).standard_normal(dim)
+    return (vector / np.linalg.norm(vector)).astype(np.float16)
+
+def test_load_after_live_add_does_not_duplicate():
+    predictions = mongomock.MongoClient()['test']['predictions']
+    user_id = ObjectId()
+    ids = [ObjectId() for _ in range(3)]
+    predictions.insert_many([
+        {"_id": item_id, "userId": user_id, "modelVersion": "v1", "embedding": encode_embedding(unit(seed))}
+        for seed, item_id in enumerate(ids)
+    ])
+
+    index = VectorIndex()
+    # A prediction made before the first /similar call triggers the load
+    index.add(user_id, "v1", ids[0], unit(0))
+    index._load(predictions)
+
+    results = index.search(user_id, "v1", unit(0).astype(np.float32), k=10)
+    result_ids = [item_id for item_id, _ in results]
+    assert sorted(result_ids) == sorted(ids)
+    assert result_ids[0] == ids[0]
+
+def test_snapshot_ignores_vectors_added_after_it():
+    index = VectorIndex()
+    user_id = ObjectId()
+    first = ObjectId()
+    index.add(user_id, "v1", first, unit(0))
+    group = index._groups[(str(user_id), "v1")]
+    snapshot = group.snapshot()
+    # Enough to grow the matrix past its initial capacity while the search runs
+    for seed in range(1, 200):
+        index.add(user_id, "v1", ObjectId(), unit(seed))
+
+    results = group.search(unit(0).astype(np.float32), 10, snapshot=snapshot)
+    assert [item_id for item_id, _ in results] == [first]
+    assert len(index.search(user_id, "v1", unit(0).astype(np.float32), k=10)) == 10
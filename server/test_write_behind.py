@@ -0,0 +1,119 @@
+import os
+import mongomock
+import pymongo
+from bson import json_util
+from bson.objectid import ObjectId
+from utils.write_behind import WriteBehindWriter, WRITE_BEHIND
+
+class FlakyCollection:
+    """Collection whose next `failures` inserts fail as if MongoDB were down"""
+
+    def __init__(self, collection, failures=0):
+        self.collection = collection
+        self.failures = failures
+
+    def insert_many(self, documents, ordered=True):
+        if self.failures:
+            self.failures -= 1
+            raise pymongo.errors.AutoReconnect("connection refused")
+        return self.collection.insert_many(documents, ordered=ordered)
+
+class ValidatingCollection:
+    """Collection that rejects documents with "bad" set, as a $jsonSchema validator would"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def insert_many(self, documents, ordered=True):
+        errors = [{"index": index, "code": 121, "errmsg": "Document failed validation"}
+                  for index, document in enumerate(documents) if document.get("bad")]
+        valid = [document for document in documents if not document.get("bad")]
+        if valid:
+            self.collection.insert_many(valid)
+        if errors:
+            raise pymongo.errors.BulkWriteError({"writeErrors": errors})
+
+def make_writer(collection, tmp_path, **kwargs):
+    # Large batch and interval so the background thread leaves flushing to the test
+    return WriteBehindWriter(collection, 'records', mode=WRITE_BEHIND, batch_size=1000,
+                             flush_interval=60, spill_dir=str(tmp_path), **kwargs)
+
+def test_replay_skips_corrupt_lines(tmp_path):
+    collection = mongomock.MongoClient()['test']['records']
+    writer = make_writer(collection, tmp_path)
+    good = [{"_id": ObjectId(), "n": n} for n in range(3)]
+    with open(writer.spill_path, 'w', encoding='utf-8') as f:
+        f.write(json_util.dumps(good[0]) + '\n')
+        f.write('{"_id": {"$oid": "not an id"}}\n')
+        f.write(json_util.dumps(good[1]) + '\n')
+        f.write(json_util.dumps(good[2])[:10])  # truncated by a crash
+
+    assert writer._replay_spill() == 2
+    assert {doc["n"] for doc in collection.find()} == {0, 1}
+    assert not os.path.exists(writer.spill_path)
+    assert not os.path.exists(writer.replaying_path)
+    with open(writer.corrupt_path, encoding='utf-8') as f:
+        assert len(f.readlines()) == 2
+    assert writer.stats["corruptLines"] == 2
+
+def test_replay_keeps_records_of_an_interrupted_replay(tmp_path):
+    collection = mongomock.MongoClient()['test']['records']
+    writer = make_writer(collection, tmp_path)
+    with open(writer.replaying_path, 'w', encoding='utf-8') as f:
+        f.write(json_util.dumps({"_id": ObjectId(), "n": 0}))  # no trailing newline
+    with open(writer.spill_path, 'w', encoding='utf-8') as f:
+        f.write(json_util.dumps({"_id": ObjectId(), "n": 1}) + '\n')
+
+    assert writer._replay_spill() == 2
+    assert sorted(doc["n"] for doc in collection.find()) == [0, 1]
+
+def test_failed_flush_requeues_in_order(tmp_path):
+    collection = mongomock.MongoClient()['test']['records']
+    writer = make_writer(FlakyCollection(collection, failures=1), tmp_path)
+    try:
+        for n in range(5):
+            writer.submit({"n": n})
+
+        assert writer.flush() == 0
+        assert [doc["n"] for doc in writer._buffer] == [0, 1, 2, 3, 4]
+        assert writer.stats["failedFlushes"] == 1
+
+        assert writer.flush() == 5
+        assert [doc["n"] for doc in collection.find().sort("n")] == [0, 1, 2, 3, 4]
+        assert not writer._buffer
+    finally:
+        writer.close()
+
+def test_rejected_records_are_dead_lettered_after_max_attempts(tmp_path):
+    collection = mongomock.MongoClient()['test']['records']
+    writer = make_writer(ValidatingCollection(collection), tmp_path, max_attempts=3)
+    bad = {"_id": ObjectId(), "n": 0, "bad": True}
+    with open(writer.spill_path, 'w', encoding='utf-8') as f:
+        f.write(json_util.dumps(bad) + '\n')
+        f.write(json_util.dumps({"_id": ObjectId(), "n": 1}) + '\n')
+
+    assert writer._replay_spill() == 1
+    assert writer._replay_spill() == 0
+    assert os.path.exists(writer.spill_path)
+    assert writer._replay_spill() == 0
+    # Third rejection: set aside instead of spilled again
+    assert not os.path.exists(writer.spill_path)
+    with open(writer.dead_letter_path, encoding='utf-8') as f:
+        assert [json_util.loads(line) for line in f] == [bad]
+    assert writer.stats["deadLettered"] == 1
+    assert not writer._attempts
+
+def test_unencodable_record_does_not_block_the_batch(tmp_path):
+    collection = mongomock.MongoClient()['test']['records']
+    writer = make_writer(collection, tmp_path)
+    try:
+        writer.submit({"n": 0})
+        writer.submit({"n": 1, "tags": object()})
+        writer.submit({"n": 2})
+        assert writer.flush() == 2
+        assert not writer._buffer
+        assert sorted(doc["n"] for doc in collection.find()) == [0, 2]
+        assert writer.stats["deadLettered"] == 1
+        assert os.path.exists(writer.dead_letter_path)
+    finally:
+        writer.close()
@@ -0,0 +1,63 @@
+import os
+import math
+import time
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Anonymous endpoint rate limit (per client IP)
+ANON_RATE_LIMIT_PER_MINUTE = float(os.getenv('ANON_RATE_LIMIT_PER_MINUTE', '10'))
+ANON_RATE_LIMIT_BURST = int(os.getenv('ANON_RATE_LIMIT_BURST', '5'))
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot be admitted; carries a Retry-After hint in seconds"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = retry_after
+
+
+class TokenBucketLimiter:
+    """In-memory per-key token bucket (e.g. keyed by client IP)"""
+
+    def __init__(self, rate_per_minute, burst, max_keys=100000):
+        self.rate = rate_per_minute / 60.0
+        self.burst = max(1, burst)
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+        # Drop buckets that have refilled completely; they carry no state
+        full_after = self.burst / self.rate if self.rate > 0 else float('inf')
+        stale = [key for key, (_, last) in self._buckets.items() if now - last >= full_after]
+        for key in stale:
+            del self._buckets[key]
+
+    def allow(self, key):
+        """
+        Take one token for `key`
+
+        Returns:
+            tuple: (allowed, retry_after_seconds)
+        """
+        if self.rate <= 0:
+            return True, 0
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                if len(self._buckets) > self.max_keys:
+                    self._prune(now)
+                return True, 0
+            self._buckets[key] = (tokens, now)
+            return False, max(1, int(math.ceil((1 - tokens) / self.rate)))
+
+
+# Shared limiter used by the anonymous prediction route
+anonymous_rate_limiter = TokenBucketLimiter(ANON_RATE_LIMIT_PER_MINUTE, ANON_RATE_LIMIT_BURST)
@@ -2,10 +2,43 @@ import requests
 import os
 import json
 from dotenv import load_dotenv
+from utils.logger import get_logger, mask_email
 
 load_dotenv()
 
+logger = get_logger(__name__)
+
 OTP_SERVICE_URL = os.getenv('OTP_SERVICE_URL', 'http://localhost:3001/api/send-otp')
+# Only enable in development: logs the test OTP returned by the Ethereal test service
+LOG_TEST_OTP = os.getenv('LOG_TEST_OTP', 'false').lower() == 'true'
+
+_async_client = None
+
+def otp_payload(email, otp, template_type):
+    return {
+        'email': email,
+        'otp': otp,
+        'templateType': template_type
+    }
+
+def handle_otp_response(email, status_code, body):
+    """Log the OTP service's answer; returns True if the email was sent"""
+    if status_code == 200:
+        logger.info("OTP email sent", extra={"fields": {"email": mask_email(email)}})
+        
+        # For testing purposes, log the OTP if provided by the test service
+        if LOG_TEST_OTP:
+            try:
+                response_data = json.loads(body)
+                if 'testOtp' in response_data:
+                    logger.warning(f"TEST OTP for {email}: {response_data['testOtp']} (Ethereal mode, no real email sent)")
+            except:
+                pass
+            
+        return True
+    else:
+        logger.error("Failed to send OTP", extra={"fields": {"status": status_code, "body": body[:200]}})
+        return False
 
 def send_otp_email(email, otp, template_type='signup'):
     """
@@ -20,41 +53,42 @@ def send_otp_email(email, otp, template_type='signup'):
         bool: True if the email was sent successfully, False otherwise
     """
     try:
-        print(f"Sending OTP {otp} to {email} via OTP service at {OTP_SERVICE_URL}")
-        
-        payload = {
-            'email': email,
-            'otp': otp,
-            'templateType': template_type
-        }
-        
-        print(f"Request payload: {json.dumps(payload)}")
+        logger.debug("Sending OTP email", extra={"fields": {"email": mask_email(email), "templateType": template_type}})
         
         response = requests.post(
             OTP_SERVICE_URL,
-            json=payload,
+            json=otp_payload(email, otp, template_type),
             headers={'Content-Type': 'application/json'},
             timeout=10  # Add timeout to prevent hanging
         )
+        return handle_otp_response(email, response.status_code, response.text)
+    except Exception as e:
+        logger.exception(f"Error sending OTP: {str(e)}")
+        return False
+
+async def send_otp_email_async(email, otp, template_type='signup'):
+    """send_otp_email for the async serving mode (asgi_app.py); waits without holding a thread"""
+    global _async_client
+    import httpx
+    
+    try:
+        logger.debug("Sending OTP email", extra={"fields": {"email": mask_email(email), "templateType": template_type}})
         
-        print(f"OTP service response status: {response.status_code}")
-        
-        if response.status_code == 200:
-            print(f"OTP sent successfully to {email}")
-            
-            # For testing purposes, log the OTP if provided by the test service
-            try:
-                response_data = response.json()
-                if 'testOtp' in response_data:
-                    print(f"======== TEST OTP for {email}: {response_data['testOtp']} ========")
-                    print(f"Please use this OTP for testing as no real email will be sent in Ethereal mode")
-            except:
-                pass
-                
-            return True
-        else:
-            print(f"Failed to send OTP: {response.text}")
-            return False
+        # One pooled client per process, created inside the event loop that uses it
+        if _async_client is None:
+            _async_client = httpx.AsyncClient(timeout=10)
+        response = await _async_client.post(
+            OTP_SERVICE_URL,
+            json=otp_payload(email, otp, template_type),
+            headers={'Content-Type': 'application/json'}
+        )
+        return handle_otp_response(email, response.status_code, response.text)
     except Exception as e:
-        print(f"Error sending OTP: {str(e)}")
-        return False 
\ No newline at end of file
+        logger.exception(f"Error sending OTP: {str(e)}")
+        return False
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
@@ -0,0 +1,76 @@
+import os
+import zlib
+import threading
+import numpy as np
+from bson.binary import Binary
+from dotenv import load_dotenv
+from utils.logger import get_logger
+
+load_dotenv()
+
+logger = get_logger(__name__)
+
+# Penultimate-layer embeddings stored with each prediction for similar-case retrieval
+EMBEDDINGS_ENABLED = os.getenv('EMBEDDINGS_ENABLED', 'true').lower() == 'true'
+# Wider embeddings are reduced with a fixed random projection, which preserves cosine similarity
+EMBEDDING_DIM = int(os.getenv('EMBEDDING_DIM', '256'))
+
+_projections = {}
+_projections_lock = threading.Lock()
+
+
+def build_dual_output_model(model):
+    """
+    Wrap a Keras model so one forward pass returns [prediction, penultimate activations]
+
+    Returns:
+        Model or None if the model's graph cannot be split (the caller then
+        keeps using the plain model and stores no embeddings)
+    """
+    import tensorflow as tf
+
+    try:
+        penultimate = model.layers[-2].output
+        return tf.keras.Model(inputs=model.inputs, outputs=[model.output, penultimate])
+    except Exception as e:
+        logger.warning(f"Could not build embedding model, similar-case retrieval disabled: {str(e)}")
+        return None
+
+
+def _projection(dim, key):
+    """Gaussian random projection from `dim` to EMBEDDING_DIM, fixed per model version"""
+    with _projections_lock:
+        matrix = _projections.get((dim, key))
+        if matrix is None:
+            rng = np.random.default_rng(zlib.crc32(f"{key}:{dim}".encode()))
+            matrix = (rng.standard_normal((dim, EMBEDDING_DIM)) / np.sqrt(EMBEDDING_DIM)).astype(np.float32)
+            _projections[(dim, key)] = matrix
+        return matrix
+
+
+def to_embeddings(activations, model_version):
+    """
+    Turn raw penultimate activations into compact, L2-normalized float16 vectors
+
+    Args:
+        activations (ndarray): (batch, ...) activations; spatial maps are average pooled
+        model_version (str): seeds the projection so vectors of one version stay comparable
+
+    Returns:
+        ndarray: (batch, <= EMBEDDING_DIM) float16
+    """
+    activations = np.asarray(activations, dtype=np.float32)
+    if activations.ndim > 2:
+        activations = activations.mean(axis=tuple(range(1, activations.ndim - 1)))
+    if activations.shape[1] > EMBEDDING_DIM:
+        activations = activations @ _projection(activations.shape[1], model_version)
+    norms = np.linalg.norm(activations, axis=1, keepdims=True)
+    return (activations / np.maximum(norms, 1e-12)).astype(np.float16)
+
+
+def encode_embedding(vector):
+    return Binary(np.asarray(vector, dtype=np.float16).tobytes())
+
+
+def decode_embedding(data):
+    return np.frombuffer(bytes(data), dtype=np.float16)
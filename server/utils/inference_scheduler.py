@@ -0,0 +1,216 @@
+import os
+import math
+import time
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from utils.admission import Overloaded
+
+load_dotenv()
+
+# Scheduler settings
+INFERENCE_MAX_CONCURRENCY = int(os.getenv('INFERENCE_MAX_CONCURRENCY', '2'))
+INFERENCE_MAX_QUEUE = int(os.getenv('INFERENCE_MAX_QUEUE', '16'))
+INFERENCE_QUEUE_TIMEOUT = float(os.getenv('INFERENCE_QUEUE_TIMEOUT', '10'))  # seconds
+INFERENCE_MAX_QUEUED_PER_USER = int(os.getenv('INFERENCE_MAX_QUEUED_PER_USER', '4'))
+# Comma separated "class=weight" pairs; a class with weight 6 gets 6x the slots of weight 1 under contention
+INFERENCE_CLASS_WEIGHTS = os.getenv('INFERENCE_CLASS_WEIGHTS', 'authenticated=6,batch=2,anonymous=1')
+
+AUTHENTICATED = 'authenticated'
+ANONYMOUS = 'anonymous'
+BATCH = 'batch'
+
+
+def _parse_weights(value):
+    weights = {AUTHENTICATED: 6.0, BATCH: 2.0, ANONYMOUS: 1.0}
+    for pair in value.split(','):
+        if '=' not in pair:
+            continue
+        name, weight = pair.split('=', 1)
+        try:
+            weights[name.strip()] = max(0.01, float(weight))
+        except ValueError:
+            continue
+    return weights
+
+
+class _Waiter:
+    __slots__ = ('event', 'user_key', 'enqueued_at')
+
+    def __init__(self, user_key):
+        self.event = threading.Event()
+        self.user_key = user_key
+        self.enqueued_at = time.monotonic()
+
+
+class _RequestClass:
+    """Queue state for one request class: one FIFO per user, served round-robin"""
+
+    def __init__(self, name, weight):
+        self.name = name
+        self.weight = weight
+        self.pass_value = 0.0
+        self.users = OrderedDict()
+        self.depth = 0
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.avg_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_wait(self, waited):
+        self.avg_wait = 0.8 * self.avg_wait + 0.2 * waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def pop_next(self):
+        # Take the head of the first user's queue and move that user to the back
+        user_key, queue = next(iter(self.users.items()))
+        waiter = queue.popleft()
+        if queue:
+            self.users.move_to_end(user_key)
+        else:
+            del self.users[user_key]
+        self.depth -= 1
+        return waiter
+
+
+class InferenceScheduler:
+    """
+    Admission control with weighted fair queuing across request classes
+
+    At most `max_concurrency` callers run inference at once. Waiting callers
+    are grouped by request class (authenticated, anonymous, batch); when a
+    slot frees up the class is chosen by stride scheduling on the class
+    weights, and within a class users are served round-robin so one user's
+    burst cannot monopolize the model. The wait queue is bounded overall and
+    per user; callers beyond the bounds get Overloaded immediately.
+    """
+
+    def __init__(self, max_concurrency, max_queue, queue_timeout, weights, max_queued_per_user):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.max_queued_per_user = max(1, max_queued_per_user)
+        self._classes = {name: _RequestClass(name, weight) for name, weight in weights.items()}
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiting = 0
+        self._virtual_time = 0.0
+        self._avg_service_time = 1.0  # EWMA of slot hold time in seconds
+
+    def _get_class(self, request_class):
+        if request_class not in self._classes:
+            self._classes[request_class] = _RequestClass(request_class, 1.0)
+        return self._classes[request_class]
+
+    def _retry_after(self):
+        estimate = self._avg_service_time * (self._waiting + 1) / self.max_concurrency
+        return max(1, int(math.ceil(estimate)))
+
+    def _next_waiter(self):
+        candidates = [c for c in self._classes.values() if c.depth > 0]
+        if not candidates:
+            return None, None
+        chosen = min(candidates, key=lambda c: (c.pass_value, -c.weight))
+        self._virtual_time = chosen.pass_value
+        chosen.pass_value += 1.0 / chosen.weight
+        self._waiting -= 1
+        return chosen, chosen.pop_next()
+
+    def acquire(self, request_class, user_key=None):
+        with self._lock:
+            rc = self._get_class(request_class)
+            if self._active < self.max_concurrency and self._waiting == 0:
+                self._active += 1
+                rc.active += 1
+                rc.admitted += 1
+                rc.record_wait(0.0)
+                return
+
+            user_queue = rc.users.get(user_key)
+            if self._waiting >= self.max_queue or (user_queue and len(user_queue) >= self.max_queued_per_user):
+                rc.rejected += 1
+                raise Overloaded('Server is busy, please retry shortly', self._retry_after())
+
+            # An idle class rejoins at the current virtual time instead of spending banked credit
+            if rc.depth == 0:
+                rc.pass_value = max(rc.pass_value, self._virtual_time)
+            waiter = _Waiter(user_key)
+            rc.users.setdefault(user_key, deque()).append(waiter)
+            rc.depth += 1
+            self._waiting += 1
+
+        if waiter.event.wait(self.queue_timeout):
+            return
+
+        with self._lock:
+            # The slot may have been handed over between the timeout and taking the lock
+            if waiter.event.is_set():
+                return
+            queue = rc.users.get(user_key)
+            queue.remove(waiter)
+            if not queue:
+                del rc.users[user_key]
+            rc.depth -= 1
+            self._waiting -= 1
+            rc.rejected += 1
+            raise Overloaded('Timed out waiting for an inference slot', self._retry_after())
+
+    def release(self, request_class, service_time=None):
+        with self._lock:
+            self._classes[request_class].active -= 1
+            if service_time is not None:
+                self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * service_time
+            next_class, waiter = self._next_waiter()
+            if waiter is None:
+                self._active -= 1
+                return
+            # Hand the slot directly to the chosen waiter; _active stays the same
+            next_class.active += 1
+            next_class.admitted += 1
+            next_class.record_wait(time.monotonic() - waiter.enqueued_at)
+            waiter.event.set()
+
+    @contextmanager
+    def slot(self, request_class, user_key=None):
+        self.acquire(request_class, user_key)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(request_class, time.monotonic() - started)
+
+    def stats(self):
+        """Queue depth, throughput and wait times per request class"""
+        with self._lock:
+            return {
+                "active": self._active,
+                "waiting": self._waiting,
+                "maxConcurrency": self.max_concurrency,
+                "maxQueue": self.max_queue,
+                "avgServiceTime": round(self._avg_service_time, 3),
+                "classes": {
+                    name: {
+                        "weight": c.weight,
+                        "queueDepth": c.depth,
+                        "queuedUsers": len(c.users),
+                        "active": c.active,
+                        "admitted": c.admitted,
+                        "rejected": c.rejected,
+                        "avgWaitSeconds": round(c.avg_wait, 3),
+                        "maxWaitSeconds": round(c.max_wait, 3)
+                    }
+                    for name, c in self._classes.items()
+                }
+            }
+
+
+# Shared scheduler used by every inference path
+inference_scheduler = InferenceScheduler(
+    INFERENCE_MAX_CONCURRENCY,
+    INFERENCE_MAX_QUEUE,
+    INFERENCE_QUEUE_TIMEOUT,
+    _parse_weights(INFERENCE_CLASS_WEIGHTS),
+    INFERENCE_MAX_QUEUED_PER_USER
+)
@@ -0,0 +1,54 @@
+import queue
+import threading
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class BackgroundWorkerPool:
+    """
+    Fixed set of daemon threads consuming a bounded in-memory queue
+
+    Workers are started lazily on the first submit so importing a module that
+    owns a pool does not spawn threads (e.g. in maintenance scripts).
+    """
+
+    def __init__(self, name, handler, num_workers=2, max_queue=100):
+        self.name = name
+        self.handler = handler
+        self.num_workers = max(1, num_workers)
+        self._queue = queue.Queue(maxsize=max(1, max_queue))
+        self._threads = []
+        self._start_lock = threading.Lock()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                self.handler(item)
+            except Exception as e:
+                logger.exception(f"Error in {self.name} worker: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    def start(self):
+        with self._start_lock:
+            if self._threads:
+                return
+            for index in range(self.num_workers):
+                thread = threading.Thread(target=self._run, name=f"{self.name}-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            logger.info(f"Started {self.num_workers} {self.name} workers")
+
+    def submit(self, item):
+        """Queue an item; returns False if the queue is full"""
+        self.start()
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            return False
+
+    def depth(self):
+        return self._queue.qsize()
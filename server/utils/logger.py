@@ -0,0 +1,208 @@
+import logging
+import logging.handlers
+import os
+import sys
+import json
+import queue
+import random
+import atexit
+import datetime
+import threading
+import uuid
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Logging configuration (override per environment via .env)
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()  # 'text' or 'json'
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+# Comma separated "event=rate" pairs, e.g. "visitor=0.01,public_statistics=0.1"
+LOG_SAMPLE_RATES = os.getenv('LOG_SAMPLE_RATES', 'visitor=0.01,public_statistics=0.1')
+
+ROOT_LOGGER_NAME = 'brain_tumor'
+
+_listener = None
+_setup_lock = threading.Lock()
+_dropped_records = 0
+
+
+def _parse_sample_rates(value):
+    rates = {}
+    for pair in value.split(','):
+        if '=' not in pair:
+            continue
+        event, rate = pair.split('=', 1)
+        try:
+            rates[event.strip()] = max(0.0, min(1.0, float(rate)))
+        except ValueError:
+            continue
+    return rates
+
+
+SAMPLE_RATES = _parse_sample_rates(LOG_SAMPLE_RATES)
+
+
+def get_request_id():
+    """Return the request id of the current Flask (or, in async mode, Quart) request, or None outside a request"""
+    try:
+        from flask import g, has_request_context
+    except ImportError:
+        return None
+    if has_request_context():
+        return getattr(g, 'request_id', None)
+    # Only look at Quart when asgi_app.py has loaded it
+    quart = sys.modules.get('quart')
+    if quart is not None and quart.has_request_context():
+        return getattr(quart.g, 'request_id', None)
+    return None
+
+
+class RequestIdFilter(logging.Filter):
+    """Attach the current request id to every record (runs on the calling thread)"""
+
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = get_request_id() or '-'
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that never blocks the caller.
+
+    Records are only resolved (message + args) on the calling thread; all
+    formatting and I/O happens on the listener thread. When the queue is full
+    the record is dropped and counted instead of stalling the request.
+    """
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        global _dropped_records
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped_records += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as single-line JSON documents"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.utcfromtimestamp(record.created).isoformat() + 'Z',
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.msg,
+        }
+        if getattr(record, 'request_id', '-') != '-':
+            entry["requestId"] = record.request_id
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human readable format for local development"""
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+def setup_logging():
+    """Configure the queue-backed logging pipeline once per process"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        if LOG_FORMAT == 'json':
+            formatter = JsonFormatter()
+        else:
+            formatter = TextFormatter('%(asctime)s %(levelname)s [%(name)s] [%(request_id)s] %(message)s')
+
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(formatter)
+
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        queue_handler = NonBlockingQueueHandler(log_queue)
+        queue_handler.addFilter(RequestIdFilter())
+
+        root = logging.getLogger(ROOT_LOGGER_NAME)
+        root.setLevel(LOG_LEVEL)
+        root.addHandler(queue_handler)
+        root.propagate = False
+
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=False)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def get_logger(name):
+    """Return a logger under the application namespace"""
+    setup_logging()
+    if name.startswith(ROOT_LOGGER_NAME):
+        return logging.getLogger(name)
+    return logging.getLogger(f"{ROOT_LOGGER_NAME}.{name}")
+
+
+def sampled(event):
+    """Return True if a high-volume event should be logged this time"""
+    rate = SAMPLE_RATES.get(event, 1.0)
+    return rate >= 1.0 or (rate > 0.0 and random.random() < rate)
+
+
+def get_dropped_count():
+    """Number of records dropped because the log queue was full"""
+    return _dropped_records
+
+
+def mask_email(email):
+    """Mask an email address for logging, e.g. j***@example.com"""
+    if not email or '@' not in email:
+        return '***'
+    local, domain = email.split('@', 1)
+    return f"{local[:1]}***@{domain}"
+
+
+def init_request_logging(app):
+    """Assign a request id to every request and echo it in the X-Request-ID header (Flask or Quart app)"""
+    if type(app).__module__.startswith('quart'):
+        from quart import g, request
+    else:
+        from flask import g, request
+
+    @app.before_request
+    def assign_request_id():
+        g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+
+    @app.after_request
+    def add_request_id_header(response):
+        request_id = getattr(g, 'request_id', None)
+        if request_id:
+            response.headers['X-Request-ID'] = request_id
+        return response
@@ -0,0 +1,241 @@
+import os
+import sys
+import time
+import signal
+import resource
+import threading
+import tracemalloc
+from functools import wraps
+from dotenv import load_dotenv
+from utils.logger import get_logger
+
+load_dotenv()
+
+logger = get_logger(__name__)
+
+# Recycle the worker once RSS stays above this many MB (0 disables); a process manager restarts it
+MEMORY_RECYCLE_RSS_MB = int(os.getenv('MEMORY_RECYCLE_RSS_MB', '0'))
+MEMORY_CHECK_INTERVAL = int(os.getenv('MEMORY_CHECK_INTERVAL', '30'))  # seconds
+MEMORY_DRAIN_TIMEOUT = int(os.getenv('MEMORY_DRAIN_TIMEOUT', '60'))  # seconds to let in-flight inference finish
+# Log requests whose RSS grew by more than this many MB
+MEMORY_REQUEST_DELTA_WARN_MB = float(os.getenv('MEMORY_REQUEST_DELTA_WARN_MB', '50'))
+TRACEMALLOC_FRAMES = int(os.getenv('TRACEMALLOC_FRAMES', '10'))
+
+MB = 1024 * 1024
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def current_rss_bytes():
+    """Resident set size of this process (peak RSS where /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in KB on Linux and bytes on macOS
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def tf_memory_info():
+    """TensorFlow allocator stats per device (only if TF is already loaded; CPU devices may not report)"""
+    tf = sys.modules.get('tensorflow')
+    if tf is None:
+        return {}
+    devices = {}
+    try:
+        for device in tf.config.list_logical_devices():
+            try:
+                info = tf.config.experimental.get_memory_info(device.name)
+                devices[device.name] = {"currentMb": round(info["current"] / MB, 1), "peakMb": round(info["peak"] / MB, 1)}
+            except Exception:
+                continue
+    except Exception as e:
+        logger.debug(f"TF memory info unavailable: {str(e)}")
+    return devices
+
+
+class RequestMemoryStats:
+    """RSS growth per endpoint; a steadily positive mean delta points at a leak in that path"""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, delta_bytes):
+        with self._lock:
+            stats = self._stats.setdefault(name, {"requests": 0, "totalDeltaMb": 0.0, "maxDeltaMb": 0.0})
+            delta_mb = delta_bytes / MB
+            stats["requests"] += 1
+            stats["totalDeltaMb"] += delta_mb
+            stats["maxDeltaMb"] = max(stats["maxDeltaMb"], delta_mb)
+
+    def summary(self):
+        with self._lock:
+            return {
+                name: {
+                    "requests": stats["requests"],
+                    "meanDeltaMb": round(stats["totalDeltaMb"] / stats["requests"], 3),
+                    "maxDeltaMb": round(stats["maxDeltaMb"], 2),
+                    "totalDeltaMb": round(stats["totalDeltaMb"], 2)
+                }
+                for name, stats in self._stats.items()
+            }
+
+
+request_memory_stats = RequestMemoryStats()
+
+
+def track_memory(f):
+    """Record the RSS delta of each call to a route (concurrent requests share the process, so deltas are approximate)"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        before = current_rss_bytes()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            delta = current_rss_bytes() - before
+            request_memory_stats.record(f.__name__, delta)
+            if delta > MEMORY_REQUEST_DELTA_WARN_MB * MB:
+                logger.warning("Large memory growth during request", extra={"fields": {
+                    "endpoint": f.__name__, "deltaMb": round(delta / MB, 1), "rssMb": round(current_rss_bytes() / MB, 1)
+                }})
+    return decorated
+
+
+# Python heap tracing, started on demand because it slows allocation down
+
+_last_snapshot = None
+
+
+def start_tracemalloc(frames=TRACEMALLOC_FRAMES):
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+        _last_snapshot = None
+    return tracemalloc.is_tracing()
+
+
+def stop_tracemalloc():
+    global _last_snapshot
+    tracemalloc.stop()
+    _last_snapshot = None
+
+
+def tracemalloc_report(top=20):
+    """
+    Top allocation sites now, and the growth since the previous report
+
+    Returns:
+        dict or None if tracing has not been started
+    """
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        return None
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ))
+    current, peak = tracemalloc.get_traced_memory()
+    report = {
+        "tracedMb": round(current / MB, 2),
+        "peakTracedMb": round(peak / MB, 2),
+        "top": [
+            {"location": str(stat.traceback[0]), "sizeKb": round(stat.size / 1024, 1), "count": stat.count}
+            for stat in snapshot.statistics('lineno')[:top]
+        ]
+    }
+    if _last_snapshot is not None:
+        report["growth"] = [
+            {"location": str(stat.traceback[0]), "sizeDiffKb": round(stat.size_diff / 1024, 1), "countDiff": stat.count_diff}
+            for stat in snapshot.compare_to(_last_snapshot, 'lineno')[:top]
+        ]
+    _last_snapshot = snapshot
+    return report
+
+
+class MemoryWatchdog:
+    """
+    Recycles the worker before the OOM killer does
+
+    When RSS crosses MEMORY_RECYCLE_RSS_MB the worker reports not ready (so
+    the load balancer stops routing to it), waits for in-flight inference to
+    drain, flushes buffered state and sends itself SIGTERM. It relies on a
+    process manager (gunicorn, systemd, Kubernetes) to start a fresh worker;
+    under `python app.py` a recycle simply stops the server.
+    """
+
+    def __init__(self, threshold_mb=MEMORY_RECYCLE_RSS_MB, interval=MEMORY_CHECK_INTERVAL):
+        self.threshold_mb = threshold_mb
+        self.interval = interval
+        self.draining = False
+        self.started_at = time.time()
+        self._thread = None
+        self._before_exit = []
+
+    def on_recycle(self, callback):
+        """Register a callback run after draining and before SIGTERM (e.g. flushing buffers)"""
+        self._before_exit.append(callback)
+
+    def start(self, inference_scheduler):
+        if self.threshold_mb <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, args=(inference_scheduler,), name='memory-watchdog', daemon=True)
+        self._thread.start()
+        logger.info(f"Started memory watchdog (recycle above {self.threshold_mb} MB)")
+
+    def _run(self, inference_scheduler):
+        while True:
+            time.sleep(self.interval)
+            rss_mb = current_rss_bytes() / MB
+            if rss_mb > self.threshold_mb:
+                self.recycle(inference_scheduler, rss_mb)
+                return
+
+    def recycle(self, inference_scheduler, rss_mb):
+        self.draining = True
+        logger.warning("Memory threshold exceeded, recycling worker", extra={"fields": {
+            "rssMb": round(rss_mb, 1), "thresholdMb": self.threshold_mb
+        }})
+        deadline = time.monotonic() + MEMORY_DRAIN_TIMEOUT
+        while time.monotonic() < deadline:
+            stats = inference_scheduler.stats()
+            if stats["active"] == 0 and stats["waiting"] == 0:
+                break
+            time.sleep(0.5)
+        for callback in self._before_exit:
+            try:
+                callback()
+            except Exception as e:
+                logger.exception(f"Error before worker recycle: {str(e)}")
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    def status(self):
+        return {
+            "recycleThresholdMb": self.threshold_mb or None,
+            "draining": self.draining,
+            "uptimeSeconds": round(time.time() - self.started_at)
+        }
+
+
+memory_watchdog = MemoryWatchdog()
+
+
+def memory_report(include_tracemalloc=True, top=20):
+    """Everything the debug endpoint shows"""
+    report = {
+        "pid": os.getpid(),
+        "rssMb": round(current_rss_bytes() / MB, 1),
+        "peakRssMb": round(peak_rss_bytes() / MB, 1),
+        "tfDevices": tf_memory_info(),
+        "requests": request_memory_stats.summary(),
+        "watchdog": memory_watchdog.status(),
+        "tracemalloc": {"tracing": tracemalloc.is_tracing()}
+    }
+    if include_tracemalloc and tracemalloc.is_tracing():
+        report["tracemalloc"].update(tracemalloc_report(top))
+    return report
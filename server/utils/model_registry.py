@@ -0,0 +1,313 @@
+import os
+import re
+import time
+import random
+import datetime
+import threading
+import numpy as np
+from dotenv import load_dotenv
+from utils.logger import get_logger
+from utils.job_queue import BackgroundWorkerPool
+from utils.embeddings import EMBEDDINGS_ENABLED, build_dual_output_model
+from utils.tuning_profile import configure_tf_threads
+from utils.inference_scheduler import inference_scheduler, BATCH
+from utils.admission import Overloaded
+
+load_dotenv()
+
+logger = get_logger(__name__)
+
+# Model registry layout:
+#   model/vgg19_ML_Model.h5               -> version "legacy"
+#   model/versions/<version>/<file>.h5    -> version "<version>"
+#   model/ACTIVE_VERSION                  -> name of the version to serve
+MODEL_DIR = os.getenv('MODEL_DIR', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'model'))
+LEGACY_MODEL_FILE = 'vgg19_ML_Model.h5'
+LEGACY_VERSION = 'legacy'
+VERSIONS_SUBDIR = 'versions'
+ACTIVE_VERSION_FILE = 'ACTIVE_VERSION'
+MODEL_EXTENSIONS = ('.h5', '.keras')
+
+MODEL_VERSION = os.getenv('MODEL_VERSION')  # pins the version and disables the pointer file
+MODEL_WATCH_INTERVAL = int(os.getenv('MODEL_WATCH_INTERVAL', '30'))  # seconds, 0 disables
+SHADOW_MODEL_VERSION = os.getenv('SHADOW_MODEL_VERSION')
+SHADOW_SAMPLE_RATE = float(os.getenv('SHADOW_SAMPLE_RATE', '0.05'))
+# Load the model at startup instead of on the first prediction
+MODEL_PRELOAD = os.getenv('MODEL_PRELOAD', 'true').lower() == 'true'
+# Batch sizes to run through the model before it is marked ready; defaults to single
+# images plus the study batch size (same setting study_routes reads)
+DEFAULT_WARMUP_BATCH_SIZES = ','.join(str(size) for size in sorted({1, int(os.getenv('STUDY_BATCH_SIZE', '16'))}))
+WARMUP_BATCH_SIZES = tuple(
+    int(size) for size in os.getenv('WARMUP_BATCH_SIZES', DEFAULT_WARMUP_BATCH_SIZES).split(',') if size.strip()
+)
+INPUT_SHAPE = (240, 240, 3)
+# Shadow runs queue as one batch user, so they hold at most INFERENCE_MAX_QUEUED_PER_USER queue places
+SHADOW_USER_KEY = 'shadow-model'
+
+
+class ModelHandle:
+    """A loaded model and the version it came from; requests keep the handle they started with"""
+
+    def __init__(self, version, model, path, dual_model=None):
+        self.version = version
+        self.model = model
+        self.path = path
+        # Same weights, also returning penultimate activations (None if embeddings are off)
+        self.dual_model = dual_model
+        self.loaded_at = datetime.datetime.utcnow()
+
+
+def version_sort_key(version):
+    """Order versions by their numeric parts, so v10 comes after v9 and 1.10 after 1.9"""
+    return [(0, int(part), '') if part.isdigit() else (1, 0, part) for part in re.findall(r'\d+|\D+', version)]
+
+
+def warm_up(model, batch_sizes=(1,)):
+    """Run dummy inferences so graph tracing and kernel selection happen before traffic"""
+    for batch_size in batch_sizes:
+        model.predict(np.zeros((batch_size,) + INPUT_SHAPE, dtype=np.float32), verbose=0)
+
+
+class ModelRegistry:
+    """
+    Versioned models on disk with background loading and atomic swaps
+
+    The active handle is replaced with a single reference assignment after
+    the new version is loaded and warmed up, so in-flight requests finish on
+    the handle they already hold while new requests see the new version.
+    Loading happens under a lock, so a burst of first requests loads the
+    model exactly once; the registry is "ready" once a warmed-up model is
+    active.
+    """
+
+    def __init__(self, model_dir=MODEL_DIR):
+        self.model_dir = model_dir
+        self._active = None
+        self._shadow = None
+        self._swap_lock = threading.Lock()
+        self._load_error = None
+        self._loading = False
+        self._pointer_mtime = None
+        self._watcher = None
+        self.shadow_stats = {"runs": 0, "agreements": 0, "meanAbsDiff": 0.0, "skipped": 0}
+
+    def list_versions(self):
+        """Return {version: model_path} for every model found on disk"""
+        versions = {}
+        legacy_path = os.path.join(self.model_dir, LEGACY_MODEL_FILE)
+        if os.path.exists(legacy_path):
+            versions[LEGACY_VERSION] = legacy_path
+        versions_dir = os.path.join(self.model_dir, VERSIONS_SUBDIR)
+        if os.path.isdir(versions_dir):
+            for version in sorted(os.listdir(versions_dir), key=version_sort_key):
+                version_dir = os.path.join(versions_dir, version)
+                if not os.path.isdir(version_dir):
+                    continue
+                model_files = sorted(name for name in os.listdir(version_dir) if name.endswith(MODEL_EXTENSIONS))
+                if model_files:
+                    versions[version] = os.path.join(version_dir, model_files[0])
+        return versions
+
+    def _pointer_path(self):
+        return os.path.join(self.model_dir, ACTIVE_VERSION_FILE)
+
+    def resolve_active_version(self):
+        """Version that should be served: MODEL_VERSION, else the pointer file, else the newest on disk"""
+        if MODEL_VERSION:
+            return MODEL_VERSION
+        pointer = self._pointer_path()
+        if os.path.exists(pointer):
+            with open(pointer) as f:
+                version = f.read().strip()
+            if version:
+                return version
+        versions = self.list_versions()
+        named = [v for v in versions if v != LEGACY_VERSION]
+        if named:
+            return named[-1]
+        return LEGACY_VERSION if versions else None
+
+    def load_version(self, version, batch_sizes=WARMUP_BATCH_SIZES):
+        """Load and warm up one version without touching the active handle"""
+        from tensorflow.keras.models import load_model
+
+        path = self.list_versions().get(version)
+        if path is None:
+            raise FileNotFoundError(f"Model version '{version}' not found under {self.model_dir}")
+        configure_tf_threads()
+        model = load_model(path)
+        dual_model = build_dual_output_model(model) if EMBEDDINGS_ENABLED else None
+        # Warm up whichever graph will serve requests
+        warm_up(dual_model or model, batch_sizes)
+        logger.info(f"Loaded model version {version}", extra={"fields": {"path": path, "embeddings": dual_model is not None}})
+        return ModelHandle(version, model, path, dual_model)
+
+    def get_active(self):
+        """Return the active model handle, loading it exactly once on first use"""
+        handle = self._active
+        if handle is not None:
+            return handle
+        with self._swap_lock:
+            # Another thread may have finished loading while we waited for the lock
+            if self._active is None:
+                version = self.resolve_active_version()
+                if version is None:
+                    self._load_error = f"No model found under {self.model_dir}"
+                    raise FileNotFoundError(self._load_error)
+                self._loading = True
+                try:
+                    self._active = self.load_version(version)
+                    self._load_error = None
+                except Exception as e:
+                    self._load_error = str(e)
+                    raise
+                finally:
+                    self._loading = False
+            return self._active
+
+    def preload_in_background(self):
+        """Load and warm up the active version at startup so readiness flips before traffic"""
+        if not MODEL_PRELOAD:
+            return None
+
+        def preload():
+            try:
+                self.get_active()
+            except Exception as e:
+                logger.exception(f"Model preload failed: {str(e)}")
+
+        thread = threading.Thread(target=preload, name='model-preload', daemon=True)
+        thread.start()
+        return thread
+
+    def is_ready(self):
+        return self._active is not None
+
+    def readiness(self):
+        """Readiness details for the health endpoint"""
+        handle = self._active
+        return {
+            "ready": handle is not None,
+            "loading": self._loading,
+            "modelVersion": handle.version if handle else None,
+            "warmupBatchSizes": list(WARMUP_BATCH_SIZES),
+            "error": self._load_error
+        }
+
+    def active_version(self):
+        handle = self._active
+        return handle.version if handle else self.resolve_active_version()
+
+    def activate(self, version):
+        """Load a version and swap it in; safe to call from a background thread"""
+        with self._swap_lock:
+            if self._active is not None and self._active.version == version:
+                return self._active
+            handle = self.load_version(version)
+            previous = self._active
+            self._active = handle
+            logger.info(f"Activated model version {version}", extra={"fields": {
+                "previousVersion": previous.version if previous else None
+            }})
+            return handle
+
+    def _activate_safely(self, version):
+        try:
+            self.activate(version)
+        except Exception as e:
+            logger.exception(f"Failed to activate model version {version}: {str(e)}")
+
+    def set_active_pointer(self, version):
+        """Point ACTIVE_VERSION at a version; running servers pick it up on their next poll"""
+        if version not in self.list_versions():
+            raise FileNotFoundError(f"Model version '{version}' not found under {self.model_dir}")
+        pointer = self._pointer_path()
+        temp_pointer = pointer + '.tmp'
+        with open(temp_pointer, 'w') as f:
+            f.write(version + '\n')
+        os.replace(temp_pointer, pointer)
+
+    def start_watcher(self):
+        """Poll the ACTIVE_VERSION pointer and hot-swap when it changes"""
+        if MODEL_VERSION or MODEL_WATCH_INTERVAL <= 0 or self._watcher is not None:
+            return
+
+        def watch():
+            while True:
+                time.sleep(MODEL_WATCH_INTERVAL)
+                try:
+                    pointer = self._pointer_path()
+                    mtime = os.path.getmtime(pointer) if os.path.exists(pointer) else None
+                    if mtime == self._pointer_mtime:
+                        continue
+                    self._pointer_mtime = mtime
+                    version = self.resolve_active_version()
+                    # Only swap once a model has been served; until then get_active loads the right one
+                    if self._active is not None and version and version != self._active.version:
+                        self._activate_safely(version)
+                except Exception as e:
+                    logger.exception(f"Error in model watcher: {str(e)}")
+
+        pointer = self._pointer_path()
+        self._pointer_mtime = os.path.getmtime(pointer) if os.path.exists(pointer) else None
+        self._watcher = threading.Thread(target=watch, name='model-watcher', daemon=True)
+        self._watcher.start()
+        logger.info("Started model version watcher")
+
+    # Shadow mode: run a candidate version on sampled traffic off the request path
+
+    def _get_shadow(self):
+        if self._shadow is None or self._shadow.version != SHADOW_MODEL_VERSION:
+            self._shadow = self.load_version(SHADOW_MODEL_VERSION)
+        return self._shadow
+
+    def _run_shadow(self, item):
+        processed_img, primary_version, primary_score, shadow_collection = item
+        shadow = self._get_shadow()
+        # Shadow runs count toward INFERENCE_MAX_CONCURRENCY like any other inference
+        try:
+            with inference_scheduler.slot(BATCH, SHADOW_USER_KEY):
+                shadow_score = float(shadow.model.predict(processed_img, verbose=0)[0][0])
+        except Overloaded:
+            self.shadow_stats["skipped"] += 1
+            return
+        agree = (shadow_score < 0.5) == (primary_score < 0.5)
+
+        stats = self.shadow_stats
+        stats["runs"] += 1
+        stats["agreements"] += int(agree)
+        stats["meanAbsDiff"] += (abs(shadow_score - primary_score) - stats["meanAbsDiff"]) / stats["runs"]
+
+        if shadow_collection is not None:
+            shadow_collection.insert_one({
+                "primaryVersion": primary_version,
+                "shadowVersion": shadow.version,
+                "primaryScore": primary_score,
+                "shadowScore": shadow_score,
+                "agree": agree,
+                "timestamp": datetime.datetime.utcnow()
+            })
+
+    def maybe_shadow(self, processed_img, primary_version, primary_score, shadow_collection=None):
+        """Queue a sampled shadow comparison; never blocks or fails the caller"""
+        if not SHADOW_MODEL_VERSION or SHADOW_MODEL_VERSION == primary_version:
+            return False
+        if random.random() >= SHADOW_SAMPLE_RATE:
+            return False
+        # The caller's array may be a reused buffer, and the comparison runs after it returns
+        return shadow_workers.submit((processed_img.copy(), primary_version, float(primary_score), shadow_collection))
+
+    def status(self):
+        handle = self._active
+        return {
+            "activeVersion": handle.version if handle else None,
+            "loadedAt": handle.loaded_at.isoformat() if handle else None,
+            "availableVersions": sorted(self.list_versions(), key=version_sort_key),
+            "shadowVersion": SHADOW_MODEL_VERSION,
+            "shadowSampleRate": SHADOW_SAMPLE_RATE if SHADOW_MODEL_VERSION else 0,
+            "shadowStats": dict(self.shadow_stats)
+        }
+
+
+model_registry = ModelRegistry()
+shadow_workers = BackgroundWorkerPool('shadow-model', model_registry._run_shadow, num_workers=1, max_queue=20)
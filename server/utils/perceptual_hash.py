@@ -0,0 +1,177 @@
+import os
+import threading
+import numpy as np
+from PIL import Image
+from dotenv import load_dotenv
+from utils.logger import get_logger
+from utils.prediction_schema import decode_prediction
+
+load_dotenv()
+
+logger = get_logger(__name__)
+
+# Near-duplicate reuse settings
+PHASH_DEDUP_ENABLED = os.getenv('PHASH_DEDUP_ENABLED', 'false').lower() == 'true'
+PHASH_MAX_DISTANCE = int(os.getenv('PHASH_MAX_DISTANCE', '3'))  # bits out of 64
+
+HASH_SIZE = 8
+DCT_SIZE = 32
+
+
+def _dct_matrix(size):
+    # Orthonormal DCT-II basis, so dct2(x) = D @ x @ D.T
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2.0 / size)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+
+_DCT = _dct_matrix(DCT_SIZE)
+
+
+def compute_phash(processed_img):
+    """
+    64-bit DCT perceptual hash of a preprocessed image
+
+    Args:
+        processed_img (ndarray): (1, h, w, 3) or (h, w, 3) array scaled to [0, 1],
+            i.e. the already decoded and resized model input
+
+    Returns:
+        str: 16 hex digit hash, or None for (near) blank images whose hash
+        would match every other blank image
+    """
+    pixels = processed_img[0] if processed_img.ndim == 4 else processed_img
+    gray = pixels.mean(axis=2).astype(np.float32)
+    if gray.std() < 1e-3:
+        return None
+    gray = Image.fromarray(gray, mode='F')
+    small = np.asarray(gray.resize((DCT_SIZE, DCT_SIZE), Image.BOX), dtype=np.float32)
+    coefficients = (_DCT @ small @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].flatten()
+    # Compare against the median of the AC coefficients so the DC term does not skew the threshold
+    bits = coefficients > np.median(coefficients[1:])
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return f"{value:016x}"
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """Burkhard-Keller tree over integer hashes with Hamming distance"""
+
+    def __init__(self):
+        self._root = None
+        self.size = 0
+
+    def add(self, key, value):
+        node = [key, value, {}]
+        self.size += 1
+        if self._root is None:
+            self._root = node
+            return
+        current = self._root
+        while True:
+            distance = hamming_distance(key, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, key, max_distance):
+        """Return [(distance, value)] for all entries within max_distance, closest first"""
+        if self._root is None:
+            return []
+        matches = []
+        stack = [self._root]
+        while stack:
+            node_key, value, children = stack.pop()
+            distance = hamming_distance(key, node_key)
+            if distance <= max_distance:
+                matches.append((distance, value))
+            # Triangle inequality: only children within [d - max, d + max] can match
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+
+class PerceptualHashIndex:
+    """
+    Process-wide index of prediction hashes
+
+    Hashes are grouped per user and model version, and a lookup only sees
+    the requesting user's own earlier scans, so a reused result never
+    reveals another user's diagnosis. Anonymous predictions are not indexed.
+    Existing hashes are loaded from the predictions collection in a background
+    thread on first use; until that finishes lookups simply miss.
+    """
+
+    def __init__(self, max_distance=PHASH_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self._trees = {}
+        self._lock = threading.Lock()
+        self._loading = False
+        self.loaded = False
+
+    def ensure_loaded(self, predictions_collection):
+        with self._lock:
+            if self._loading:
+                return
+            self._loading = True
+        threading.Thread(target=self._load, args=(predictions_collection,), daemon=True).start()
+
+    def _load(self, predictions_collection):
+        try:
+            cursor = predictions_collection.find(
+                {"phash": {"$exists": True}, "reusedFrom": {"$exists": False}, "userId": {"$ne": None}},
+                {"v": 1, "userId": 1, "phash": 1, "result": 1, "confidence": 1, "modelVersion": 1}
+            ).batch_size(5000)
+            for prediction in map(decode_prediction, cursor):
+                self.add(
+                    prediction["phash"],
+                    prediction["_id"],
+                    prediction["result"],
+                    prediction.get("confidence", 0),
+                    prediction.get("modelVersion"),
+                    prediction["userId"]
+                )
+            self.loaded = True
+            logger.info(f"Loaded {self.size()} perceptual hashes")
+        except Exception as e:
+            logger.exception(f"Error loading perceptual hash index: {str(e)}")
+            with self._lock:
+                self._loading = False
+
+    def add(self, phash, prediction_id, result, confidence, model_version=None, user_id=None):
+        if user_id is None:
+            return
+        with self._lock:
+            tree = self._trees.setdefault((str(user_id), model_version), BKTree())
+            tree.add(int(phash, 16), (prediction_id, result, confidence, model_version))
+
+    def find(self, phash, user_id, model_version=None):
+        """
+        Return the closest prior (prediction_id, result, confidence, model_version)
+        of `user_id` within the threshold that was produced by `model_version`,
+        or None
+        """
+        if user_id is None:
+            return None
+        with self._lock:
+            tree = self._trees.get((str(user_id), model_version))
+            matches = tree.search(int(phash, 16), self.max_distance) if tree else []
+        return matches[0][1] if matches else None
+
+    def size(self):
+        with self._lock:
+            return sum(tree.size for tree in self._trees.values())
+
+
+phash_index = PerceptualHashIndex()
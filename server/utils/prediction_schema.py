@@ -0,0 +1,213 @@
+"""
+Prediction document schema
+
+Version 2 (current):
+    v           2
+    userId      ObjectId; absent for anonymous predictions
+    timestamp   datetime
+    result      int, RESULT_CODES
+    confidence  int, hundredths of a percent (0-10000)
+    decidedBy   int, STAGE_CODES
+    image       16-byte BLAKE2b hash of the uploaded file, stored as uploads/<hex>.<ext>
+    ext         extension of that file (becomes "webp" once retention recompresses it)
+    optional    name (the file name the user uploaded, shown instead of the hash),
+                modelVersion, phash, reusedFrom, embedding, studyId, sliceIndex,
+                saliency, imagePurged
+
+Version 1 (no "v") stored result and decidedBy as strings, confidence as a
+float, the upload's file name in imageName and an isAnonymous flag.
+
+Field names are shared between versions, so filters built here match both
+and the same indexes serve both while migrate_predictions.py converts old
+documents. Read documents through decode_prediction.
+"""
+import os
+import shutil
+import hashlib
+from bson.binary import Binary
+
+SCHEMA_VERSION = 2
+
+TUMOR = "Tumor"
+NO_TUMOR = "No Tumor"
+RESULT_CODES = {NO_TUMOR: 0, TUMOR: 1}
+RESULT_NAMES = {code: name for name, code in RESULT_CODES.items()}
+
+# Which model decided a prediction (see run_inference)
+STAGE_CODES = {"vgg19": 0, "screen": 1, "phash": 2}
+STAGE_NAMES = {code: name for name, code in STAGE_CODES.items()}
+
+CONFIDENCE_SCALE = 100  # stored confidence = percent * 100
+IMAGE_HASH_BYTES = 16
+IMAGE_EXTENSIONS = {'PNG': 'png', 'JPEG': 'jpg'}
+
+# Fields the dashboard needs to list predictions; with userId they form the covering index below
+LIST_FIELDS = {"timestamp": 1, "result": 1, "image": 1, "ext": 1, "imageName": 1, "name": 1}
+LIST_INDEX = [
+    ("userId", 1), ("timestamp", -1), ("result", 1), ("image", 1), ("ext", 1), ("imageName", 1), ("name", 1),
+    ("_id", 1)
+]
+LIST_INDEX_NAME = "user_history_covering"
+
+
+def hash_image(stream, chunk_size=1024 * 1024):
+    """Content hash of an upload (a file-like object, rewound afterwards)"""
+    digest = hashlib.blake2b(digest_size=IMAGE_HASH_BYTES)
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.digest()
+
+
+def image_filename(image_hash, ext):
+    return f"{image_hash.hex()}.{ext}"
+
+
+def parse_image_filename(filename):
+    """(hash, ext) if filename is content-addressed, else None"""
+    stem, _, ext = filename.partition('.')
+    if len(stem) != IMAGE_HASH_BYTES * 2 or not ext:
+        return None
+    try:
+        return bytes.fromhex(stem), ext
+    except ValueError:
+        return None
+
+
+def encode_result(result):
+    return RESULT_CODES[result]
+
+
+def encode_confidence(confidence):
+    return int(round(confidence * CONFIDENCE_SCALE))
+
+
+def result_filter(result):
+    """Filter value matching a result in either schema version"""
+    return {"$in": [RESULT_CODES[result], result]}
+
+
+def image_reference(filename):
+    """Fields referencing an uploaded file in a new document"""
+    parsed = parse_image_filename(filename)
+    if parsed is None:
+        return {"imageName": filename}
+    image_hash, ext = parsed
+    return {"image": Binary(image_hash), "ext": ext}
+
+
+def image_filter(filename):
+    """Filter matching every prediction (either version) that references an uploaded file"""
+    parsed = parse_image_filename(filename)
+    if parsed is None:
+        return {"imageName": filename}
+    image_hash, ext = parsed
+    return {"$or": [{"imageName": filename}, {"image": Binary(image_hash), "ext": ext}]}
+
+
+def rename_image_updates(filename, new_filename):
+    """(filter, update) pairs that point predictions at a renamed file, e.g. after recompression"""
+    updates = [({"imageName": filename}, {"$set": {"imageName": new_filename}})]
+    parsed, new_parsed = parse_image_filename(filename), parse_image_filename(new_filename)
+    if parsed and new_parsed and parsed[0] == new_parsed[0]:
+        updates.append(({"image": Binary(parsed[0]), "ext": parsed[1]}, {"$set": {"ext": new_parsed[1]}}))
+    return updates
+
+
+def build_document(user_id, image_name, result, confidence, decided_by, timestamp, name=None):
+    """Core fields of a version 2 prediction document; `name` is the uploaded file's own name"""
+    document = {
+        "v": SCHEMA_VERSION,
+        "timestamp": timestamp,
+        "result": encode_result(result),
+        "confidence": encode_confidence(confidence),
+        "decidedBy": STAGE_CODES[decided_by],
+        **image_reference(image_name)
+    }
+    if user_id is not None:
+        document["userId"] = user_id
+    if name:
+        document["name"] = name
+    return document
+
+
+def stored_image_name(document):
+    """File name of a prediction's upload, or None"""
+    if document.get("image") is not None:
+        return image_filename(bytes(document["image"]), document.get("ext"))
+    return document.get("imageName")
+
+
+def display_name(prediction):
+    """File name to show for a decoded prediction: the uploaded name, else the stored one"""
+    return prediction.get("name") or prediction.get("imageName")
+
+
+def decode_prediction(document):
+    """
+    Read a prediction of either version into the version 1 shape the API uses
+
+    Works on projections: only the fields present are decoded.
+    """
+    # "v" is left out of the dashboard projections; only version 2 stores result as a number
+    current = document.get("v") == SCHEMA_VERSION or isinstance(document.get("result"), int)
+    decoded = {
+        key: value for key, value in document.items()
+        if key not in ("v", "image", "ext", "isAnonymous")
+    }
+    if "userId" in document or document.get("v") == SCHEMA_VERSION:
+        decoded["userId"] = document.get("userId")
+    if current:
+        if "result" in document:
+            decoded["result"] = RESULT_NAMES[document["result"]]
+        if "confidence" in document:
+            decoded["confidence"] = document["confidence"] / CONFIDENCE_SCALE
+        if "decidedBy" in document:
+            decoded["decidedBy"] = STAGE_NAMES[document["decidedBy"]]
+    if "image" in document or "imageName" in document:
+        decoded["imageName"] = stored_image_name(document)
+    return decoded
+
+
+def upgrade_document(document, upload_dir):
+    """
+    Version 2 form of a version 1 document ({"$set", "$unset"} update), used by migrate_predictions.py
+
+    The upload is re-filed under its content hash (hard link; the caller
+    removes the old name once the update is written) and the old file name
+    is kept as the display name. A missing file keeps its imageName.
+
+    Returns:
+        tuple: (update, old_path_to_remove or None)
+    """
+    update = {
+        "v": SCHEMA_VERSION,
+        "result": encode_result(document["result"]),
+        "confidence": encode_confidence(document.get("confidence", 0)),
+        "decidedBy": STAGE_CODES.get(document.get("decidedBy", "vgg19"), STAGE_CODES["vgg19"])
+    }
+    unset = {"isAnonymous": ""}
+    if document.get("userId") is None:
+        unset["userId"] = ""
+
+    old_path = None
+    image_name = document.get("imageName")
+    source_path = os.path.join(upload_dir, image_name) if image_name else None
+    if source_path and os.path.exists(source_path):
+        ext = os.path.splitext(image_name)[1].lstrip('.').lower() or 'png'
+        ext = 'jpg' if ext == 'jpeg' else ext
+        with open(source_path, 'rb') as f:
+            image_hash = hash_image(f)
+        target_path = os.path.join(upload_dir, image_filename(image_hash, ext))
+        if target_path != source_path:
+            if not os.path.exists(target_path):
+                try:
+                    os.link(source_path, target_path)
+                except OSError:
+                    # e.g. a filesystem without hard links
+                    shutil.copy2(source_path, target_path)
+            old_path = source_path
+        update.update({"image": Binary(image_hash), "ext": ext, "name": image_name})
+        unset["imageName"] = ""
+    return {"$set": update, "$unset": unset}, old_path
@@ -0,0 +1,419 @@
+"""
+Image decode/preprocess stage, run in worker processes
+
+Decoding and resizing an upload with PIL holds the GIL for much of the
+work, so on the request thread it stalls the rest of the Flask worker and
+never overlaps inference. Here PREPROCESS_WORKERS processes decode uploads
+in parallel. The raw uploads are copied into a shared memory block owned by
+this process, in chunks from their (possibly disk-spooled) streams, and the
+workers write the float32 model input back into the same block, which the
+request thread then feeds to the model without copying. Only offsets cross
+the process boundary. Routes decode before they ask for an inference slot,
+so one request's decode runs while another's inference does.
+
+PREPROCESS_MODE=inline decodes on the calling thread (threads for
+multi-image batches) as before; the process mode falls back to that for a
+request if its workers die, and restarts them for the next one.
+"""
+import io
+import os
+import sys
+import time
+import atexit
+import weakref
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+from PIL import Image
+from dotenv import load_dotenv
+from utils.logger import get_logger
+from utils.perceptual_hash import compute_phash
+
+load_dotenv()
+
+logger = get_logger(__name__)
+
+PROCESS = 'process'
+INLINE = 'inline'
+
+# Preprocess settings
+PREPROCESS_MODE = os.getenv('PREPROCESS_MODE', PROCESS).lower()
+PREPROCESS_WORKERS = int(os.getenv('PREPROCESS_WORKERS', str(min(4, os.cpu_count() or 1))))
+PREPROCESS_TIMEOUT = float(os.getenv('PREPROCESS_TIMEOUT', '30'))  # seconds per batch
+# Idle shared memory kept for reuse; larger leases are freed once released
+PREPROCESS_SHM_CACHE_MB = int(os.getenv('PREPROCESS_SHM_CACHE_MB', '64'))
+# fork starts workers without re-importing the app (app.py starts them before TensorFlow is
+# imported); spawn and forkserver re-run the entry module in every worker, so only use them
+# when it is gunicorn/uvicorn
+PREPROCESS_START_METHOD = os.getenv(
+    'PREPROCESS_START_METHOD', 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+)
+
+TARGET_SIZE = (240, 240)
+COPY_CHUNK_BYTES = 1024 * 1024
+
+
+class PreprocessError(Exception):
+    """Raised when an image cannot be decoded, or decoding timed out"""
+
+
+def decode_image(source, target_size=TARGET_SIZE):
+    """
+    Decode an image into model input: RGB, resized, float32 scaled to [0, 1]
+
+    Args:
+        source: Raw bytes or a file-like stream
+
+    Returns:
+        ndarray: (height, width, 3) float32 array
+    """
+    if not hasattr(source, 'read'):
+        source = io.BytesIO(source)
+    img = Image.open(source)
+    img = img.convert('RGB')
+    img = img.resize(target_size)
+    return np.asarray(img, dtype=np.float32) / 255.0
+
+
+def _source_size(source):
+    if not hasattr(source, 'read'):
+        return len(source)
+    source.seek(0, os.SEEK_END)
+    size = source.tell()
+    source.seek(0)
+    return size
+
+
+def _copy_source(source, buffer):
+    """Copy raw bytes or a stream (rewound for the caller) into a view of a shared block, in chunks"""
+    if not hasattr(source, 'read'):
+        buffer[:] = source
+        return
+    source.seek(0)
+    offset = 0
+    while offset < len(buffer):
+        chunk = source.read(min(COPY_CHUNK_BYTES, len(buffer) - offset))
+        if not chunk:
+            break
+        buffer[offset:offset + len(chunk)] = chunk
+        offset += len(chunk)
+    source.seek(0)
+
+
+def _decode_into_shared(shm_name, source_offset, source_size, offset, target_size):
+    """Worker process: decode the upload at `source_offset` of the caller's block into it at `offset`; returns its phash"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        # Only this image's bytes are copied out, and no view of the block is alive while PIL decodes
+        with shm.buf[source_offset:source_offset + source_size] as raw:
+            data = bytes(raw)
+        pixels = decode_image(data, target_size)
+        phash = compute_phash(pixels)
+        shm.buf[offset:offset + pixels.nbytes] = memoryview(pixels).cast('B')
+    finally:
+        shm.close()
+    return phash
+
+
+_row_buffers = threading.local()
+
+
+def gather_rows(batch, rows):
+    """
+    The selected rows of a batch as one contiguous array
+
+    Returns the batch itself when every row is selected; otherwise the rows
+    are copied into a scratch array reused by this thread, which is only
+    valid until its next call.
+    """
+    if len(rows) == batch.shape[0]:
+        return batch
+    buffer = getattr(_row_buffers, 'batch', None)
+    fits = buffer is not None and buffer.dtype == batch.dtype and buffer.shape[1:] == batch.shape[1:]
+    if not fits or buffer.shape[0] < len(rows):
+        buffer = np.empty((max(len(rows), batch.shape[0]),) + batch.shape[1:], dtype=batch.dtype)
+        _row_buffers.batch = buffer
+    out = buffer[:len(rows)]
+    np.take(batch, rows, axis=0, out=out)
+    return out
+
+
+class _SharedBuffers:
+    """
+    Shared memory blocks reused across requests; each lease belongs to one caller at a time
+
+    A block is released with a weak reference to the array viewing it and
+    is only handed out again once that array (and so every view of it) is
+    gone. A freed block is unlinked at once but stays mapped while viewed.
+    """
+
+    def __init__(self, max_idle_bytes):
+        self.max_idle_bytes = max_idle_bytes
+        # (block, weak reference to its array or None)
+        self._idle = []
+        # Freed blocks an array still views; they are unmapped once it is gone
+        self._pinned = []
+        self._lock = threading.Lock()
+        self.created = 0
+
+    def acquire(self, size):
+        self._sweep()
+        with self._lock:
+            fitting = [
+                entry for entry in self._idle
+                if entry[0].size >= size and (entry[1] is None or entry[1]() is None)
+            ]
+            if fitting:
+                entry = min(fitting, key=lambda item: item[0].size)
+                self._idle.remove(entry)
+                return entry[0]
+            self.created += 1
+        return shared_memory.SharedMemory(create=True, size=size)
+
+    def release(self, shm, reusable=True, viewed=None):
+        """Return a block; one a worker may still write to (after a timeout) is never handed out again"""
+        with self._lock:
+            idle_bytes = sum(block.size for block, _ in self._idle)
+            if reusable and idle_bytes + shm.size <= self.max_idle_bytes:
+                self._idle.append((shm, viewed))
+                return
+        self._free(shm)
+
+    def _free(self, shm):
+        shm.unlink()
+        try:
+            shm.close()
+        except BufferError:
+            # An array from np.frombuffer holds an export, so the mapping stays valid while it lives
+            with self._lock:
+                self._pinned.append(shm)
+
+    def _sweep(self):
+        with self._lock:
+            pinned, self._pinned = self._pinned, []
+        for shm in pinned:
+            try:
+                shm.close()
+            except BufferError:
+                with self._lock:
+                    self._pinned.append(shm)
+
+    def idle_bytes(self):
+        with self._lock:
+            return sum(block.size for block, _ in self._idle)
+
+    def pinned(self):
+        with self._lock:
+            return len(self._pinned)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for shm, _ in idle:
+            self._free(shm)
+        self._sweep()
+
+
+class PreprocessPool:
+    """
+    Decodes batches of images into float32 model input
+
+    preprocess() is a context manager yielding (batch, phashes). In process
+    mode the batch is a view of a shared memory block, which is only reused
+    or unmapped once no array viewing it is left, so the batch stays valid
+    even if it is kept after the block exits.
+    """
+
+    def __init__(self, mode=PREPROCESS_MODE, workers=PREPROCESS_WORKERS, timeout=PREPROCESS_TIMEOUT,
+                 start_method=PREPROCESS_START_METHOD, target_size=TARGET_SIZE,
+                 max_idle_bytes=PREPROCESS_SHM_CACHE_MB * 1024 * 1024):
+        if mode not in (PROCESS, INLINE):
+            logger.warning(f"Unknown PREPROCESS_MODE {mode!r}, using {PROCESS}")
+            mode = PROCESS
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.start_method = start_method
+        self.target_size = target_size
+        self._buffers = _SharedBuffers(max_idle_bytes)
+        self._executor = None
+        self._threads = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self._exit_registered = False
+        self.images = 0
+        self.fallbacks = 0
+        self.restarts = 0
+        self.avg_ms = 0.0
+
+    def start(self):
+        """Start the worker processes now; with fork, before the app imports TensorFlow or starts threads"""
+        if self.mode == PROCESS:
+            self._get_executor()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is not None or self._closed:
+                return self._executor
+            if self.start_method == 'fork' and 'tensorflow' in sys.modules:
+                logger.warning("Forking preprocess workers after TensorFlow was imported; start the pool earlier")
+            try:
+                # Workers must report to this process's resource tracker; one of their own
+                # would unlink the blocks they attached to when they exit
+                resource_tracker.ensure_running()
+                executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context(self.start_method)
+                )
+                # Start every worker now rather than on the first upload
+                executor.submit(os.getpid).result(timeout=self.timeout)
+            except Exception as e:
+                logger.exception(f"Could not start preprocess workers, decoding inline: {str(e)}")
+                self.mode = INLINE
+                return None
+            self._executor = executor
+            if not self._exit_registered:
+                atexit.register(self.close)
+                self._exit_registered = True
+            logger.info(f"Started {self.workers} preprocess workers ({self.start_method})")
+            return executor
+
+    def _discard_executor(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self.restarts += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _get_threads(self):
+        with self._lock:
+            if self._threads is None:
+                self._threads = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='preprocess')
+            return self._threads
+
+    def _decode_inline(self, sources):
+        batch = np.empty((len(sources), self.target_size[1], self.target_size[0], 3), dtype=np.float32)
+
+        def decode(index):
+            batch[index] = decode_image(sources[index], self.target_size)
+            return compute_phash(batch[index])
+
+        try:
+            if len(sources) == 1:
+                phashes = [decode(0)]
+            else:
+                # Decoding and resizing release the GIL for most of their work, so threads parallelize it
+                phashes = list(self._get_threads().map(decode, range(len(sources))))
+        except Exception as e:
+            raise PreprocessError(str(e)) from e
+        return batch, phashes
+
+    def _decode_in_workers(self, executor, sources, sizes, shm, image_bytes):
+        """Returns the phashes; raises BrokenProcessPool if a worker died"""
+        # The raw uploads follow the decoded images in the block
+        source_offsets = [len(sources) * image_bytes + sum(sizes[:index]) for index in range(len(sources))]
+        for source, source_offset, size in zip(sources, source_offsets, sizes):
+            with shm.buf[source_offset:source_offset + size] as buffer:
+                _copy_source(source, buffer)
+        try:
+            futures = [
+                executor.submit(_decode_into_shared, shm.name, source_offsets[index], sizes[index],
+                                index * image_bytes, self.target_size)
+                for index in range(len(sources))
+            ]
+        except RuntimeError as e:
+            # Submitting to a pool that is shutting down or already broken
+            raise BrokenProcessPool(str(e)) from e
+        done, pending = wait(futures, timeout=self.timeout, return_when=FIRST_EXCEPTION)
+        for future in pending:
+            future.cancel()
+        for future in futures:
+            if future in done and future.exception() is not None:
+                error = future.exception()
+                if isinstance(error, BrokenProcessPool):
+                    raise error
+                raise PreprocessError(str(error)) from error
+        if pending:
+            raise PreprocessError(f"Decoding took longer than {self.timeout}s")
+        return [future.result() for future in futures]
+
+    @contextmanager
+    def preprocess(self, sources):
+        """
+        Decode images (bytes or streams) into one batch
+
+        Yields:
+            tuple: (batch, phashes) where batch is an (n, height, width, 3)
+            float32 array scaled to [0, 1] and phashes holds compute_phash
+            of each image
+
+        Raises:
+            PreprocessError: If an image cannot be decoded
+        """
+        start = time.perf_counter()
+        executor = self._get_executor() if self.mode == PROCESS else None
+        if executor is None:
+            batch, phashes = self._decode_inline(sources)
+            self._record(len(sources), start)
+            yield batch, phashes
+            return
+
+        shape = (len(sources), self.target_size[1], self.target_size[0], 3)
+        image_bytes = int(np.prod(shape[1:])) * np.dtype(np.float32).itemsize
+        sizes = [_source_size(source) for source in sources]
+        shm = self._buffers.acquire(image_bytes * len(sources) + sum(sizes))
+        reusable = False
+        viewed = None
+        try:
+            try:
+                phashes = self._decode_in_workers(executor, sources, sizes, shm, image_bytes)
+                # frombuffer (unlike ndarray(buffer=...)) holds an export, so the block cannot be
+                # unmapped under this array or any view of it
+                flat = np.frombuffer(shm.buf, dtype=np.float32, count=int(np.prod(shape)))
+                viewed = weakref.ref(flat)
+                batch = flat.reshape(shape)
+                del flat
+                reusable = True
+            except BrokenProcessPool as e:
+                logger.warning(f"Preprocess worker died, decoding inline and restarting workers: {str(e)}")
+                self._discard_executor(executor)
+                self.fallbacks += 1
+                batch, phashes = self._decode_inline(sources)
+            self._record(len(sources), start)
+            yield batch, phashes
+        finally:
+            batch = None
+            self._buffers.release(shm, reusable, viewed)
+
+    def _record(self, count, start):
+        self.images += count
+        self.avg_ms = 0.8 * self.avg_ms + 0.2 * (time.perf_counter() - start) * 1000
+
+    def status(self):
+        return {
+            "mode": self.mode,
+            "workers": self.workers if self.mode == PROCESS else 0,
+            "startMethod": self.start_method,
+            "running": self._executor is not None,
+            "images": self.images,
+            "avgBatchMs": round(self.avg_ms, 2),
+            "inlineFallbacks": self.fallbacks,
+            "restarts": self.restarts,
+            "sharedBlocksCreated": self._buffers.created,
+            "sharedIdleBytes": self._buffers.idle_bytes(),
+            "sharedPinnedBlocks": self._buffers.pinned()
+        }
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        self._buffers.close()
+
+
+preprocess_pool = PreprocessPool()
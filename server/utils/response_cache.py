@@ -0,0 +1,141 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import request, make_response, current_app
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Per-user response cache settings
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+# Entries also expire after this long, which bounds staleness when several worker processes each keep a cache
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '300'))  # seconds
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '10000'))
+
+
+class UserResponseCache:
+    """
+    In-process cache of rendered JSON responses, invalidated per user by version
+
+    Each user has a version counter that is bumped whenever their data
+    changes (e.g. a new prediction). Entries remember the version they were
+    rendered at and are ignored once it moves on, so invalidation is a
+    single increment rather than a scan over cached keys.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl=RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def version(self, user_id):
+        return self._versions.get(str(user_id), 0)
+
+    def bump(self, user_id):
+        """Invalidate every cached response for a user"""
+        with self._lock:
+            user_id = str(user_id)
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get(self, user_id, key):
+        """Return (etag, body) if a fresh entry exists for the user's current version"""
+        cache_key = (str(user_id), key)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is None:
+                return None
+            version, stored_at, etag, body = entry
+            if version != self._versions.get(cache_key[0], 0) or time.monotonic() - stored_at > self.ttl:
+                del self._entries[cache_key]
+                return None
+            self._entries.move_to_end(cache_key)
+            return etag, body
+
+    def put(self, user_id, key, version, etag, body):
+        with self._lock:
+            self._entries[(str(user_id), key)] = (version, time.monotonic(), etag, body)
+            self._entries.move_to_end((str(user_id), key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+response_cache = UserResponseCache()
+
+
+def cached_user_response(key_func):
+    """
+    Cache a user's 200 JSON responses and answer If-None-Match with 304
+
+    Must be applied inside token_required so request.user_id is set.
+    `key_func` returns the cache key for the current request, or None to
+    bypass the cache (e.g. for pages other than the first).
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            key = key_func() if RESPONSE_CACHE_ENABLED else None
+            if key is None:
+                return f(*args, **kwargs)
+
+            cached = response_cache.get(request.user_id, key)
+            if cached is None:
+                # Read the version before querying so a prediction stored meanwhile invalidates this entry
+                version = response_cache.version(request.user_id)
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                body = response.get_data()
+                etag = hashlib.sha1(body).hexdigest()
+                response_cache.put(request.user_id, key, version, etag, body)
+            else:
+                etag, body = cached
+                response = current_app.response_class(body, status=200, mimetype='application/json')
+
+            response.set_etag(etag)
+            # Responses are per user; browsers must revalidate, which is then a cheap 304
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response.make_conditional(request)
+        return decorated
+    return decorator
+
+
+def async_cached_user_response(key_func):
+    """cached_user_response for the Quart routes of the async serving mode (shares the same cache and ETags)"""
+    from quart import request as async_request, make_response as async_make_response, current_app as async_app
+
+    def decorator(f):
+        @wraps(f)
+        async def decorated(*args, **kwargs):
+            key = key_func() if RESPONSE_CACHE_ENABLED else None
+            if key is None:
+                return await f(*args, **kwargs)
+
+            cached = response_cache.get(async_request.user_id, key)
+            if cached is None:
+                # Read the version before querying so a prediction stored meanwhile invalidates this entry
+                version = response_cache.version(async_request.user_id)
+                response = await async_make_response(await f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                body = await response.get_data()
+                etag = hashlib.sha1(body).hexdigest()
+                response_cache.put(async_request.user_id, key, version, etag, body)
+            else:
+                etag, body = cached
+                response = async_app.response_class(body, status=200, mimetype='application/json')
+
+            response.set_etag(etag)
+            # Responses are per user; browsers must revalidate, which is then a cheap 304
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return await response.make_conditional(async_request)
+        return decorated
+    return decorator
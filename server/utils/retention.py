@@ -0,0 +1,327 @@
+import os
+import gzip
+import time
+import uuid
+import socket
+import datetime
+import pymongo
+from bson import json_util
+from PIL import Image, features
+from dotenv import load_dotenv
+from utils.logger import get_logger
+from utils.response_cache import response_cache
+from utils.prediction_schema import image_filter, rename_image_updates
+from utils.saliency import SALIENCY_DIR, remove_overlay
+
+load_dotenv()
+
+logger = get_logger(__name__)
+
+SERVER_DIR = os.path.dirname(os.path.dirname(__file__))
+UPLOAD_DIR = os.path.join(SERVER_DIR, 'uploads')
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', os.path.join(SERVER_DIR, 'archive'))
+
+# Retention policy
+RETENTION_ANONYMOUS_DAYS = int(os.getenv('RETENTION_ANONYMOUS_DAYS', '90'))
+RETENTION_RECOMPRESS_DAYS = int(os.getenv('RETENTION_RECOMPRESS_DAYS', '30'))
+RETENTION_WEBP_QUALITY = int(os.getenv('RETENTION_WEBP_QUALITY', '85'))
+UPLOADS_QUOTA_MB = int(os.getenv('UPLOADS_QUOTA_MB', '5000'))
+TEMP_USER_RETENTION_HOURS = int(os.getenv('TEMP_USER_RETENTION_HOURS', '1'))
+
+# Work is done in bounded batches with a pause in between to avoid I/O spikes
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', '500'))
+RETENTION_BATCH_PAUSE = float(os.getenv('RETENTION_BATCH_PAUSE', '1.0'))  # seconds
+RETENTION_MAX_BATCHES = int(os.getenv('RETENTION_MAX_BATCHES', '20'))  # per task per run
+
+# Scheduled maintenance in the server process; off unless the operator opts in, since it archives
+# records and deletes files
+MAINTENANCE_ENABLED = os.getenv('MAINTENANCE_ENABLED', 'false').lower() == 'true'
+MAINTENANCE_INTERVAL_MINUTES = int(os.getenv('MAINTENANCE_INTERVAL_MINUTES', '60'))
+
+MAINTENANCE_LEASE_SECONDS = 3600
+RECOMPRESSIBLE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+# Newer uploads may belong to a prediction the write-behind writer has not stored yet
+UPLOAD_GRACE_SECONDS = 3600
+# Prediction jobs that will still read their upload (see routes/job_routes.py)
+PENDING_JOB_STATUSES = ('queued', 'running')
+
+
+def acquire_lease(db, name, seconds=MAINTENANCE_LEASE_SECONDS):
+    """
+    Take a named lease so only one worker process runs maintenance at a time
+
+    Returns:
+        bool: True if this process now holds the lease
+    """
+    now = datetime.datetime.utcnow()
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    try:
+        db['maintenance_leases'].find_one_and_update(
+            {"_id": name, "$or": [{"expires": {"$lt": now}}, {"owner": owner}]},
+            {"$set": {"owner": owner, "expires": now + datetime.timedelta(seconds=seconds)}},
+            upsert=True
+        )
+        return True
+    except pymongo.errors.DuplicateKeyError:
+        # Someone else holds an unexpired lease (the upsert collided with their document)
+        return False
+
+
+def release_lease(db, name):
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    db['maintenance_leases'].delete_one({"_id": name, "owner": owner})
+
+
+def cleanup_temp_users(db, hours=TEMP_USER_RETENTION_HOURS):
+    """
+    Clean up temporary users that are older than specified hours
+
+    Returns:
+        int: Number of temporary users removed
+    """
+    expiry_time = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
+    result = db['temp_users'].delete_many({"created": {"$lt": expiry_time}})
+    if result.deleted_count:
+        logger.info(f"Deleted {result.deleted_count} expired temporary users")
+    return result.deleted_count
+
+
+def archive_anonymous_predictions(db, days=RETENTION_ANONYMOUS_DAYS, batch_size=RETENTION_BATCH_SIZE,
+                                  max_batches=RETENTION_MAX_BATCHES, archive_dir=ARCHIVE_DIR):
+    """
+    Move anonymous predictions older than `days` into gzip NDJSON archive files
+
+    Each batch is written (and fsynced) to its own archive file before the
+    documents are deleted, so a crash can at worst leave a record both
+    archived and still in the collection, never lost.
+
+    Returns:
+        int: Number of predictions archived
+    """
+    predictions_collection = db['predictions']
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+    os.makedirs(archive_dir, exist_ok=True)
+
+    archived = 0
+    for batch_number in range(max_batches):
+        batch = list(predictions_collection.find(
+            {"userId": None, "timestamp": {"$lt": cutoff}}
+        ).sort("timestamp", pymongo.ASCENDING).limit(batch_size))
+        if not batch:
+            break
+
+        stamp = datetime.datetime.utcnow().strftime('%Y%m%d_%H%M%S_%f')
+        archive_path = os.path.join(archive_dir, f"anonymous_predictions_{stamp}.ndjson.gz")
+        with gzip.open(archive_path, 'wt', encoding='utf-8') as f:
+            for prediction in batch:
+                f.write(json_util.dumps(prediction) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+        predictions_collection.delete_many({"_id": {"$in": [prediction["_id"] for prediction in batch]}})
+        for prediction in batch:
+            remove_overlay(prediction.get("saliency"))
+        archived += len(batch)
+        logger.info(f"Archived {len(batch)} anonymous predictions", extra={"fields": {"archive": archive_path}})
+
+        if len(batch) < batch_size:
+            break
+        time.sleep(RETENTION_BATCH_PAUSE)
+    return archived
+
+
+def _upload_files(upload_dir):
+    """Top-level files of a directory (uploads or overlays) with their stats"""
+    entries = []
+    if not os.path.isdir(upload_dir):
+        return entries
+    for entry in os.scandir(upload_dir):
+        if entry.is_file() and not entry.name.startswith('.'):
+            entries.append((entry.name, entry.stat()))
+    return entries
+
+
+def remove_if_untouched(path, mtime):
+    """
+    Remove an upload unless it was reused since it was listed with `mtime`
+
+    store_upload refreshes the mtime of a file it reuses for a new
+    prediction. The file is renamed aside before that is checked, so a
+    concurrent reuse either happened first (and the file is put back) or
+    finds no file and writes it again.
+
+    Returns:
+        bool: True if the file was removed
+    """
+    directory, name = os.path.split(path)
+    aside = os.path.join(directory, f".{name}.{uuid.uuid4().hex}.removing")
+    try:
+        os.rename(path, aside)
+    except FileNotFoundError:
+        return False
+    if os.stat(aside).st_mtime != mtime:
+        # Any file written there since has the same content
+        os.replace(aside, path)
+        return False
+    os.remove(aside)
+    return True
+
+
+def ensure_retention_indexes(db):
+    """Indexes for finding the predictions that reference an upload"""
+    db['predictions'].create_index([("image", pymongo.ASCENDING), ("ext", pymongo.ASCENDING)], sparse=True)
+    db['predictions'].create_index("imageName", sparse=True)
+
+
+def _quota_deletable(db, name):
+    """
+    Whether the quota may delete an upload: no pending job reads it and no
+    signed-in user's prediction (including study slices) refers to it, so
+    only anonymous or archived predictions lose their image
+    """
+    if db['prediction_jobs'].find_one(
+        {"status": {"$in": list(PENDING_JOB_STATUSES)}, "imageName": name}, {"_id": 1}
+    ):
+        return False
+    owned = {"$and": [image_filter(name), {"$or": [{"userId": {"$ne": None}}, {"studyId": {"$exists": True}}]}]}
+    return db['predictions'].find_one(owned, {"_id": 1}) is None
+
+
+def recompress_aged_uploads(db, days=RETENTION_RECOMPRESS_DAYS, quality=RETENTION_WEBP_QUALITY,
+                            batch_size=RETENTION_BATCH_SIZE, max_batches=RETENTION_MAX_BATCHES,
+                            upload_dir=UPLOAD_DIR):
+    """
+    Re-encode JPG/PNG uploads older than `days` as WebP when that saves space
+
+    Prediction documents are repointed at the new file before the original is removed.
+
+    Returns:
+        int: Number of images recompressed
+    """
+    if not features.check('webp'):
+        logger.warning("Pillow was built without WebP support; skipping upload recompression")
+        return 0
+
+    predictions_collection = db['predictions']
+    cutoff = time.time() - days * 86400
+    candidates = sorted(
+        (stat.st_mtime, name, stat.st_size) for name, stat in _upload_files(upload_dir)
+        if name.lower().endswith(RECOMPRESSIBLE_EXTENSIONS) and stat.st_mtime < cutoff
+    )
+
+    recompressed = 0
+    for index, (mtime, name, size) in enumerate(candidates[:batch_size * max_batches]):
+        if index and index % batch_size == 0:
+            time.sleep(RETENTION_BATCH_PAUSE)
+
+        source_path = os.path.join(upload_dir, name)
+        webp_name = os.path.splitext(name)[0] + '.webp'
+        webp_path = os.path.join(upload_dir, webp_name)
+        # An existing WebP is this image, recompressed before the original was uploaded again
+        if not os.path.exists(webp_path):
+            try:
+                with Image.open(source_path) as img:
+                    img.save(webp_path, format='WEBP', quality=quality, method=4)
+            except Exception as e:
+                logger.warning(f"Could not recompress {name}: {str(e)}")
+                if os.path.exists(webp_path):
+                    os.remove(webp_path)
+                continue
+
+            if os.path.getsize(webp_path) >= size:
+                os.remove(webp_path)
+                continue
+
+        for query, update in rename_image_updates(name, webp_name):
+            predictions_collection.update_many(query, update)
+        # A prediction that reused the original meanwhile keeps it (and is repointed on a later run)
+        if remove_if_untouched(source_path, mtime):
+            recompressed += 1
+
+    if recompressed:
+        # Cached prediction pages still carry the old image names
+        response_cache.clear()
+        logger.info(f"Recompressed {recompressed} aged uploads to WebP")
+    return recompressed
+
+
+def enforce_upload_quota(db, quota_mb=UPLOADS_QUOTA_MB, batch_size=RETENTION_BATCH_SIZE,
+                         max_batches=RETENTION_MAX_BATCHES, upload_dir=UPLOAD_DIR, saliency_dir=SALIENCY_DIR):
+    """
+    Delete the oldest files until uploads and saliency overlays are under quota
+
+    Overlays can be generated again, so they go first; their predictions
+    drop the saliency field. Then only uploads that no signed-in user's
+    prediction and no pending job refers to are deleted (see
+    _quota_deletable); predictions whose image was removed are flagged
+    with imagePurged.
+
+    Returns:
+        int: Number of files deleted
+    """
+    predictions_collection = db['predictions']
+    quota_bytes = quota_mb * 1024 * 1024
+    overlays = sorted((stat.st_mtime, name, stat.st_size) for name, stat in _upload_files(saliency_dir))
+    uploads = sorted((stat.st_mtime, name, stat.st_size) for name, stat in _upload_files(upload_dir))
+    files = [(saliency_dir, mtime, name, size) for mtime, name, size in overlays]
+    files += [(upload_dir, mtime, name, size) for mtime, name, size in uploads]
+    total = sum(size for _, _, _, size in files)
+    if total <= quota_bytes:
+        return 0
+
+    grace_cutoff = time.time() - UPLOAD_GRACE_SECONDS
+    deleted = 0
+    for directory, mtime, name, size in files:
+        if total <= quota_bytes or deleted >= batch_size * max_batches:
+            break
+        if directory == saliency_dir:
+            os.remove(os.path.join(directory, name))
+            predictions_collection.update_many({"saliency.imageName": name}, {"$unset": {"saliency": ""}})
+        else:
+            if mtime >= grace_cutoff or not _quota_deletable(db, name):
+                continue
+            if not remove_if_untouched(os.path.join(directory, name), mtime):
+                continue
+            predictions_collection.update_many(image_filter(name), {"$set": {"imagePurged": True}})
+        total -= size
+        deleted += 1
+        if deleted % batch_size == 0:
+            time.sleep(RETENTION_BATCH_PAUSE)
+
+    if total > quota_bytes:
+        logger.warning(f"Uploads stay over the {quota_mb} MB quota: the rest belong to signed-in users or pending jobs")
+    if deleted:
+        logger.info(f"Deleted {deleted} files to stay under the {quota_mb} MB quota")
+    return deleted
+
+
+TASKS = {
+    "temp_users": cleanup_temp_users,
+    "archive_anonymous": archive_anonymous_predictions,
+    "recompress_uploads": recompress_aged_uploads,
+    "upload_quota": enforce_upload_quota,
+}
+
+
+def run_maintenance(db, tasks=None):
+    """
+    Run the retention tasks once, holding a lease so workers don't overlap
+
+    Returns:
+        dict: {task name: count} or None if another process holds the lease
+    """
+    if not acquire_lease(db, 'retention'):
+        logger.info("Maintenance already running in another process, skipping")
+        return None
+    results = {}
+    try:
+        ensure_retention_indexes(db)
+        for name in tasks or TASKS:
+            try:
+                results[name] = TASKS[name](db)
+            except Exception as e:
+                logger.exception(f"Maintenance task {name} failed: {str(e)}")
+                results[name] = None
+    finally:
+        release_lease(db, 'retention')
+    return results
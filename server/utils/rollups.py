@@ -0,0 +1,157 @@
+import os
+import atexit
+import datetime
+import threading
+import time
+import pymongo
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+from utils.logger import get_logger
+
+load_dotenv()
+
+logger = get_logger(__name__)
+
+ROLLUP_FLUSH_INTERVAL = float(os.getenv('ROLLUP_FLUSH_INTERVAL', '5'))  # seconds
+ROLLUPS_COLLECTION = 'usage_rollups'
+
+HOUR = 'hour'
+DAY = 'day'
+GRANULARITIES = (HOUR, DAY)
+
+# Counters kept per bucket
+COUNTERS = (
+    'predictions',
+    'tumorPredictions',
+    'noTumorPredictions',
+    'anonymousPredictions',
+    'authenticatedPredictions',
+    'visitors',
+    'signups'
+)
+
+
+def bucket_start(timestamp, granularity):
+    if granularity == HOUR:
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def bucket_id(start, granularity):
+    return f"{granularity}:{start.strftime('%Y-%m-%dT%H' if granularity == HOUR else '%Y-%m-%d')}"
+
+
+def prediction_counters(result, anonymous):
+    """Counters to increment for one stored prediction"""
+    return {
+        'predictions': 1,
+        'tumorPredictions' if result == 'Tumor' else 'noTumorPredictions': 1,
+        'anonymousPredictions' if anonymous else 'authenticatedPredictions': 1
+    }
+
+
+class RollupWriter:
+    """
+    Buffers counter increments in memory and flushes them as hourly and daily buckets
+
+    Requests only touch a dict under a lock; a background thread turns the
+    accumulated increments into one bulk upsert per flush interval, so even
+    high-volume events (visitors) add no database round-trip to the request.
+    Counts buffered at the moment of a crash are lost; everything else is
+    flushed on shutdown.
+    """
+
+    def __init__(self, collection, flush_interval=ROLLUP_FLUSH_INTERVAL):
+        self.collection = collection
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._indexes_ready = False
+
+    def record(self, counters, timestamp=None):
+        timestamp = timestamp or datetime.datetime.utcnow()
+        with self._lock:
+            for granularity in GRANULARITIES:
+                key = (granularity, bucket_start(timestamp, granularity))
+                bucket = self._pending.setdefault(key, {})
+                for name, amount in counters.items():
+                    bucket[name] = bucket.get(name, 0) + amount
+        self._start()
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='rollup-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception(f"Error flushing usage rollups: {str(e)}")
+
+    def ensure_indexes(self):
+        if not self._indexes_ready:
+            self.collection.create_index([("granularity", pymongo.ASCENDING), ("bucket", pymongo.ASCENDING)])
+            self._indexes_ready = True
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        operations = [
+            UpdateOne(
+                {"_id": bucket_id(start, granularity)},
+                {
+                    "$inc": {f"counts.{name}": amount for name, amount in counters.items()},
+                    "$setOnInsert": {"granularity": granularity, "bucket": start}
+                },
+                upsert=True
+            )
+            for (granularity, start), counters in pending.items()
+        ]
+        try:
+            self.ensure_indexes()
+            self.collection.bulk_write(operations, ordered=False)
+        except Exception:
+            # Put the increments back so the next flush retries them
+            with self._lock:
+                for key, counters in pending.items():
+                    bucket = self._pending.setdefault(key, {})
+                    for name, amount in counters.items():
+                        bucket[name] = bucket.get(name, 0) + amount
+            raise
+        return len(operations)
+
+
+def rollup_query(granularity, start, end):
+    """Filter and projection for the buckets overlapping [start, end) of one granularity"""
+    return (
+        {"granularity": granularity, "bucket": {"$gte": bucket_start(start, granularity), "$lt": end}},
+        {"_id": 0, "bucket": 1, "counts": 1}
+    )
+
+
+def format_rollup(document):
+    return {
+        "bucket": document["bucket"].isoformat(),
+        **{name: document.get("counts", {}).get(name, 0) for name in COUNTERS}
+    }
+
+
+def query_rollups(collection, granularity, start, end):
+    """Return buckets overlapping [start, end) for one granularity, oldest first"""
+    cursor = collection.find(*rollup_query(granularity, start, end)).sort("bucket", pymongo.ASCENDING)
+    return [format_rollup(document) for document in cursor]
+
+
+_mongo_client = pymongo.MongoClient(os.getenv('MONGO_URI', 'mongodb://localhost:27017'))
+rollup_writer = RollupWriter(_mongo_client['brain_tumor_detection'][ROLLUPS_COLLECTION])
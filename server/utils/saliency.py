@@ -0,0 +1,241 @@
+import os
+import time
+import shutil
+import secrets
+import datetime
+import numpy as np
+from PIL import Image
+from dotenv import load_dotenv
+from utils.logger import get_logger
+from utils.job_queue import BackgroundWorkerPool
+from utils.admission import Overloaded
+from utils.prediction_schema import stored_image_name
+
+load_dotenv()
+
+logger = get_logger(__name__)
+
+SALIENCY_WORKERS = int(os.getenv('SALIENCY_WORKERS', '1'))
+SALIENCY_QUEUE = int(os.getenv('SALIENCY_QUEUE', '50'))
+# Admission attempts while inference is busy before the request is dropped (a later view asks again)
+SALIENCY_MAX_ATTEMPTS = int(os.getenv('SALIENCY_MAX_ATTEMPTS', '5'))
+SALIENCY_STALE_SECONDS = 600  # a pending map not finished in this long is assumed lost
+# Overlays show the patient's scan, so they are kept out of the public uploads directory and
+# only served by the dashboard route, which checks the prediction's owner
+SALIENCY_DIR = os.getenv('SALIENCY_DIR', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'saliency'))
+# Where overlays used to be written, under uploads/
+LEGACY_SALIENCY_SUBDIR = 'saliency'
+OVERLAY_ALPHA = 0.45
+
+PENDING = 'pending'
+READY = 'ready'
+FAILED = 'failed'
+
+
+def _split_model(model):
+    """
+    Split a model at its last spatial (4D) output
+
+    Returns:
+        tuple: (feature_model, head_layers) where applying head_layers in order
+        to the feature map reproduces the model output
+    """
+    import tensorflow as tf
+
+    for index in reversed(range(len(model.layers))):
+        layer = model.layers[index]
+        if len(layer.output.shape) == 4:
+            feature_model = tf.keras.Model(model.inputs, layer.output)
+            return feature_model, model.layers[index + 1:]
+    raise ValueError("Model has no convolutional feature map to explain")
+
+
+def compute_gradcam(model, processed_img):
+    """
+    Grad-CAM heatmap for a single preprocessed image
+
+    The explained score is the predicted class: the model outputs the
+    "No Tumor" probability, so for a Tumor prediction we explain 1 - output.
+
+    Returns:
+        ndarray: (h, w) heatmap scaled to [0, 1] at feature-map resolution
+    """
+    import tensorflow as tf
+
+    feature_model, head_layers = _split_model(model)
+    inputs = tf.convert_to_tensor(processed_img, dtype=tf.float32)
+    with tf.GradientTape() as tape:
+        features = feature_model(inputs, training=False)
+        tape.watch(features)
+        output = features
+        for layer in head_layers:
+            output = layer(output, training=False)
+        score = output[:, 0]
+        target = tf.where(score < 0.5, 1.0 - score, score)
+
+    gradients = tape.gradient(target, features)
+    channel_weights = tf.reduce_mean(gradients, axis=(1, 2))
+    heatmap = tf.nn.relu(tf.reduce_sum(features * channel_weights[:, tf.newaxis, tf.newaxis, :], axis=-1))[0]
+    heatmap = heatmap.numpy()
+    peak = heatmap.max()
+    return heatmap / peak if peak > 0 else heatmap
+
+
+def _jet_colormap(values):
+    """Map [0, 1] values to RGB with a jet-like colormap"""
+    r = np.clip(1.5 - np.abs(4 * values - 3), 0, 1)
+    g = np.clip(1.5 - np.abs(4 * values - 2), 0, 1)
+    b = np.clip(1.5 - np.abs(4 * values - 1), 0, 1)
+    return (np.stack([r, g, b], axis=-1) * 255).astype(np.uint8)
+
+
+def render_overlay(image_path, heatmap, output_path):
+    """Blend a heatmap over the original upload and save it as PNG"""
+    with Image.open(image_path) as original:
+        original = original.convert('RGB')
+        heatmap_img = Image.fromarray((heatmap * 255).astype(np.uint8)).resize(original.size, Image.BILINEAR)
+        colored = Image.fromarray(_jet_colormap(np.asarray(heatmap_img, dtype=np.float32) / 255.0))
+        overlay = Image.blend(original, colored, OVERLAY_ALPHA)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    overlay.save(output_path, format='PNG')
+
+
+def saliency_filename():
+    """Random file name for a new overlay; it is never sent to clients"""
+    return f"{secrets.token_hex(16)}.png"
+
+
+def saliency_path(filename):
+    """Absolute path of an overlay in SALIENCY_DIR"""
+    return os.path.join(SALIENCY_DIR, os.path.basename(filename))
+
+
+def remove_overlay(saliency):
+    """Delete the overlay file of a prediction's saliency field, if it has one"""
+    filename = (saliency or {}).get("imageName")
+    if not filename:
+        return False
+    try:
+        os.remove(saliency_path(filename))
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def _generate_saliency(prediction_id):
+    # Imported lazily so the dashboard does not pull in TensorFlow at import time
+    from routes.predict_routes import (
+        predictions_collection, load_prediction_model, preprocess_image, upload_path
+    )
+    from utils.inference_scheduler import inference_scheduler, BATCH
+
+    prediction = predictions_collection.find_one({"_id": prediction_id}, {"image": 1, "ext": 1, "imageName": 1, "userId": 1})
+    if not prediction:
+        return
+    try:
+        image_path = upload_path(stored_image_name(prediction))
+        attempt = 0
+        while True:
+            try:
+                with inference_scheduler.slot(BATCH, str(prediction.get("userId"))):
+                    with open(image_path, 'rb') as f:
+                        processed_img = preprocess_image(f)
+                    heatmap = compute_gradcam(load_prediction_model(), processed_img)
+                break
+            except Overloaded as e:
+                # Busy is not a failure: back off, and past the cap release the claim for a later view
+                attempt += 1
+                if attempt >= SALIENCY_MAX_ATTEMPTS:
+                    logger.warning(f"Saliency map for prediction {prediction_id} dropped, inference busy")
+                    predictions_collection.update_one(
+                        {"_id": prediction_id, "saliency.status": PENDING}, {"$unset": {"saliency": ""}}
+                    )
+                    return
+                time.sleep(e.retry_after * 2 ** (attempt - 1))
+
+        filename = saliency_filename()
+        render_overlay(image_path, heatmap, saliency_path(filename))
+        predictions_collection.update_one({"_id": prediction_id}, {"$set": {
+            "saliency.status": READY,
+            "saliency.imageName": filename,
+            "saliency.created": datetime.datetime.utcnow()
+        }})
+    except Exception as e:
+        logger.exception(f"Saliency map for prediction {prediction_id} failed: {str(e)}")
+        predictions_collection.update_one({"_id": prediction_id}, {"$set": {"saliency.status": FAILED}})
+
+
+saliency_workers = BackgroundWorkerPool('saliency', _generate_saliency, SALIENCY_WORKERS, SALIENCY_QUEUE)
+
+
+def recover_pending_saliency(predictions_collection):
+    """Release saliency claims left pending by a restart, so the next view schedules them again"""
+    predictions_collection.create_index("saliency.status", sparse=True)
+    stale_time = datetime.datetime.utcnow() - datetime.timedelta(seconds=SALIENCY_STALE_SECONDS)
+    released = predictions_collection.update_many(
+        {"saliency.status": PENDING, "saliency.requested": {"$lt": stale_time}},
+        {"$unset": {"saliency": ""}}
+    ).modified_count
+    if released:
+        logger.info(f"Released {released} stale saliency requests")
+    return released
+
+
+def move_public_overlays(predictions_collection, upload_dir):
+    """
+    Move overlays written under uploads/saliency (publicly served, named by
+    prediction id) into SALIENCY_DIR under random names
+
+    Returns:
+        int: Number of overlays moved
+    """
+    legacy_dir = os.path.join(upload_dir, LEGACY_SALIENCY_SUBDIR)
+    if not os.path.isdir(legacy_dir):
+        return 0
+    moved = 0
+    os.makedirs(SALIENCY_DIR, exist_ok=True)
+    for prediction in predictions_collection.find(
+        {"saliency.imageName": {"$regex": f"^{LEGACY_SALIENCY_SUBDIR}/"}}, {"saliency.imageName": 1}
+    ):
+        source_path = os.path.join(upload_dir, prediction["saliency"]["imageName"])
+        if not os.path.exists(source_path):
+            predictions_collection.update_one({"_id": prediction["_id"]}, {"$unset": {"saliency": ""}})
+            continue
+        filename = saliency_filename()
+        shutil.move(source_path, saliency_path(filename))
+        predictions_collection.update_one({"_id": prediction["_id"]}, {"$set": {"saliency.imageName": filename}})
+        moved += 1
+    # Anything left there belongs to no prediction
+    shutil.rmtree(legacy_dir, ignore_errors=True)
+    if moved:
+        logger.info(f"Moved {moved} saliency overlays out of the public uploads directory")
+    return moved
+
+
+def request_saliency(predictions_collection, prediction):
+    """
+    Return the saliency state of a prediction, scheduling generation on first request
+
+    Only the caller that flips the status from missing (or stale pending) to
+    pending enqueues the work, so Grad-CAM runs at most once per prediction.
+
+    Returns:
+        dict: {"status": "pending" | "ready" | "failed", "imageName": ...}
+    """
+    saliency = prediction.get("saliency")
+    stale_time = datetime.datetime.utcnow() - datetime.timedelta(seconds=SALIENCY_STALE_SECONDS)
+    stale = saliency and saliency.get("status") == PENDING and saliency.get("requested", stale_time) < stale_time
+    if saliency and not stale:
+        return saliency
+
+    claimed = predictions_collection.update_one(
+        {"_id": prediction["_id"], "$or": [
+            {"saliency": {"$exists": False}},
+            {"saliency.status": PENDING, "saliency.requested": {"$lt": stale_time}}
+        ]},
+        {"$set": {"saliency": {"status": PENDING, "requested": datetime.datetime.utcnow()}}}
+    )
+    if claimed.modified_count == 1 and not saliency_workers.submit(prediction["_id"]):
+        # Queue is full: release the claim so a later view can try again
+        predictions_collection.update_one({"_id": prediction["_id"]}, {"$unset": {"saliency": ""}})
+    return {"status": PENDING}
@@ -0,0 +1,121 @@
+import os
+import threading
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Cascade settings
+CASCADE_ENABLED = os.getenv('CASCADE_ENABLED', 'false').lower() == 'true'
+SCREENING_MODEL_PATH = os.getenv(
+    'SCREENING_MODEL_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'model', 'screening_model.npz')
+)
+# The screener decides alone only when its score is outside [lower, upper]; inside the band we escalate to VGG19
+CASCADE_LOWER = float(os.getenv('CASCADE_LOWER', '0.1'))
+CASCADE_UPPER = float(os.getenv('CASCADE_UPPER', '0.9'))
+
+# Block-mean downsampling factor applied to the 240x240 preprocessed image
+POOL_FACTOR = 10
+HISTOGRAM_BINS = 16
+
+_screening_model = None
+_load_lock = threading.Lock()
+
+
+def extract_features(processed_imgs):
+    """
+    Cheap handcrafted features from preprocessed images
+
+    Args:
+        processed_imgs (ndarray): Batch of shape (n, 240, 240, 3) scaled to [0, 1]
+
+    Returns:
+        ndarray: (n, 24 * 24 + 16) float32 features (pooled grayscale + intensity histogram)
+    """
+    gray = processed_imgs.mean(axis=3)
+    n, height, width = gray.shape
+    pooled = gray[:, :height - height % POOL_FACTOR, :width - width % POOL_FACTOR]
+    pooled = pooled.reshape(n, height // POOL_FACTOR, POOL_FACTOR, width // POOL_FACTOR, POOL_FACTOR).mean(axis=(2, 4))
+    histograms = np.stack([
+        np.histogram(g, bins=HISTOGRAM_BINS, range=(0.0, 1.0))[0] / g.size for g in gray
+    ])
+    return np.concatenate([pooled.reshape(n, -1), histograms], axis=1).astype(np.float32)
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -30, 30)))
+
+
+class ScreeningModel:
+    """
+    Logistic regression over pooled pixels, distilled from VGG19 outputs
+
+    predict() returns a score with the same meaning as the VGG19 sigmoid
+    output (below 0.5 means "Tumor") so the two stages are interchangeable.
+    """
+
+    def __init__(self, weights, bias, mean, std):
+        self.weights = weights.astype(np.float32)
+        self.bias = float(bias)
+        self.mean = mean.astype(np.float32)
+        self.std = std.astype(np.float32)
+
+    def predict(self, processed_imgs):
+        return self.predict_features(extract_features(processed_imgs))
+
+    def predict_features(self, features):
+        """predict() for features already computed with extract_features()"""
+        features = (features - self.mean) / self.std
+        return _sigmoid(features @ self.weights + self.bias)
+
+    @classmethod
+    def distill(cls, processed_imgs, teacher_scores, epochs=300, learning_rate=0.1, l2=1e-3):
+        """
+        Fit the screener to reproduce the teacher's (VGG19) sigmoid outputs
+
+        Uses full-batch gradient descent on binary cross-entropy against the
+        teacher's soft labels.
+        """
+        return cls.fit(extract_features(processed_imgs), teacher_scores, epochs, learning_rate, l2)
+
+    @classmethod
+    def fit(cls, features, teacher_scores, epochs=300, learning_rate=0.1, l2=1e-3):
+        """distill() from features already computed with extract_features()"""
+        mean = features.mean(axis=0)
+        std = features.std(axis=0) + 1e-6
+        x = (features - mean) / std
+        y = np.asarray(teacher_scores, dtype=np.float32).reshape(-1)
+
+        weights = np.zeros(x.shape[1], dtype=np.float32)
+        bias = 0.0
+        for _ in range(epochs):
+            error = _sigmoid(x @ weights + bias) - y
+            weights -= learning_rate * (x.T @ error / len(y) + l2 * weights)
+            bias -= learning_rate * float(error.mean())
+        return cls(weights, bias, mean, std)
+
+    def save(self, path):
+        np.savez(path, weights=self.weights, bias=self.bias, mean=self.mean, std=self.std)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data['weights'], data['bias'], data['mean'], data['std'])
+
+
+def should_escalate(score, lower=CASCADE_LOWER, upper=CASCADE_UPPER):
+    """Return True if a screening score is too uncertain to decide without VGG19"""
+    return lower <= score <= upper
+
+
+def load_screening_model():
+    """Return the screening model, or None when the cascade is disabled or no model is trained"""
+    global _screening_model
+    if not CASCADE_ENABLED:
+        return None
+    if _screening_model is None:
+        with _load_lock:
+            if _screening_model is None and os.path.exists(SCREENING_MODEL_PATH):
+                _screening_model = ScreeningModel.load(SCREENING_MODEL_PATH)
+    return _screening_model
@@ -0,0 +1,68 @@
+import os
+import json
+from dotenv import load_dotenv
+
+# Written by autotune.py; settings are environment variable names and values
+TUNING_PROFILE_PATH = os.getenv(
+    'TUNING_PROFILE_PATH', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'tuning_profile.json')
+)
+
+# Settings a profile may provide
+TUNABLE_SETTINGS = (
+    'TF_INTRA_OP_THREADS',
+    'TF_INTER_OP_THREADS',
+    'INFERENCE_MAX_CONCURRENCY',
+    'STUDY_BATCH_SIZE',
+    'WARMUP_BATCH_SIZES',
+)
+
+
+def load_tuning_profile(path=TUNING_PROFILE_PATH):
+    """Return the profile dict, or None if there is none"""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def apply_tuning_profile(path=TUNING_PROFILE_PATH):
+    """
+    Export the profile's settings as environment variables
+
+    Must run before the modules that read these settings are imported.
+    Values already set in the environment or .env take precedence, so a
+    profile never overrides an explicit setting.
+
+    Returns:
+        dict: the settings that were applied
+    """
+    load_dotenv()
+    profile = load_tuning_profile(path)
+    if not profile:
+        return {}
+    applied = {}
+    for name, value in profile.get('settings', {}).items():
+        if name in TUNABLE_SETTINGS and name not in os.environ:
+            os.environ[name] = str(value)
+            applied[name] = str(value)
+    return applied
+
+
+def configure_tf_threads():
+    """Apply TF_INTRA_OP_THREADS / TF_INTER_OP_THREADS; must run before TensorFlow executes anything"""
+    intra = int(os.getenv('TF_INTRA_OP_THREADS', '0'))
+    inter = int(os.getenv('TF_INTER_OP_THREADS', '0'))
+    if not intra and not inter:
+        return intra, inter
+
+    import tensorflow as tf
+
+    try:
+        if intra:
+            tf.config.threading.set_intra_op_parallelism_threads(intra)
+        if inter:
+            tf.config.threading.set_inter_op_parallelism_threads(inter)
+    except RuntimeError:
+        # The runtime is already initialized (e.g. a second model load); the first setting stays in force
+        pass
+    return intra, inter
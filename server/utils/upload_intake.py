@@ -0,0 +1,151 @@
+import os
+import struct
+from PIL import Image
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Upload limits
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', str(10 * 1024 * 1024)))  # 10 MB
+MAX_IMAGE_PIXELS = int(os.getenv('MAX_IMAGE_PIXELS', str(25_000_000)))  # ~5000 x 5000
+MAX_NAME_LENGTH = 255  # of the original file name kept for display
+HEADER_SNIFF_BYTES = 64 * 1024
+
+ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png'}
+
+# Make PIL refuse decompression bombs too (it only warns below 2x the limit by default)
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+JPEG_SIGNATURE = b'\xff\xd8\xff'
+# JPEG start-of-frame markers carry the image dimensions (C4, C8 and CC are not SOF markers)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class UploadRejected(Exception):
+    """Raised when an upload fails intake validation"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def _png_dimensions(header):
+    # IHDR is always the first chunk: signature(8) + length(4) + type(4) + width(4) + height(4)
+    if len(header) < 24 or header[12:16] != b'IHDR':
+        return None
+    width, height = struct.unpack('>II', header[16:24])
+    return width, height
+
+
+def _jpeg_dimensions(header):
+    offset = 2
+    length = len(header)
+    while offset + 4 <= length:
+        if header[offset] != 0xFF:
+            return None
+        marker = header[offset + 1]
+        # Fill bytes and standalone markers have no length field
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker in (0x01,) or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+        segment_length = struct.unpack('>H', header[offset + 2:offset + 4])[0]
+        if marker in JPEG_SOF_MARKERS:
+            if offset + 9 > length:
+                return None
+            height, width = struct.unpack('>HH', header[offset + 5:offset + 9])
+            return width, height
+        offset += 2 + segment_length
+    return None
+
+
+def sniff_image(header):
+    """
+    Identify an image from its leading bytes
+
+    Args:
+        header (bytes): The first bytes of the upload
+
+    Returns:
+        tuple: (format, (width, height)) where dimensions may be None if they are
+        not within the sniffed header
+    """
+    if header.startswith(PNG_SIGNATURE):
+        return 'PNG', _png_dimensions(header)
+    if header.startswith(JPEG_SIGNATURE):
+        return 'JPEG', _jpeg_dimensions(header)
+    return None, None
+
+
+def check_extension(filename):
+    """Return True if the filename has an allowed image extension"""
+    return bool(filename) and '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def intake_upload(file):
+    """
+    Validate an uploaded image without reading the whole body into memory
+
+    Werkzeug spools uploads to a temporary file, so only the header is read
+    here. The returned stream is rewound and can be handed straight to PIL or
+    copied to disk.
+
+    Args:
+        file (FileStorage): The uploaded file from request.files
+
+    Returns:
+        dict: {"stream", "format", "width", "height", "size", "name"} where
+        name is the client's file name (without any path) to show the user
+
+    Raises:
+        UploadRejected: If the upload is too large, not a JPG/PNG or too many pixels
+    """
+    if not check_extension(file.filename):
+        raise UploadRejected('Invalid file format. Please upload JPG or PNG image')
+
+    stream = file.stream
+
+    # Size check against the spooled stream (MAX_CONTENT_LENGTH bounds the request as a whole)
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    if size == 0:
+        raise UploadRejected('Empty image file')
+    if size > MAX_UPLOAD_BYTES:
+        raise UploadRejected(f'Image exceeds maximum size of {MAX_UPLOAD_BYTES // (1024 * 1024)} MB', 413)
+
+    header = stream.read(HEADER_SNIFF_BYTES)
+    stream.seek(0)
+
+    image_format, dimensions = sniff_image(header)
+    if image_format is None:
+        raise UploadRejected('Invalid file format. Please upload JPG or PNG image')
+
+    if dimensions is None:
+        # Header did not contain the frame size (e.g. very large EXIF block); let PIL read it lazily
+        try:
+            with Image.open(stream) as img:
+                dimensions = img.size
+        except Exception:
+            raise UploadRejected('Invalid or corrupted image file')
+        finally:
+            stream.seek(0)
+
+    width, height = dimensions
+    if width == 0 or height == 0:
+        raise UploadRejected('Invalid or corrupted image file')
+    if width * height > MAX_IMAGE_PIXELS:
+        raise UploadRejected('Image dimensions are too large', 413)
+
+    return {
+        "stream": stream,
+        "format": image_format,
+        "width": width,
+        "height": height,
+        "size": size,
+        "name": os.path.basename(file.filename.replace('\\', '/'))[:MAX_NAME_LENGTH]
+    }
@@ -0,0 +1,202 @@
+import os
+import threading
+import numpy as np
+from dotenv import load_dotenv
+from utils.logger import get_logger
+from utils.embeddings import decode_embedding
+
+load_dotenv()
+
+logger = get_logger(__name__)
+
+# Approximate (inverted file) search for users with very many vectors; exact search otherwise
+VECTOR_IVF_ENABLED = os.getenv('VECTOR_IVF_ENABLED', 'true').lower() == 'true'
+VECTOR_IVF_MIN_VECTORS = int(os.getenv('VECTOR_IVF_MIN_VECTORS', '20000'))
+VECTOR_IVF_NPROBE = int(os.getenv('VECTOR_IVF_NPROBE', '8'))
+
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 20000
+INITIAL_CAPACITY = 64
+
+
+def kmeans(vectors, num_clusters, iterations=KMEANS_ITERATIONS, seed=0):
+    """Spherical k-means on unit vectors; returns (num_clusters, dim) unit centroids"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), num_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        for cluster in range(num_clusters):
+            members = vectors[assignments == cluster]
+            if len(members):
+                centroids[cluster] = members.sum(axis=0)
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+    return centroids
+
+
+class VectorGroup:
+    """
+    Unit vectors of one user and model version
+
+    Vectors live in a float16 matrix grown by doubling. Search is an exact
+    matrix-vector product; once the group is large enough an inverted-file
+    index (k-means partitions) is built in the background and searches only
+    score the VECTOR_IVF_NPROBE partitions closest to the query.
+    """
+
+    def __init__(self):
+        self.ids = []
+        self._id_set = set()
+        self.matrix = np.zeros((0, 0), dtype=np.float16)
+        self.count = 0
+        self.centroids = None
+        self.lists = None
+        self._ivf_size = 0
+        self._building = False
+
+    def add(self, item_id, vector):
+        # The background load re-reads predictions that were added live before it ran
+        if item_id in self._id_set:
+            return False
+        if self.count == 0 and self.matrix.shape[1] != len(vector):
+            self.matrix = np.zeros((INITIAL_CAPACITY, len(vector)), dtype=np.float16)
+        if len(vector) != self.matrix.shape[1]:
+            return False
+        if self.count == len(self.matrix):
+            grown = np.zeros((len(self.matrix) * 2, self.matrix.shape[1]), dtype=np.float16)
+            grown[:self.count] = self.matrix[:self.count]
+            self.matrix = grown
+        self.matrix[self.count] = vector
+        self.ids.append(item_id)
+        self._id_set.add(item_id)
+        if self.centroids is not None:
+            nearest = int(np.argmax(self.centroids @ vector.astype(np.float32)))
+            self.lists[nearest].append(self.count)
+        self.count += 1
+        return True
+
+    def needs_ivf(self):
+        # (Re)build when the group first gets large, then whenever it doubles
+        return (VECTOR_IVF_ENABLED and not self._building and self.count >= VECTOR_IVF_MIN_VECTORS
+                and self.count >= 2 * self._ivf_size)
+
+    def build_ivf(self):
+        count = self.count
+        vectors = self.matrix[:count].astype(np.float32)
+        num_clusters = max(1, int(np.sqrt(count)))
+        rng = np.random.default_rng(0)
+        sample = vectors[rng.choice(count, min(count, KMEANS_SAMPLE), replace=False)]
+        centroids = kmeans(sample, num_clusters)
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        lists = [list(np.flatnonzero(assignments == cluster)) for cluster in range(num_clusters)]
+        return count, centroids, lists
+
+    def snapshot(self):
+        """
+        What a search reads, taken under the index lock
+
+        Rows below count are never written again (growing copies them into a
+        new matrix), so a snapshot can be searched without holding the lock.
+        """
+        return self.count, self.matrix, self.ids, self.centroids, self.lists
+
+    def search(self, query, k, exclude_id=None, snapshot=None):
+        """Return [(item_id, cosine similarity)] for the k nearest vectors, best first"""
+        count, matrix, ids, centroids, lists = snapshot or self.snapshot()
+        if count == 0 or len(query) != matrix.shape[1]:
+            return []
+        query = query.astype(np.float32)
+        if centroids is not None:
+            probe = np.argsort(-(centroids @ query))[:VECTOR_IVF_NPROBE]
+            rows = np.fromiter((row for cluster in probe for row in lists[cluster]), dtype=np.int64)
+            # Partitions may have grown with rows added after the snapshot
+            rows = rows[rows < count]
+        else:
+            rows = np.arange(count)
+        if len(rows) == 0:
+            return []
+        scores = matrix[rows].astype(np.float32) @ query
+        # One extra in case the query itself is among the results
+        take = min(len(rows), k + 1)
+        top = np.argpartition(-scores, take - 1)[:take]
+        top = top[np.argsort(-scores[top])]
+        results = [(ids[rows[i]], float(scores[i])) for i in top if ids[rows[i]] != exclude_id]
+        return results[:k]
+
+
+class VectorIndex:
+    """
+    Process-wide embedding index, partitioned by user and model version
+
+    Searches are scoped to one user's own predictions, so they only ever
+    touch that user's vectors no matter how many are indexed in total.
+    Existing embeddings are loaded from the predictions collection in a
+    background thread on first use; until that finishes lookups may miss.
+    Predictions added live before the load are skipped when it reaches them.
+    """
+
+    def __init__(self):
+        self._groups = {}
+        self._lock = threading.Lock()
+        self._loading = False
+        self.loaded = False
+
+    def ensure_loaded(self, predictions_collection):
+        with self._lock:
+            if self._loading:
+                return
+            self._loading = True
+        threading.Thread(target=self._load, args=(predictions_collection,), daemon=True).start()
+
+    def _load(self, predictions_collection):
+        try:
+            cursor = predictions_collection.find(
+                {"embedding": {"$exists": True}, "userId": {"$ne": None}},
+                {"userId": 1, "modelVersion": 1, "embedding": 1}
+            ).batch_size(5000)
+            loaded = 0
+            for prediction in cursor:
+                self.add(prediction["userId"], prediction.get("modelVersion"), prediction["_id"],
+                         decode_embedding(prediction["embedding"]))
+                loaded += 1
+            self.loaded = True
+            logger.info(f"Loaded {loaded} prediction embeddings")
+        except Exception as e:
+            logger.exception(f"Error loading vector index: {str(e)}")
+            with self._lock:
+                self._loading = False
+
+    def add(self, user_id, model_version, item_id, vector):
+        with self._lock:
+            group = self._groups.setdefault((str(user_id), model_version), VectorGroup())
+            group.add(item_id, np.asarray(vector, dtype=np.float16))
+            build = group.needs_ivf()
+            if build:
+                group._building = True
+        if build:
+            threading.Thread(target=self._build_ivf, args=(group,), daemon=True).start()
+
+    def _build_ivf(self, group):
+        try:
+            size, centroids, lists = group.build_ivf()
+            with self._lock:
+                # Vectors added while building are appended to their nearest partition
+                for row in range(size, group.count):
+                    lists[int(np.argmax(centroids @ group.matrix[row].astype(np.float32)))].append(row)
+                group.centroids, group.lists, group._ivf_size = centroids, lists, size
+            logger.info(f"Built IVF index over {size} vectors", extra={"fields": {"partitions": len(lists)}})
+        except Exception as e:
+            logger.exception(f"Error building IVF index: {str(e)}")
+        finally:
+            group._building = False
+
+    def search(self, user_id, model_version, query, k=5, exclude_id=None):
+        # Only the snapshot is taken under the lock; scoring a large group must not stall other users
+        with self._lock:
+            group = self._groups.get((str(user_id), model_version))
+            if group is None:
+                return []
+            snapshot = group.snapshot()
+        return group.search(np.asarray(query), k, exclude_id, snapshot)
+
+
+vector_index = VectorIndex()
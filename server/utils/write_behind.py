@@ -0,0 +1,396 @@
+"""
+Write-behind persistence for documents that do not need to be on disk before the response
+
+Durability (PREDICTION_WRITE_MODE=write_behind):
+- A record is acknowledged once it is queued in memory. It reaches MongoDB
+  within WRITE_BEHIND_FLUSH_INTERVAL seconds or as soon as
+  WRITE_BEHIND_BATCH_SIZE records are waiting, whichever comes first.
+- If MongoDB is unreachable, records stay buffered (up to
+  WRITE_BEHIND_MAX_BUFFER) and are retried; beyond that they are appended,
+  fsynced, to a local spill file that is replayed once writes succeed
+  again and at the next startup. Worker processes sharing the spill
+  directory coordinate through lock files; an interrupted replay is picked
+  up by the next one, and unreadable lines are set aside in a .corrupt
+  file instead of stopping the replay.
+- A document MongoDB itself rejects (e.g. a validation error) is retried
+  WRITE_BEHIND_MAX_ATTEMPTS times, then moved to a .dead file and logged
+  once; one that cannot be encoded at all goes there straight away.
+- On a clean shutdown (atexit, SIGTERM via app.py, memory recycle) the
+  buffer is flushed, or spilled if the database is down.
+- Only a hard kill (SIGKILL, OOM kill, power loss) can lose records: at most
+  the ones queued since the last flush.
+- Documents get a client-side ObjectId when queued, so callers can use the
+  id immediately and replays are idempotent (duplicates are ignored).
+- Reads may not see a record until it is flushed.
+
+PREDICTION_WRITE_MODE=sync keeps the old behaviour: one insert_one per
+record before responding.
+"""
+import os
+import time
+import atexit
+import shutil
+import threading
+from collections import deque
+from contextlib import contextmanager
+import bson
+import pymongo
+from bson import json_util
+from bson.objectid import ObjectId
+from dotenv import load_dotenv
+from utils.logger import get_logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: spill files are only guarded within one process
+    fcntl = None
+
+load_dotenv()
+
+logger = get_logger(__name__)
+
+SYNC = 'sync'
+WRITE_BEHIND = 'write_behind'
+PREDICTION_WRITE_MODE = os.getenv('PREDICTION_WRITE_MODE', WRITE_BEHIND)
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv('WRITE_BEHIND_BATCH_SIZE', '100'))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL', '0.5'))  # seconds
+WRITE_BEHIND_MAX_BUFFER = int(os.getenv('WRITE_BEHIND_MAX_BUFFER', '10000'))
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv('WRITE_BEHIND_MAX_ATTEMPTS', '5'))  # per rejected document
+WRITE_BEHIND_SPILL_DIR = os.getenv(
+    'WRITE_BEHIND_SPILL_DIR', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'spill')
+)
+
+DUPLICATE_KEY = 11000
+RETRY_BACKOFF_MAX = 30  # seconds
+SHUTDOWN_FLUSH_TIMEOUT = 10  # seconds
+
+
+class _SpillLock:
+    """Exclusive lock between threads and, through flock on a lock file, between worker processes"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def hold(self, blocking=True):
+        """Yields True once held, or False if blocking is off and someone else holds it"""
+        if not self._lock.acquire(blocking):
+            yield False
+            return
+        try:
+            if fcntl is None:
+                yield True
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'a') as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    yield False
+                    return
+                try:
+                    yield True
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        finally:
+            self._lock.release()
+
+
+class WriteBehindWriter:
+    """Queues documents and writes them with insert_many(ordered=False) from a background thread"""
+
+    def __init__(self, collection, name, mode=PREDICTION_WRITE_MODE, batch_size=WRITE_BEHIND_BATCH_SIZE,
+                 flush_interval=WRITE_BEHIND_FLUSH_INTERVAL, max_buffer=WRITE_BEHIND_MAX_BUFFER,
+                 spill_dir=WRITE_BEHIND_SPILL_DIR, on_flushed=None, max_attempts=WRITE_BEHIND_MAX_ATTEMPTS):
+        self.collection = collection
+        self.name = name
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.spill_path = os.path.join(spill_dir, f"{name}.ndjson")
+        self.replaying_path = self.spill_path + '.replaying'
+        self.corrupt_path = self.spill_path + '.corrupt'
+        self.dead_letter_path = self.spill_path + '.dead'
+        self.on_flushed = on_flushed
+        self.max_attempts = max(1, max_attempts)
+        # _id -> times MongoDB rejected the document; cleared once it is written or dead-lettered
+        self._attempts = {}
+        self._buffer = deque()
+        self._condition = threading.Condition()
+        # Appends to the spill file, and the one replay allowed at a time across processes
+        self._spill_lock = _SpillLock(self.spill_path + '.lock')
+        self._replay_lock = _SpillLock(self.spill_path + '.replay.lock')
+        self._thread = None
+        self._stopping = False
+        self._backoff = 0
+        self.stats = {
+            "queued": 0, "flushed": 0, "spilled": 0, "replayed": 0, "failedFlushes": 0, "corruptLines": 0,
+            "deadLettered": 0
+        }
+
+    def submit(self, document):
+        """Persist a document; returns it with its _id set"""
+        document.setdefault("_id", ObjectId())
+        if self.mode == SYNC:
+            self.collection.insert_one(document)
+            return document
+
+        self.start()
+        overflow = []
+        with self._condition:
+            self._buffer.append(document)
+            self.stats["queued"] += 1
+            while len(self._buffer) > self.max_buffer:
+                overflow.append(self._buffer.popleft())
+            if len(self._buffer) >= self.batch_size:
+                self._condition.notify()
+        if overflow:
+            self._spill(overflow)
+        return document
+
+    def start(self):
+        """Start the flusher, which first replays records spilled by an earlier run"""
+        if self.mode == SYNC or self._thread is not None:
+            return
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name=f'write-behind-{self.name}', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _run(self):
+        self._try_replay()
+        while not self._stopping:
+            with self._condition:
+                if len(self._buffer) < self.batch_size:
+                    self._condition.wait(timeout=self.flush_interval + self._backoff)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception(f"Error in write-behind flusher: {str(e)}")
+
+    def _take_batch(self):
+        with self._condition:
+            return [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+
+    def _insert(self, documents):
+        """
+        insert_many that treats already-written documents (duplicate _id) as success
+
+        Returns (retry, dead): the documents MongoDB rejected that are still
+        worth retrying, and the ones given up on. Connection errors are raised
+        to the caller.
+        """
+        try:
+            self.collection.insert_many(documents, ordered=False)
+            rejected = []
+        except bson.errors.InvalidDocument:
+            # One document that cannot be encoded fails the whole call; set it aside and write the rest
+            encodable, dead = [], []
+            for document in documents:
+                try:
+                    bson.encode(document)
+                    encodable.append(document)
+                except bson.errors.InvalidDocument as e:
+                    self._dead_letter([document], str(e))
+                    dead.append(document)
+            if not dead:
+                raise
+            retry, more_dead = self._insert(encodable) if encodable else ([], [])
+            return retry, dead + more_dead
+        except pymongo.errors.BulkWriteError as e:
+            failed_indexes = {
+                error["index"] for error in e.details.get("writeErrors", []) if error.get("code") != DUPLICATE_KEY
+            }
+            rejected = [documents[index] for index in sorted(failed_indexes)]
+        return self._count_attempts(documents, rejected)
+
+    def _count_attempts(self, documents, rejected):
+        """Dead-letter rejected documents that used up their attempts; returns (retry, dead)"""
+        rejected_ids = {document["_id"] for document in rejected}
+        if self._attempts:
+            for document in documents:
+                if document["_id"] not in rejected_ids:
+                    self._attempts.pop(document["_id"], None)
+        retry, dead = [], []
+        for document in rejected:
+            attempts = self._attempts.get(document["_id"], 0) + 1
+            if attempts >= self.max_attempts:
+                self._attempts.pop(document["_id"], None)
+                dead.append(document)
+            else:
+                self._attempts[document["_id"]] = attempts
+                retry.append(document)
+        if dead:
+            self._dead_letter(dead, f"rejected {self.max_attempts} times")
+        return retry, dead
+
+    def _dead_letter(self, documents, reason):
+        """Set aside documents that will never be written, instead of retrying them on every flush"""
+        with self._spill_lock.hold():
+            os.makedirs(os.path.dirname(self.dead_letter_path), exist_ok=True)
+            with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+                for document in documents:
+                    try:
+                        f.write(json_util.dumps(document) + '\n')
+                    except Exception:
+                        f.write(json_util.dumps({"_id": document.get("_id"), "unencodable": repr(document)}) + '\n')
+        self.stats["deadLettered"] += len(documents)
+        logger.error(f"Gave up on {len(documents)} {self.name} records: {reason}", extra={"fields": {
+            "path": self.dead_letter_path, "ids": [str(document.get("_id")) for document in documents]
+        }})
+
+    def flush(self):
+        """Write everything buffered right now; returns the number of documents written"""
+        written = 0
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                break
+            dead = []
+            try:
+                failed, dead = self._insert(batch)
+            except pymongo.errors.PyMongoError as e:
+                failed = batch
+                logger.warning(f"Write-behind flush for {self.name} failed, will retry: {str(e)}")
+            unwritten = {document["_id"] for document in failed + dead}
+            done = [document for document in batch if document["_id"] not in unwritten]
+            if done:
+                written += len(done)
+                self.stats["flushed"] += len(done)
+                if self.on_flushed:
+                    try:
+                        self.on_flushed(done)
+                    except Exception as e:
+                        logger.exception(f"Error in write-behind callback: {str(e)}")
+            if failed:
+                self.stats["failedFlushes"] += 1
+                self._requeue(failed)
+                self._backoff = min(RETRY_BACKOFF_MAX, max(1, self._backoff * 2))
+                break
+            self._backoff = 0
+        if written and (os.path.exists(self.spill_path) or os.path.exists(self.replaying_path)):
+            # The database is reachable again; bring spilled documents back
+            self._try_replay()
+        return written
+
+    def _requeue(self, documents):
+        overflow = []
+        with self._condition:
+            self._buffer.extendleft(reversed(documents))
+            while len(self._buffer) > self.max_buffer:
+                overflow.append(self._buffer.pop())
+        if overflow:
+            self._spill(overflow)
+
+    def _spill(self, documents):
+        """Append documents to the local spill file so a long outage cannot exhaust memory"""
+        with self._spill_lock.hold():
+            os.makedirs(os.path.dirname(self.spill_path), exist_ok=True)
+            with open(self.spill_path, 'a', encoding='utf-8') as f:
+                for document in documents:
+                    f.write(json_util.dumps(document) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        self.stats["spilled"] += len(documents)
+        logger.warning(f"Spilled {len(documents)} {self.name} records to disk", extra={"fields": {"path": self.spill_path}})
+
+    def _try_replay(self):
+        try:
+            self._replay_spill()
+        except Exception as e:
+            logger.exception(f"Error replaying spilled {self.name} records: {str(e)}")
+
+    def _claim_spill(self):
+        """Move the spill file to the replaying file, adding to one an interrupted replay left behind"""
+        with self._spill_lock.hold():
+            if not os.path.exists(self.spill_path):
+                return
+            if not os.path.exists(self.replaying_path):
+                os.replace(self.spill_path, self.replaying_path)
+                return
+            with open(self.replaying_path, 'ab+') as dst:
+                # A crash mid-write can leave the last line without its newline
+                if dst.tell():
+                    dst.seek(-1, os.SEEK_END)
+                    if dst.read(1) != b'\n':
+                        dst.write(b'\n')
+                with open(self.spill_path, 'rb') as src:
+                    shutil.copyfileobj(src, dst)
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.remove(self.spill_path)
+
+    def _read_spill(self, path):
+        """Parse a spill file, setting aside lines that are not valid documents"""
+        documents, corrupt = [], []
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    documents.append(json_util.loads(line))
+                except Exception:
+                    corrupt.append(line if line.endswith('\n') else line + '\n')
+        if corrupt:
+            with open(self.corrupt_path, 'a', encoding='utf-8') as f:
+                f.writelines(corrupt)
+            self.stats["corruptLines"] += len(corrupt)
+            logger.error(f"Skipped {len(corrupt)} unreadable spilled {self.name} records",
+                         extra={"fields": {"path": self.corrupt_path}})
+        return documents
+
+    def _replay_spill(self):
+        """Insert spilled documents; anything that still fails goes back to the spill file"""
+        with self._replay_lock.hold(blocking=False) as acquired:
+            if not acquired:
+                # Another thread or worker process is replaying
+                return 0
+            self._claim_spill()
+            if not os.path.exists(self.replaying_path):
+                return 0
+            documents = self._read_spill(self.replaying_path)
+            replayed = 0
+            for start in range(0, len(documents), self.batch_size):
+                chunk = documents[start:start + self.batch_size]
+                dead = []
+                try:
+                    failed, dead = self._insert(chunk)
+                except pymongo.errors.PyMongoError:
+                    failed = documents[start:]
+                if failed:
+                    self._spill(failed)
+                    if len(failed) == len(documents[start:]):
+                        break
+                replayed += len(chunk) - len(failed) - len(dead)
+            os.remove(self.replaying_path)
+        self.stats["replayed"] += replayed
+        if replayed:
+            logger.info(f"Replayed {replayed} spilled {self.name} records")
+        return replayed
+
+    def close(self, timeout=SHUTDOWN_FLUSH_TIMEOUT):
+        """Flush on shutdown; whatever cannot be written in time is spilled"""
+        self._stopping = True
+        with self._condition:
+            self._condition.notify_all()
+        deadline = time.monotonic() + timeout
+        while self._buffer and time.monotonic() < deadline:
+            if not self.flush():
+                break
+        with self._condition:
+            remaining = list(self._buffer)
+            self._buffer.clear()
+        if remaining:
+            self._spill(remaining)
+
+    def status(self):
+        return {
+            "mode": self.mode,
+            "buffered": len(self._buffer),
+            "spillPending": os.path.exists(self.spill_path) or os.path.exists(self.replaying_path),
+            **self.stats
+        }